@@ -129,6 +129,9 @@ trans_tejani2dou = {
 # inout.save_ply(p_out, m['pts'], m['colors'], faces=m['faces'])
 # exit(-1)
 
+# The images are saved in the background
+im_writer = inout.AsyncImageWriter()
+
 for scene_id in sorted(scenes.keys()):
     scene_info = {}
     scene_gt = {}
@@ -166,8 +169,8 @@ for scene_id in sorted(scenes.keys()):
         #depth *= 10.0  # Convert depth map to [100um]
 
         # Save the RGB and depth image
-        inout.save_im(rgb_out_mpath.format(scene_id, im_id_out), rgb)
-        inout.save_depth(depth_out_mpath.format(scene_id, im_id_out), depth)
+        im_writer.save_im(rgb_out_mpath.format(scene_id, im_id_out), rgb)
+        im_writer.save_depth(depth_out_mpath.format(scene_id, im_id_out), depth)
 
         # Load the camera pose
         cam_R, cam_t = load_doumanoglou_pose(cam_pose_mpath.format(scene_id, im_id), False)
@@ -223,3 +226,5 @@ for scene_id in sorted(scenes.keys()):
 
     inout.save_info(scene_info_mpath.format(scene_id), scene_info)
     inout.save_gt(scene_gt_mpath.format(scene_id), scene_gt)
+
+im_writer.close()
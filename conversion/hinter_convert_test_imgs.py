@@ -68,6 +68,9 @@ def load_hinter_mat(path):
 with open(bbox_cens_path, 'r') as f:
     bbox_cens = np.array(yaml.load(f))
 
+# The images are saved in the background
+im_writer = inout.AsyncImageWriter()
+
 for scene_id in scene_ids:
     scene_info = {}
     scene_gt = {}
@@ -109,8 +112,8 @@ for scene_id in scene_ids:
         depth *= 10.0  # Convert depth map to [100um]
 
         # Save the RGB and depth image
-        inout.save_im(rgb_out_mpath.format(scene_id, im_id), rgb)
-        inout.save_depth(depth_out_mpath.format(scene_id, im_id), depth)
+        im_writer.save_im(rgb_out_mpath.format(scene_id, im_id), rgb)
+        im_writer.save_depth(depth_out_mpath.format(scene_id, im_id), depth)
 
         # Load the GT pose
         R_m2c = load_hinter_mat(rot_mpath.format(scene_id, im_id))
@@ -161,3 +164,5 @@ for scene_id in scene_ids:
     # Store ground truth poses
     with open(scene_gt_mpath.format(scene_id), 'w') as f:
         yaml.dump(scene_gt, f, width=10000)
+
+im_writer.close()
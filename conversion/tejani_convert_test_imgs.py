@@ -52,6 +52,9 @@ def load_tejani_poses(path):
 with open(bbox_cens_path, 'r') as f:
     bbox_cens = np.array(yaml.load(f))
 
+# The images are saved in the background
+im_writer = inout.AsyncImageWriter()
+
 for scene_id in scene_ids:
     scene_info = {}
     scene_gt = {}
@@ -87,8 +90,8 @@ for scene_id in scene_ids:
         depth *= 10.0  # Convert depth map to [100um]
 
         # Save the RGB and depth image
-        inout.save_im(rgb_out_mpath.format(scene_id, im_id_out), rgb)
-        inout.save_depth(depth_out_mpath.format(scene_id, im_id_out), depth)
+        im_writer.save_im(rgb_out_mpath.format(scene_id, im_id_out), rgb)
+        im_writer.save_depth(depth_out_mpath.format(scene_id, im_id_out), depth)
 
         scene_info[im_id_out] = {
             'cam_K': par['cam']['K'].flatten().tolist()
@@ -142,3 +145,5 @@ for scene_id in scene_ids:
     # Store ground truth poses
     with open(scene_gt_mpath.format(scene_id), 'w') as f:
         yaml.dump(scene_gt, f, width=10000)
+
+im_writer.close()
@@ -169,6 +169,8 @@ def get_dataset_params(name, model_type='', train_type='', test_type='',
     p['train_depth_mpath'] = pjoin(p['base_path'], train_dir, '{:02d}', 'depth', im_id_f + '.png')
     p['train_mask_mpath'] = pjoin(p['base_path'], train_dir, '{:02d}', 'mask', im_id_f + '_{:02d}.png')
     p['train_mask_visib_mpath'] = pjoin(p['base_path'], train_dir, '{:02d}', 'mask_visib', im_id_f + '_{:02d}.png')
+    p['obj_gt_depth_cache_mpath'] = pjoin(p['base_path'], train_dir + '_gt_depth_cache', models_dir, '{:02d}')
+    p['obj_im_cache_mpath'] = pjoin(p['base_path'], train_dir + '_im_cache', '{:02d}_{}')
 
     p['scene_info_mpath'] = pjoin(p['base_path'], test_dir, '{:02d}', 'info.yml')
     p['scene_gt_mpath'] = pjoin(p['base_path'], test_dir, '{:02d}', 'gt.yml')
@@ -177,6 +179,8 @@ def get_dataset_params(name, model_type='', train_type='', test_type='',
     p['test_depth_mpath'] = pjoin(p['base_path'], test_dir, '{:02d}', 'depth', im_id_f + '.png')
     p['test_mask_mpath'] = pjoin(p['base_path'], test_dir, '{:02d}', 'mask', im_id_f + '_{:02d}.png')
     p['test_mask_visib_mpath'] = pjoin(p['base_path'], test_dir, '{:02d}', 'mask_visib', im_id_f + '_{:02d}.png')
+    p['scene_gt_depth_cache_mpath'] = pjoin(p['base_path'], test_dir + '_gt_depth_cache', models_dir, '{:02d}')
+    p['scene_im_cache_mpath'] = pjoin(p['base_path'], test_dir + '_im_cache', '{:02d}_{}')
 
     p['test_set_fpath'] = pjoin(p['base_path'], 'test_set_v1.yml')
 
@@ -0,0 +1,239 @@
+# Author: Tomas Hodan (hodantom@cmp.felk.cvut.cz)
+# Center for Machine Perception, Czech Technical University in Prague
+
+# On-disk cache of depth images of object models rendered at the ground truth
+# poses. It is filled by tools/calc_gt_stats.py and reused by
+# tools/eval_calc_errors.py (for VSD and COU).
+#
+# The depth images of one scene are stored in two files:
+# - <path>.dat - Raw float32 data with the depth images cropped to the bounding
+#   box of the rendered object (read through a memory map).
+# - <path>_index.npz - Index with the location of each (im_id, gt_id) rendering
+#   in the .dat file, and a signature of the inputs the renderings were made
+#   from (content hash of gt.yml, info.yml and the model PLY files, and the
+#   clipping planes). If the signature does not match, the cache is discarded.
+
+import os
+import hashlib
+import numpy as np
+from . import misc
+
+# MD5 hashes of files indexed by (path, modification time, size)
+_file_hashes = {}
+
+def file_hash(path):
+    """
+    Calculates MD5 hash of the content of a file (memoized).
+
+    :param path: Path to the file.
+    :return: Hexadecimal MD5 digest.
+    """
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_mtime, st.st_size)
+    if key not in _file_hashes:
+        md5 = hashlib.md5()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(2 ** 20), b''):
+                md5.update(chunk)
+        _file_hashes[key] = md5.hexdigest()
+    return _file_hashes[key]
+
+def file_stat(path):
+    """
+    :param path: Path to a file.
+    :return: String with the absolute path, the size and the modification time
+    of the file (a cheap replacement of file_hash for large files, e.g. images).
+    """
+    st = os.stat(path)
+    return repr((os.path.abspath(path), st.st_size, st.st_mtime))
+
+def calc_signature(paths, params=(), stat_paths=()):
+    """
+    Calculates a signature of the content of files and of other parameters.
+
+    :param paths: List of paths to the files (their content is hashed).
+    :param params: Tuple of other parameters (with a stable repr()).
+    :param stat_paths: List of paths to the files represented only by their
+    path, size and modification time (see file_stat).
+    :return: Hexadecimal MD5 digest.
+    """
+    md5 = hashlib.md5()
+    for path in paths:
+        md5.update(file_hash(path).encode('ascii'))
+    md5.update(repr(tuple(params)).encode('ascii'))
+    for path in stat_paths:
+        md5.update(file_stat(path).encode('utf-8'))
+    return md5.hexdigest()
+
+class GTDepthCache(object):
+    """
+    Cache of depth images rendered at the ground truth poses of one scene.
+    """
+    def __init__(self, path, signature, read_only=False):
+        """
+        :param path: Path to the cache files (without the extension).
+        :param signature: Signature of the inputs (see calc_signature()). An
+        existing cache with a different signature is discarded.
+        :param read_only: Whether the cache files can be only read (e.g. when
+        the cache is filled by another process). An invalid cache is then
+        ignored instead of being removed.
+        """
+        self.data_path = path + '.dat'
+        self.index_path = path + '_index.npz'
+        self.signature = signature
+        self.read_only = read_only
+
+        # (im_id, gt_id) -> (offset, x, y, w, h, im_width, im_height)
+        self.index = {}
+        self.data_size = 0 # Number of float32 values in the .dat file
+        self.data = None # Memory map of the .dat file
+        self.writer = None
+
+        valid = False
+        if os.path.isfile(self.index_path) and os.path.isfile(self.data_path):
+            index = np.load(self.index_path)
+            if str(index['signature']) == signature:
+                for e in index['entries']:
+                    self.index[(int(e[0]), int(e[1]))] = tuple(int(v) for v in e[2:])
+                self.data_size = int(index['data_size'])
+                valid = True
+
+        # Discard an outdated or incomplete cache
+        if not valid and not read_only:
+            for path in [self.index_path, self.data_path]:
+                if os.path.isfile(path):
+                    os.remove(path)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def get(self, im_id, gt_id, im_size=None):
+        """
+        Loads a cached depth image.
+
+        :param im_id: Image ID.
+        :param gt_id: GT ID.
+        :param im_size: Expected image size (width, height).
+        :return: Depth image or None if it is not in the cache.
+        """
+        e = self.index.get((im_id, gt_id))
+        if e is None:
+            return None
+        offset, x, y, w, h, im_w, im_h = e
+        if im_size is not None and tuple(im_size) != (im_w, im_h):
+            return None
+
+        depth = np.zeros((im_h, im_w), np.float32)
+        if w > 0:
+            if self.data is None:
+                self.data = np.memmap(self.data_path, np.float32, 'r',
+                                      shape=(self.data_size,))
+            depth[y:(y + h), x:(x + w)] =\
+                self.data[offset:(offset + w * h)].reshape((h, w))
+        return depth
+
+    def put(self, im_id, gt_id, depth):
+        """
+        Adds a depth image to the cache (it is stored on disk by save()).
+
+        :param im_id: Image ID.
+        :param gt_id: GT ID.
+        :param depth: Rendered depth image.
+        """
+        if self.read_only:
+            raise ValueError('The cache is read-only.')
+
+        ys, xs = np.nonzero(depth > 0)
+        if ys.size:
+            x, y = xs.min(), ys.min()
+            w, h = xs.max() - x + 1, ys.max() - y + 1
+            crop = np.ascontiguousarray(depth[y:(y + h), x:(x + w)], np.float32)
+        else:
+            x, y, w, h = 0, 0, 0, 0
+            crop = np.zeros(0, np.float32)
+
+        if self.writer is None:
+            misc.ensure_dir(os.path.dirname(self.data_path))
+            self.writer = open(self.data_path, 'ab')
+
+            # Discard data which were not indexed (e.g. when the previous run
+            # was interrupted before save()), so the offsets of the new data
+            # are correct
+            self.writer.truncate(self.data_size * 4)
+            self.data = None
+        self.writer.write(crop.tobytes())
+
+        self.index[(im_id, gt_id)] = (self.data_size, int(x), int(y), int(w),
+                                      int(h), depth.shape[1], depth.shape[0])
+        self.data_size += crop.size
+
+    def save(self):
+        """
+        Saves the index of the cache.
+        """
+        if self.writer is None:
+            return
+        self.writer.close()
+        self.writer = None
+        self.data = None
+
+        keys = sorted(self.index.keys())
+        entries = np.array([list(k) + list(self.index[k]) for k in keys],
+                           np.int64).reshape((-1, 9))
+        index_path_tmp = self.index_path + '.tmp.npz'
+        np.savez(index_path_tmp, entries=entries,
+                 data_size=np.array(self.data_size),
+                 signature=np.array(self.signature))
+        os.rename(index_path_tmp, self.index_path)
+
+def load_scene_cache(path, gt_path, info_path, model_paths, clip_near,
+                     clip_far, backend, read_only=False):
+    """
+    Opens the GT depth cache of a scene.
+
+    :param path: Path to the cache files (without the extension), e.g.
+    dp['scene_gt_depth_cache_mpath'].format(scene_id).
+    :param gt_path: Path to gt.yml of the scene.
+    :param info_path: Path to info.yml of the scene.
+    :param model_paths: Paths to the object models.
+    :param clip_near, clip_far: Clipping planes used for the rendering.
+    :param backend: Rendering backend ('gl' or 'cpu', the renderings of the
+    backends slightly differ).
+    :param read_only: See GTDepthCache.
+    :return: GTDepthCache.
+    """
+    signature = calc_signature([gt_path, info_path] + sorted(model_paths),
+                               (float(clip_near), float(clip_far), backend))
+    return GTDepthCache(path, signature, read_only)
+
+if __name__ == '__main__':
+    # Test of a cache filled by an interrupted run (put() without save())
+    import shutil
+    import tempfile
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmp_dir, 'cache')
+        depth_1 = np.zeros((4, 5), np.float32)
+        depth_1[1:3, 1:4] = 1.0
+        depth_2 = np.zeros((4, 5), np.float32)
+        depth_2[0:2, 2:5] = 2.0
+
+        cache = GTDepthCache(path, 'sign')
+        cache.put(0, 0, depth_1)
+        cache.save()
+
+        cache = GTDepthCache(path, 'sign')
+        cache.put(1, 0, depth_1)
+        cache.writer.close() # Interrupted before save()
+
+        cache = GTDepthCache(path, 'sign')
+        cache.put(2, 0, depth_2)
+        cache.save()
+
+        cache = GTDepthCache(path, 'sign', read_only=True)
+        assert((1, 0) not in cache)
+        assert(np.array_equal(cache.get(0, 0), depth_1))
+        assert(np.array_equal(cache.get(2, 0), depth_2))
+        print('Interrupted cache test: OK')
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
@@ -0,0 +1,232 @@
+# Author: Tomas Hodan (hodantom@cmp.felk.cvut.cz)
+# Center for Machine Perception, Czech Technical University in Prague
+
+# On-disk cache of decoded images of a scene (or of training images of an
+# object). The images are decoded only once and then read through a memory map,
+# i.e. processes reading the same images (e.g. workers of eval_calc_errors.py)
+# share them in the page cache instead of decoding each PNG file again.
+#
+# The images of one type (e.g. depth) of one scene are stored in two files:
+# - <path>.npy - NxHxW (or NxHxWxC) array with all the images at the native
+#   resolution, stored in the native type (uint16 for depth, uint8 for RGB).
+# - <path>_index.npz - Image IDs (in the order of the images in the array),
+#   sizes and modification times of the source images, and the image type. The
+#   cache is rebuilt if it does not contain some of the requested images or if
+#   some of them changed (a cache built for a superset of the requested images
+#   is reused).
+#
+# Only the images used by the runs are cached (caching all images of a scene
+# would be slower than decoding them for a run on a subset). When the cache is
+# rebuilt, it keeps the still valid images of the previous cache (they are
+# copied, not decoded again), i.e. runs on different subsets of images do not
+# rebuild the cache over and over.
+
+import os
+import tempfile
+import numpy as np
+from . import inout, misc
+
+# Version of the cache format (caches of other versions are rebuilt)
+version = 2
+
+def get_images_stats(im_paths):
+    """
+    Sizes and modification times of the source images (hashing the content
+    would be as slow as decoding the images).
+
+    :param im_paths: List of paths to the images.
+    :return: nx2 ndarray with the size and the modification time of each image.
+    """
+    stats = []
+    for path in im_paths:
+        st = os.stat(path)
+        stats.append((st.st_size, st.st_mtime))
+    return np.array(stats, np.float64).reshape((-1, 2))
+
+def load_image(path, im_type, out=None):
+    """
+    Loads an image in the native type.
+
+    :param path: Path to the image.
+    :param im_type: 'depth' (uint16) or 'rgb' (uint8).
+    :param out: Optional preallocated array into which the image is loaded.
+    :return: The loaded image.
+    """
+    if im_type == 'depth':
+        return inout.load_depth(path, out=out, dtype=np.uint16)
+    im = inout.load_im(path)
+    if out is not None:
+        out[...] = im
+        return out
+    return im
+
+class ImageCache(object):
+    """
+    Cache of decoded images of one scene.
+    """
+    def __init__(self, path):
+        """
+        :param path: Path to the cache files (without the extension).
+        """
+        index = np.load(path + '_index.npz')
+        self.version = int(index['version'])
+        self.im_type = str(index['im_type'])
+        self.im_stats = index['im_stats']
+        self.im_ids = [int(i) for i in index['im_ids']]
+        self.im_inds = {im_id: i for i, im_id in enumerate(self.im_ids)}
+
+        # The images are read through a memory map
+        self.data = np.load(path + '.npy', mmap_mode='r')
+        if self.data.shape[0] != len(self.im_ids):
+            raise ValueError('Inconsistent image cache: ' + path)
+
+    def __contains__(self, im_id):
+        return im_id in self.im_inds
+
+    def is_valid(self, im_ids, im_stats, im_type):
+        """
+        :param im_ids: List of image IDs.
+        :param im_stats: Stats of the source images (see get_images_stats).
+        :param im_type: 'depth' or 'rgb'.
+        :return: Whether the cache contains the up-to-date images.
+        """
+        if self.version != version or self.im_type != im_type or\
+                any(im_id not in self.im_inds for im_id in im_ids):
+            return False
+        inds = [self.im_inds[im_id] for im_id in im_ids]
+        return np.array_equal(self.im_stats[inds], im_stats)
+
+    def get_valid_ids(self, im_mpath, data_id, im_type):
+        """
+        :param im_mpath: Mask of path to the source images.
+        :param data_id: Scene ID (or object ID for training images).
+        :param im_type: 'depth' or 'rgb'.
+        :return: IDs of the cached images whose source images did not change.
+        """
+        if self.version != version or self.im_type != im_type:
+            return []
+        valid_ids = []
+        for im_id in self.im_ids:
+            im_path = im_mpath.format(data_id, im_id)
+            if os.path.isfile(im_path) and np.array_equal(
+                    self.im_stats[self.im_inds[im_id]],
+                    get_images_stats([im_path])[0]):
+                valid_ids.append(im_id)
+        return valid_ids
+
+    def get(self, im_id):
+        """
+        :param im_id: Image ID.
+        :return: Read-only view of the image in the native type (no copy).
+        """
+        return self.data[self.im_inds[im_id]]
+
+    def get_depth(self, im_id, depth_scale=1.0):
+        """
+        :param im_id: Image ID.
+        :param depth_scale: Factor converting the depth values to [mm].
+        :return: Depth image in [mm] (float32, the same as returned by
+        inout.load_depth with depth_scale).
+        """
+        depth = np.empty(self.data.shape[1:], np.float32)
+        np.multiply(self.get(im_id), depth_scale, out=depth, dtype=np.float32)
+        return depth
+
+def build_cache(path, im_paths, im_ids, im_type, old_cache=None,
+                old_ids=()):
+    """
+    Decodes the images and stores them into the cache files. The files are
+    written under temporary names and then renamed (other processes may build
+    the same cache at the same time).
+
+    :param path: Path to the cache files (without the extension).
+    :param im_paths: List of paths to the images.
+    :param im_ids: List of image IDs.
+    :param im_type: 'depth' or 'rgb'.
+    :param old_cache: Optional previous ImageCache.
+    :param old_ids: IDs of the images which are copied from old_cache instead
+    of being decoded (their source images must not have changed).
+    """
+    cache_dir = os.path.dirname(os.path.abspath(path))
+    misc.ensure_dir(cache_dir)
+
+    # All images of the scene are expected to have the same size
+    im_stats = get_images_stats(im_paths)
+    im = load_image(im_paths[0], im_type)
+    fd, data_path_tmp = tempfile.mkstemp(suffix='.npy', dir=cache_dir)
+    os.close(fd)
+    data = np.lib.format.open_memmap(data_path_tmp, mode='w+', dtype=im.dtype,
+                                     shape=(len(im_paths),) + im.shape)
+    old_ids = set(old_ids)
+    for i, (im_id, im_path) in enumerate(zip(im_ids, im_paths)):
+        if im_id in old_ids and old_cache.get(im_id).shape == im.shape:
+            data[i] = old_cache.get(im_id)
+        else:
+            load_image(im_path, im_type, out=data[i])
+    data.flush()
+    del data
+
+    fd, index_path_tmp = tempfile.mkstemp(suffix='.npz', dir=cache_dir)
+    os.close(fd)
+    np.savez(index_path_tmp, version=np.array(version),
+             im_type=np.array(im_type), im_ids=np.array(im_ids, np.int64),
+             im_stats=im_stats)
+
+    # The index is renamed last (the cache is valid only if both files exist)
+    os.rename(data_path_tmp, path + '.npy')
+    os.rename(index_path_tmp, path + '_index.npz')
+
+def open_cache(path):
+    """
+    Opens an existing image cache without checking the source images (e.g. in
+    worker processes when the cache was checked by the main process).
+
+    :param path: Path to the cache files (without the extension).
+    :return: ImageCache or None if the cache does not exist.
+    """
+    if not os.path.isfile(path + '_index.npz') or\
+            not os.path.isfile(path + '.npy'):
+        return None
+    try:
+        return ImageCache(path)
+    except (IOError, ValueError, KeyError):
+        return None
+
+def load_scene_cache(path, im_mpath, data_id, im_ids, im_type='depth',
+                     read_only=False):
+    """
+    Opens the image cache of a scene. The cache is (re)built if it does not
+    contain some of the images or if some of the source images changed. The
+    rebuilt cache contains the requested images and the still valid images of
+    the previous cache.
+
+    :param path: Path to the cache files (without the extension), e.g.
+    dp['scene_im_cache_mpath'].format(scene_id, 'depth').
+    :param im_mpath: Mask of path to the source images, e.g.
+    dp['test_depth_mpath'].
+    :param data_id: Scene ID (or object ID for training images).
+    :param im_ids: IDs of the images used by the current run.
+    :param im_type: 'depth' or 'rgb'.
+    :param read_only: Whether the cache can be only read (e.g. in worker
+    processes). None is returned if the cache is not valid.
+    :return: ImageCache or None.
+    """
+    im_ids = sorted(set(im_ids))
+    im_paths = [im_mpath.format(data_id, im_id) for im_id in im_ids]
+    im_stats = get_images_stats(im_paths)
+
+    cache = open_cache(path)
+    if cache is not None and cache.is_valid(im_ids, im_stats, im_type):
+        return cache
+
+    if read_only or not im_ids:
+        return None
+
+    # The still valid images of the previous cache are kept
+    old_ids = []
+    if cache is not None:
+        old_ids = cache.get_valid_ids(im_mpath, data_id, im_type)
+        im_ids = sorted(set(im_ids) | set(old_ids))
+        im_paths = [im_mpath.format(data_id, im_id) for im_id in im_ids]
+    build_cache(path, im_paths, im_ids, im_type, cache, old_ids)
+    return ImageCache(path)
@@ -1,8 +1,15 @@
 # Author: Tomas Hodan (hodantom@cmp.felk.cvut.cz)
 # Center for Machine Perception, Czech Technical University in Prague
 
+import os
+import re
+import zlib
 import struct
+import shutil
 import itertools
+import collections
+import multiprocessing
+import multiprocessing.pool
 import numpy as np
 import scipy.misc
 import png
@@ -24,6 +31,153 @@ def save_yaml(path, content):
     with open(path, 'w') as f:
         yaml.dump(content, f, Dumper=yaml.CDumper, width=10000)
 
+# Fast loading of YAML files in the SIXD formats (gt.yml, info.yml, results)
+#-------------------------------------------------------------------------------
+class _YamlFormatError(Exception):
+    pass
+
+_yaml_int_re = re.compile(r'^[-+]?(0|[1-9][0-9]*)$')
+_yaml_float_re = re.compile(r'^[-+]?([0-9]+\.[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?$')
+_yaml_str_re = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+_yaml_special = {
+    'null': None, 'Null': None, 'NULL': None, '~': None,
+    'true': True, 'True': True, 'TRUE': True,
+    'false': False, 'False': False, 'FALSE': False,
+    '.nan': float('nan'), '.NaN': float('nan'), '.NAN': float('nan'),
+    '.inf': float('inf'), '.Inf': float('inf'), '.INF': float('inf'),
+    '-.inf': float('-inf'), '-.Inf': float('-inf'), '-.INF': float('-inf')
+}
+_yaml_1_1_bools = {'y', 'Y', 'yes', 'Yes', 'YES', 'n', 'N', 'no', 'No', 'NO',
+                   'on', 'On', 'ON', 'off', 'Off', 'OFF'}
+_yaml_top_key_re = re.compile(r'^([A-Za-z0-9_]+):(?: (.*))?$')
+_yaml_item_key_re = re.compile(r'^- ([A-Za-z0-9_]+):(?: (.*))?$')
+_yaml_sub_key_re = re.compile(r'^  ([A-Za-z0-9_]+):(?: (.*))?$')
+_yaml_seq_item_re = re.compile(r'^(?:  |    )- (.*)$')
+_yaml_flow_map_item_re = re.compile(r'\s*([A-Za-z0-9_]+): (\[[^\]]*\]|[^,\[\]{}]*)\s*(?:,|$)')
+
+def _parse_yaml_scalar(s):
+    s = s.strip()
+    if _yaml_int_re.match(s):
+        return int(s)
+    if _yaml_float_re.match(s):
+        return float(s)
+    if s in _yaml_special:
+        return _yaml_special[s]
+    if _yaml_str_re.match(s) and s not in _yaml_1_1_bools:
+        return s
+    raise _YamlFormatError(s)
+
+def _parse_yaml_value(s):
+    s = s.strip()
+    if s.startswith('['):
+        if not s.endswith(']'):
+            raise _YamlFormatError(s)
+        s = s[1:-1].strip()
+        return [_parse_yaml_scalar(e) for e in s.split(',')] if s else []
+    elif s.startswith('{'):
+        if not s.endswith('}'):
+            raise _YamlFormatError(s)
+        s = s[1:-1].strip()
+        d = {}
+        pos = 0
+        while pos < len(s):
+            m = _yaml_flow_map_item_re.match(s, pos)
+            if not m or m.end() == pos:
+                raise _YamlFormatError(s)
+            d[_parse_yaml_scalar(m.group(1))] = _parse_yaml_value(m.group(2))
+            pos = m.end()
+        return d
+    return _parse_yaml_scalar(s)
+
+def _load_yaml_fast(path):
+    """
+    Loads a YAML file in one of the SIXD formats, i.e. a mapping with scalar
+    values or with values given by a mapping or by a list of mappings, where
+    the values of the inner mappings are scalars or lists of scalars. If the
+    file does not follow this format, it is loaded by the YAML library.
+
+    :param path: Path to the YAML file.
+    :return: Content of the file.
+    """
+    with open(path, 'r') as f:
+        lines = f.read().splitlines()
+
+    try:
+        content = {}
+        block_key = None # Top-level key with a mapping or a list of mappings
+        inner = None # The current inner mapping
+        seq_owner = None # (mapping, key) of the current block sequence
+        for line in lines:
+            if not line.strip() or line.lstrip().startswith('#'):
+                continue
+
+            # Item of a block sequence
+            m = _yaml_seq_item_re.match(line)
+            if m:
+                if seq_owner is None:
+                    raise _YamlFormatError(line)
+                d, key = seq_owner
+                if d[key] is None:
+                    d[key] = []
+                d[key].append(_parse_yaml_scalar(m.group(1)))
+                continue
+            seq_owner = None
+
+            # Key of an inner mapping
+            m = _yaml_sub_key_re.match(line)
+            if m:
+                if inner is None:
+                    if block_key is None or content[block_key] is not None:
+                        raise _YamlFormatError(line)
+                    inner = content[block_key] = {}
+                key = _parse_yaml_scalar(m.group(1))
+                inner[key] = _parse_yaml_value(m.group(2)) if m.group(2) else None
+                if inner[key] is None:
+                    seq_owner = (inner, key)
+                continue
+
+            # Item of a list of mappings
+            m = _yaml_item_key_re.match(line)
+            if m or line.startswith('- {'):
+                if block_key is None:
+                    raise _YamlFormatError(line)
+                if content[block_key] is None:
+                    content[block_key] = []
+                elif not isinstance(content[block_key], list):
+                    raise _YamlFormatError(line)
+                if m:
+                    key = _parse_yaml_scalar(m.group(1))
+                    inner = {key: _parse_yaml_value(m.group(2))
+                                  if m.group(2) else None}
+                    if inner[key] is None:
+                        seq_owner = (inner, key)
+                else:
+                    inner = _parse_yaml_value(line[2:])
+                    if not isinstance(inner, dict):
+                        raise _YamlFormatError(line)
+                content[block_key].append(inner)
+                continue
+
+            # Top-level key
+            m = _yaml_top_key_re.match(line)
+            if m:
+                key = _parse_yaml_scalar(m.group(1))
+                inner = None
+                block_key = None
+                if m.group(2):
+                    content[key] = _parse_yaml_value(m.group(2))
+                else:
+                    content[key] = None
+                    block_key = key
+                continue
+
+            raise _YamlFormatError(line)
+
+    except _YamlFormatError:
+        content = load_yaml(path)
+
+    return content
+
 def load_cam_params(path):
     with open(path, 'r') as f:
         c = yaml.load(f, Loader=yaml.CLoader)
@@ -37,6 +191,58 @@ def load_cam_params(path):
         cam['depth_scale'] = float(c['depth_scale'])
     return cam
 
+#-------------------------------------------------------------------------------
+# PNG encoding
+#-------------------------------------------------------------------------------
+# zlib compression level of the saved PNG images (0-9; 6 is the zlib default,
+# which is used also by PyPNG)
+png_compression = 6
+
+# PNG color types for the number of channels
+_png_color_types = {1: 0, 2: 4, 3: 2, 4: 6}
+
+def _png_chunk(chunk_type, data):
+    crc = zlib.crc32(chunk_type + data) & 0xffffffff
+    return struct.pack('>I', len(data)) + chunk_type + data +\
+           struct.pack('>I', crc)
+
+def encode_png(im, compression=png_compression):
+    """
+    Encodes an image into the PNG format. The rows are not filtered (filter
+    type 0, as by default in PyPNG) and the pixel data are compressed by zlib
+    in one call (zlib releases the GIL, i.e. images can be encoded in parallel
+    threads).
+
+    :param im: HxW (grayscale) or HxWxC (C = 2: grayscale with alpha, 3: RGB,
+    4: RGBA) ndarray of type uint8 or uint16.
+    :param compression: zlib compression level (0-9).
+    :return: Encoded image (bytes).
+    """
+    im = np.asarray(im)
+    if im.dtype == np.uint8:
+        bit_depth = 8
+    elif im.dtype == np.uint16:
+        bit_depth = 16
+        im = im.astype('>u2') # PNG stores 16-bit values in big-endian
+    else:
+        raise ValueError('Unsupported image type: {}'.format(im.dtype))
+    if im.ndim not in [2, 3] or\
+            (im.ndim == 3 and im.shape[2] not in _png_color_types):
+        raise ValueError('Unsupported image shape: {}'.format(im.shape))
+    n_channels = 1 if im.ndim == 2 else im.shape[2]
+
+    # Each row starts with the filter type
+    h, w = im.shape[:2]
+    rows = np.ascontiguousarray(im).reshape((h, -1)).view(np.uint8)
+    data = np.zeros((h, rows.shape[1] + 1), np.uint8)
+    data[:, 1:] = rows
+
+    header = struct.pack('>IIBBBBB', w, h, bit_depth,
+                         _png_color_types[n_channels], 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + _png_chunk(b'IHDR', header) +\
+           _png_chunk(b'IDAT', zlib.compress(data.tobytes(), compression)) +\
+           _png_chunk(b'IEND', b'')
+
 def load_im(path):
     im = scipy.misc.imread(path)
 
@@ -46,42 +252,225 @@ def load_im(path):
 
     return im
 
-def save_im(path, im):
-    scipy.misc.imsave(path, im)
+def save_im(path, im, compression=png_compression):
+    im = np.asarray(im)
+
+    # 8-bit PNG images are encoded by encode_png (faster; other formats and
+    # types are saved by SciPy, which e.g. rescales float images)
+    if os.path.splitext(path)[1].lower() == '.png' and im.dtype == np.uint8\
+            and (im.ndim == 2 or (im.ndim == 3 and im.shape[2] in [3, 4])):
+        with open(path, 'wb') as f:
+            f.write(encode_png(im, compression))
+    else:
+        scipy.misc.imsave(path, im)
 
     # Using PyPNG (for RGB)
     # w_rgb = png.Writer(im.shape[1], im.shape[0], greyscale=False, bitdepth=8)
     # with open(path, 'wb') as f:
     #     w_rgb.write(f, np.reshape(im, (-1, 3 * im.shape[1])))
 
-def load_depth(path):
-    # PyPNG library is used since it allows to save 16-bit PNG
-    r = png.Reader(filename=path)
-    im = np.vstack(itertools.imap(np.uint16, r.asDirect()[2])).astype(np.float32)
-    return im
+def _png_unfilter(data, bpp):
+    """
+    Reverses filtering of the rows of a decompressed PNG image (in place).
+
+    :param data: hx(1 + row_len) ndarray (uint8) with the filter type and the
+    filtered bytes of each row.
+    :param bpp: Number of bytes per pixel.
+    :return: True if successful, False if the image contains rows with filter
+    types which are not supported (Average and Paeth).
+    """
+    filters = data[:, 0]
+    if np.any(filters > 2):
+        return False
+    rows = data[:, 1:]
+    for i in np.flatnonzero(filters).tolist():
+        if filters[i] == 1: # Sub (the bytes are cumulative sums modulo 256)
+            row = rows[i].reshape((-1, bpp))
+            row[:] = np.cumsum(row, axis=0, dtype=np.uint8)
+        elif i > 0: # Up (the prior row of the first row is zero)
+            rows[i] += rows[i - 1]
+    return True
+
+def decode_depth_png(data, out=None, depth_scale=None, dtype=np.float32):
+    """
+    Decodes a depth image from a grayscale PNG (typically 16-bit). Images with
+    unfiltered rows or rows filtered by the Sub and Up filters (as saved by
+    save_depth, PyPNG or OpenCV with the default settings) are decoded by
+    NumPy directly into the output array, other images by PyPNG.
+
+    :param data: Encoded image (bytes).
+    :param out: Optional preallocated HxW ndarray into which the image is
+    decoded (its type is then used instead of dtype).
+    :param depth_scale: Optional factor by which the depth values are
+    multiplied (e.g. to convert them to [mm]; requires a float type).
+    :param dtype: Type of the returned image (e.g. np.uint16 for the stored
+    values without any conversion).
+    :return: HxW ndarray with the depth image.
+    """
+    if data[:8] != b'\x89PNG\r\n\x1a\n':
+        raise ValueError('Not a PNG image.')
+
+    # Read the header and the compressed data
+    pos = 8
+    header = None
+    idat = []
+    while pos + 8 <= len(data):
+        length, chunk_type = struct.unpack('>I4s', data[pos:(pos + 8)])
+        if chunk_type == b'IHDR':
+            header = struct.unpack('>IIBBBBB', data[(pos + 8):(pos + 21)])
+        elif chunk_type == b'IDAT':
+            idat.append(data[(pos + 8):(pos + 8 + length)])
+        elif chunk_type == b'IEND':
+            break
+        pos += 12 + length
+    w, h, bit_depth, color_type, _, _, interlace = header
+
+    vals = None
+    if color_type == 0 and bit_depth in [8, 16] and interlace == 0:
+        bpp = bit_depth // 8
+        raw = zlib.decompress(b''.join(idat))
+        if len(raw) != h * (1 + w * bpp):
+            raise ValueError('Corrupted PNG image.')
+        buf = np.frombuffer(raw, np.uint8).reshape((h, 1 + w * bpp))
+        if np.any(buf[:, 0]):
+            buf = buf.copy()
+            if not _png_unfilter(buf, bpp):
+                buf = None
+        if buf is not None:
+            vals = np.ndarray((h, w), np.dtype('>u2') if bpp == 2 else np.uint8,
+                              buffer=buf, offset=1, strides=(1 + w * bpp, bpp))
+
+    # Other images are decoded by PyPNG
+    if vals is None:
+        w, h, rows, info = png.Reader(bytes=data).asDirect()
+        vals = np.vstack(list(map(np.uint16, rows)))
+        if info['planes'] > 1:
+            vals = vals.reshape((h, w, info['planes']))
+
+    if out is None:
+        out = np.empty(vals.shape, dtype)
+    elif out.shape != vals.shape:
+        raise ValueError('The output array has shape {}, expected {}.'.format(
+            out.shape, vals.shape))
+
+    # The values are converted (and scaled) in one pass
+    if depth_scale is None:
+        out[...] = vals
+    elif np.issubdtype(out.dtype, np.floating):
+        np.multiply(vals, depth_scale, out=out, dtype=out.dtype)
+    else:
+        raise ValueError('depth_scale requires a float output type.')
+    return out
+
+def load_depth(path, out=None, depth_scale=None, dtype=np.float32):
+    """
+    Loads a depth image saved as a grayscale PNG (see decode_depth_png).
+    """
+    with open(path, 'rb') as f:
+        return decode_depth_png(f.read(), out, depth_scale, dtype)
 
 def load_depth2(path):
-    d = scipy.misc.imread(path)
-    d = d.astype(np.float32)
-    return d
+    # The same as load_depth (kept for backward compatibility)
+    return load_depth(path)
 
-def save_depth(path, im):
-    # PyPNG library is used since it allows to save 16-bit PNG
-    w_depth = png.Writer(im.shape[1], im.shape[0], greyscale=True, bitdepth=16)
+def save_depth(path, im, compression=png_compression):
+    # Saved as 16-bit PNG (encoded by encode_png, which gives the same image as
+    # PyPNG but is faster)
     im_uint16 = np.round(im).astype(np.uint16)
     with open(path, 'wb') as f:
-        w_depth.write(f, np.reshape(im_uint16, (-1, im.shape[1])))
+        f.write(encode_png(im_uint16, compression))
+
+    # Using PyPNG
+    # w_depth = png.Writer(im.shape[1], im.shape[0], greyscale=True, bitdepth=16)
+    # with open(path, 'wb') as f:
+    #     w_depth.write(f, np.reshape(im_uint16, (-1, im.shape[1])))
+
+class AsyncImageWriter(object):
+    """
+    Saves images (by save_im and save_depth) in the background, on a pool of
+    threads (the PNG encoding releases the GIL) or processes. At most
+    max_pending images are waiting to be saved - saving of a new image blocks
+    until one of them is saved.
+
+    Usage:
+        with inout.AsyncImageWriter(n_workers=4) as writer:
+            writer.save_im(rgb_path, rgb)
+            writer.save_depth(depth_path, depth)
+    """
+    def __init__(self, n_workers=4, compression=png_compression,
+                 use_processes=False, max_pending=None):
+        """
+        :param n_workers: Number of writing threads/processes.
+        :param compression: zlib compression level of PNG images (0-9).
+        :param use_processes: Whether to use processes instead of threads.
+        :param max_pending: Maximum number of images waiting to be saved
+        (None = 4 * n_workers).
+        """
+        self.compression = compression
+        self.max_pending = 4 * n_workers if max_pending is None else max_pending
+        if use_processes:
+            self.pool = multiprocessing.Pool(n_workers)
+        else:
+            self.pool = multiprocessing.pool.ThreadPool(n_workers)
+        self.pending = collections.deque()
+
+    def _submit(self, save_func, path, im):
+        while len(self.pending) >= max(1, self.max_pending):
+            self.pending.popleft().get()
+        self.pending.append(self.pool.apply_async(
+            save_func, (path, im, self.compression)))
+
+    def save_im(self, path, im):
+        """
+        Saves an image in the background (see save_im). The image is copied,
+        i.e. the passed array can be modified immediately.
+        """
+        self._submit(save_im, path, np.array(im))
+
+    def save_depth(self, path, im):
+        """
+        Saves a depth image in the background (see save_depth). The image is
+        copied, i.e. the passed array can be modified immediately.
+        """
+        self._submit(save_depth, path, np.array(im))
+
+    def flush(self):
+        """
+        Waits until all images are saved (exceptions raised when saving the
+        images are re-raised here).
+        """
+        while self.pending:
+            self.pending.popleft().get()
+
+    def close(self):
+        """
+        Saves all images and stops the workers.
+        """
+        try:
+            self.flush()
+        finally:
+            self.pool.close()
+            self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.pool.terminate()
+            self.pool.join()
 
 def load_info(path):
-    with open(path, 'r') as f:
-        info = yaml.load(f, Loader=yaml.CLoader)
-        for eid in info.keys():
-            if 'cam_K' in info[eid].keys():
-                info[eid]['cam_K'] = np.array(info[eid]['cam_K']).reshape((3, 3))
-            if 'cam_R_w2c' in info[eid].keys():
-                info[eid]['cam_R_w2c'] = np.array(info[eid]['cam_R_w2c']).reshape((3, 3))
-            if 'cam_t_w2c' in info[eid].keys():
-                info[eid]['cam_t_w2c'] = np.array(info[eid]['cam_t_w2c']).reshape((3, 1))
+    info = _load_yaml_fast(path)
+    for eid in info.keys():
+        if 'cam_K' in info[eid].keys():
+            info[eid]['cam_K'] = np.array(info[eid]['cam_K']).reshape((3, 3))
+        if 'cam_R_w2c' in info[eid].keys():
+            info[eid]['cam_R_w2c'] = np.array(info[eid]['cam_R_w2c']).reshape((3, 3))
+        if 'cam_t_w2c' in info[eid].keys():
+            info[eid]['cam_t_w2c'] = np.array(info[eid]['cam_t_w2c']).reshape((3, 1))
     return info
 
 def save_info(path, info):
@@ -96,15 +485,99 @@ def save_info(path, info):
     with open(path, 'w') as f:
         yaml.dump(info, f, Dumper=yaml.CDumper, width=10000)
 
-def load_gt(path):
-    with open(path, 'r') as f:
-        gts = yaml.load(f, Loader=yaml.CLoader)
-        for im_id, gts_im in gts.items():
-            for gt in gts_im:
-                if 'cam_R_m2c' in gt.keys():
-                    gt['cam_R_m2c'] = np.array(gt['cam_R_m2c']).reshape((3, 3))
-                if 'cam_t_m2c' in gt.keys():
-                    gt['cam_t_m2c'] = np.array(gt['cam_t_m2c']).reshape((3, 1))
+def load_gt(path, use_index=False):
+    """
+    Loads GT poses from a file.
+
+    :param path: Path to gt.yml.
+    :param use_index: Whether to use the binary GT index (see save_gt_index).
+    The index is created if it does not exist or is outdated.
+    :return: Dictionary with a list of GT poses for each image ID.
+    """
+    if use_index:
+        gts = load_gt_index(path)
+        if gts is not None:
+            return gts
+
+    gts = _load_yaml_fast(path)
+    for im_id, gts_im in gts.items():
+        for gt in gts_im:
+            if 'cam_R_m2c' in gt.keys():
+                gt['cam_R_m2c'] = np.array(gt['cam_R_m2c']).reshape((3, 3))
+            if 'cam_t_m2c' in gt.keys():
+                gt['cam_t_m2c'] = np.array(gt['cam_t_m2c']).reshape((3, 1))
+
+    if use_index:
+        try:
+            save_gt_index(path, gts)
+        except (IOError, OSError): # E.g. a read-only dataset folder
+            pass
+    return gts
+
+def get_gt_index_path(path):
+    """
+    :param path: Path to gt.yml.
+    :return: Path to the binary GT index.
+    """
+    return os.path.splitext(path)[0] + '_index.npz'
+
+def save_gt_index(path, gts):
+    """
+    Saves a binary index of GT poses, i.e. arrays with im_id, obj_id, R, t and
+    obj_bb of all GT poses. The index is not created if some GT poses have
+    other items.
+
+    :param path: Path to gt.yml the GT poses were loaded from.
+    :param gts: GT poses (as returned by load_gt).
+    """
+    gt_keys = {'obj_id', 'cam_R_m2c', 'cam_t_m2c', 'obj_bb'}
+    im_ids = sorted(gts.keys())
+    gts_all = [(im_id, gt) for im_id in im_ids for gt in gts[im_id]]
+    if any(set(gt.keys()) != gt_keys for _, gt in gts_all):
+        return
+
+    st = os.stat(path)
+    n = len(gts_all)
+    index_path = get_gt_index_path(path)
+    index_path_tmp = index_path + '.{}.tmp.npz'.format(os.getpid())
+    np.savez(index_path_tmp,
+             yml_size=np.array(st.st_size), yml_mtime=np.array(st.st_mtime),
+             scene_im_ids=np.array(im_ids, np.int64),
+             im_ids=np.array([im_id for im_id, _ in gts_all], np.int64),
+             obj_ids=np.array([gt['obj_id'] for _, gt in gts_all], np.int64),
+             Rs=np.array([np.asarray(gt['cam_R_m2c']).flatten()
+                          for _, gt in gts_all], np.float64).reshape((n, 9)),
+             ts=np.array([np.asarray(gt['cam_t_m2c']).flatten()
+                          for _, gt in gts_all], np.float64).reshape((n, 3)),
+             bbs=np.array([gt['obj_bb'] for _, gt in gts_all],
+                          np.int64).reshape((n, 4)))
+    os.rename(index_path_tmp, index_path)
+
+def load_gt_index(path):
+    """
+    Loads GT poses from the binary GT index.
+
+    :param path: Path to gt.yml the index was created from.
+    :return: GT poses (as returned by load_gt) or None if the index does not
+    exist or is outdated.
+    """
+    index_path = get_gt_index_path(path)
+    if not os.path.isfile(index_path):
+        return None
+    index = np.load(index_path)
+    st = os.stat(path)
+    if int(index['yml_size']) != st.st_size or\
+            float(index['yml_mtime']) != st.st_mtime:
+        return None
+
+    gts = {int(im_id): [] for im_id in index['scene_im_ids']}
+    Rs = index['Rs'].reshape((-1, 3, 3))
+    ts = index['ts'].reshape((-1, 3, 1))
+    for i, (im_id, obj_id, bb) in enumerate(zip(index['im_ids'].tolist(),
+                                                index['obj_ids'].tolist(),
+                                                index['bbs'].tolist())):
+        gts[im_id].append({'obj_id': obj_id, 'cam_R_m2c': Rs[i],
+                           'cam_t_m2c': ts[i], 'obj_bb': bb})
     return gts
 
 def save_gt(path, gts):
@@ -127,19 +600,18 @@ def load_results_sixd17(path):
     :param path: Path to a file with poses.
     :return: List of the loaded poses.
     """
-    with open(path, 'r') as f:
-        res = yaml.load(f, Loader=yaml.CLoader)
-        if not res['ests'] or res['ests'] == [{}]:
-            res['ests'] = []
-        else:
-            for est in res['ests']:
-                est['R'] = np.array(est['R']).reshape((3, 3))
-                est['t'] = np.array(est['t']).reshape((3, 1))
-                if isinstance(est['score'], basestring):
-                    if 'nan' in est['score']:
-                        est['score'] = 0.0
-                    else:
-                        raise ValueError('Bad type of score.')
+    res = _load_yaml_fast(path)
+    if not res['ests'] or res['ests'] == [{}]:
+        res['ests'] = []
+    else:
+        for est in res['ests']:
+            est['R'] = np.array(est['R']).reshape((3, 3))
+            est['t'] = np.array(est['t']).reshape((3, 1))
+            if isinstance(est['score'], basestring):
+                if 'nan' in est['score']:
+                    est['score'] = 0.0
+                else:
+                    raise ValueError('Bad type of score.')
     return res
 
 def save_results_sixd17(path, res, run_time=-1):
@@ -174,6 +646,259 @@ def save_errors(path, errors):
                                    e['score'], txt_errors)
         f.write(txt)
 
+# Columnar binary format of pose errors (an alternative to the YAML format of
+# save_errors, which is slow to load for large numbers of estimates). The file
+# consists of a 64B header (magic, version, number of estimates n and number of
+# errors m) followed by arrays (little-endian) in this order:
+# score (float64, n), indptr (int64, n + 1), error (float64, m),
+# im_id (int32, n), obj_id (int32, n), est_id (int32, n), gt_id (int32, m).
+# The errors of the i-th estimate are error[indptr[i]:indptr[i + 1]] w.r.t. the
+# GT poses gt_id[indptr[i]:indptr[i + 1]] (i.e. the CSR format).
+errors_bin_magic = b'SIXDERRS'
+errors_bin_version = 1
+errors_bin_header_size = 64
+errors_bin_arrays = [
+    ('score', '<f8', 'n'),
+    ('indptr', '<i8', 'n+1'),
+    ('error', '<f8', 'm'),
+    ('im_id', '<i4', 'n'),
+    ('obj_id', '<i4', 'n'),
+    ('est_id', '<i4', 'n'),
+    ('gt_id', '<i4', 'm')
+]
+
+def _errors_bin_lens(n, m):
+    return {'n': n, 'n+1': n + 1, 'm': m}
+
+class ErrorsWriter(object):
+    """
+    Streaming writer of pose errors in the columnar binary format. The errors
+    are appended to temporary column files, which are joined into the output
+    file by close().
+    """
+    def __init__(self, path):
+        """
+        :param path: Path to the output file.
+        """
+        self.path = path
+        self.n = 0 # Number of estimates
+        self.m = 0 # Number of errors
+        self.tmp_mpath = '{}.{}.{{}}.tmp'.format(path, os.getpid())
+        self.files = {}
+        for name, _, _ in errors_bin_arrays:
+            self.files[name] = open(self.tmp_mpath.format(name), 'wb')
+        np.zeros(1, '<i8').tofile(self.files['indptr'])
+
+    def add(self, errors):
+        """
+        :param errors: List of errors of the pose estimates (dictionaries with
+        items 'im_id', 'obj_id', 'est_id', 'score' and 'errors' - as returned
+        by load_errors).
+        """
+        if not len(errors):
+            return
+        lens = [len(e['errors']) for e in errors]
+        cols = {
+            'score': [e['score'] for e in errors],
+            'indptr': self.m + np.cumsum(lens),
+            'im_id': [e['im_id'] for e in errors],
+            'obj_id': [e['obj_id'] for e in errors],
+            'est_id': [e['est_id'] for e in errors],
+            'gt_id': [gt_id for e in errors for gt_id in e['errors'].keys()],
+            'error': [err for e in errors for err in e['errors'].values()]
+        }
+        for name, dtype, _ in errors_bin_arrays:
+            np.asarray(cols[name], dtype).tofile(self.files[name])
+        self.n += len(errors)
+        self.m += sum(lens)
+
+    def add_arrays(self, errors):
+        """
+        :param errors: Errors in the columnar format (as returned by
+        load_errors_bin).
+        """
+        n = len(errors['score'])
+        if n == 0:
+            return
+        indptr = np.asarray(errors['indptr'], np.int64)
+        for name, dtype, _ in errors_bin_arrays:
+            if name == 'indptr':
+                col = self.m + indptr[1:] - indptr[0]
+            elif name in ['error', 'gt_id']:
+                col = errors[name][indptr[0]:indptr[-1]]
+            else:
+                col = errors[name]
+            np.asarray(col, dtype).tofile(self.files[name])
+        self.n += n
+        self.m += int(indptr[-1] - indptr[0])
+
+    def close(self):
+        """
+        Joins the column files into the output file.
+        """
+        if self.files is None:
+            return
+        for f in self.files.values():
+            f.close()
+        header = np.zeros(errors_bin_header_size, np.uint8)
+        header[:8] = np.frombuffer(errors_bin_magic, np.uint8)
+        header[8:32] = np.array([errors_bin_version, self.n, self.m],
+                                '<i8').view(np.uint8)
+        path_tmp = self.tmp_mpath.format('all')
+        with open(path_tmp, 'wb') as f_out:
+            header.tofile(f_out)
+            for name, _, _ in errors_bin_arrays:
+                with open(self.tmp_mpath.format(name), 'rb') as f_in:
+                    shutil.copyfileobj(f_in, f_out, 2 ** 20)
+                os.remove(self.tmp_mpath.format(name))
+        os.rename(path_tmp, self.path)
+        self.files = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        elif self.files is not None: # Do not leave incomplete files
+            for name, f in self.files.items():
+                f.close()
+                os.remove(self.tmp_mpath.format(name))
+            self.files = None
+
+def load_errors_bin(path):
+    """
+    Loads pose errors in the columnar binary format.
+
+    :param path: Path to the file.
+    :return: Dictionary with arrays 'im_id', 'obj_id', 'est_id', 'score',
+    'indptr', 'gt_id' and 'error' (read-only memory maps, see above for
+    details).
+    """
+    data = np.memmap(path, np.uint8, mode='r')
+    if len(data) < errors_bin_header_size or\
+            data[:8].tobytes() != errors_bin_magic:
+        raise ValueError('Not a file with pose errors: ' + path)
+    version, n, m = data[8:32].view('<i8').tolist()
+    if version != errors_bin_version:
+        raise ValueError('Unsupported version of file with pose errors: '
+                         '{} ({})'.format(version, path))
+
+    lens = _errors_bin_lens(n, m)
+    errors = {}
+    offset = errors_bin_header_size
+    for name, dtype, len_key in errors_bin_arrays:
+        size = lens[len_key] * np.dtype(dtype).itemsize
+        errors[name] = data[offset:offset + size].view(dtype)
+        offset += size
+    return errors
+
+def save_errors_bin(path, errors):
+    """
+    Saves pose errors in the columnar binary format.
+
+    :param path: Path to the output file.
+    :param errors: List of errors of the pose estimates (as returned by
+    load_errors).
+    """
+    with ErrorsWriter(path) as w:
+        w.add(errors)
+
+def errors_to_arrays(errors):
+    """
+    :param errors: List of errors of the pose estimates (as returned by
+    load_errors).
+    :return: Errors in the columnar format (as returned by load_errors_bin).
+    """
+    lens = [len(e['errors']) for e in errors]
+    return {
+        'score': np.array([e['score'] for e in errors], np.float64),
+        'indptr': np.concatenate([[0], np.cumsum(lens)]).astype(np.int64),
+        'error': np.array([err for e in errors for err in e['errors'].values()],
+                          np.float64),
+        'im_id': np.array([e['im_id'] for e in errors], np.int32),
+        'obj_id': np.array([e['obj_id'] for e in errors], np.int32),
+        'est_id': np.array([e['est_id'] for e in errors], np.int32),
+        'gt_id': np.array([gt_id for e in errors for gt_id in e['errors'].keys()],
+                          np.int32)
+    }
+
+def errors_from_arrays(errors):
+    """
+    :param errors: Errors in the columnar format (as returned by
+    load_errors_bin).
+    :return: List of errors of the pose estimates (as returned by load_errors).
+    """
+    indptr = np.asarray(errors['indptr']).tolist()
+    gt_ids = np.asarray(errors['gt_id']).tolist()
+    errs = np.asarray(errors['error']).tolist()
+    errors_list = []
+    for i, (im_id, obj_id, est_id, score) in enumerate(zip(
+            np.asarray(errors['im_id']).tolist(),
+            np.asarray(errors['obj_id']).tolist(),
+            np.asarray(errors['est_id']).tolist(),
+            np.asarray(errors['score']).tolist())):
+        s, e = indptr[i], indptr[i + 1]
+        errors_list.append({'im_id': im_id, 'obj_id': obj_id,
+                            'est_id': est_id, 'score': score,
+                            'errors': dict(zip(gt_ids[s:e], errs[s:e]))})
+    return errors_list
+
+def convert_errors(in_path, out_path):
+    """
+    Converts pose errors between the YAML format (.yml) and the columnar binary
+    format (other extensions, e.g. .bin).
+
+    :param in_path: Path to the input file.
+    :param out_path: Path to the output file.
+    """
+    if os.path.splitext(in_path)[1] == '.yml':
+        errors = load_errors(in_path)
+    else:
+        errors = errors_from_arrays(load_errors_bin(in_path))
+    if os.path.splitext(out_path)[1] == '.yml':
+        save_errors(out_path, errors)
+    else:
+        save_errors_bin(out_path, errors)
+
+# Data types of the PLY properties
+ply_dtypes = {
+    'char': 'i1', 'int8': 'i1',
+    'uchar': 'u1', 'uint8': 'u1',
+    'short': 'i2', 'int16': 'i2',
+    'ushort': 'u2', 'uint16': 'u2',
+    'int': 'i4', 'int32': 'i4',
+    'uint': 'u4', 'uint32': 'u4',
+    'float': 'f4', 'float32': 'f4',
+    'double': 'f8', 'float64': 'f8'
+}
+
+def _ply_elem_dtype(props, byte_order, list_len, is_binary=True):
+    """
+    Creates a structured data type of a PLY element.
+
+    :param props: List of properties (name, data type, data type of the list
+    count or None if the property is not a list).
+    :param byte_order: '<' (little endian) or '>' (big endian).
+    :param list_len: Length of the list properties (must be fixed).
+    :param is_binary: If False, all properties are represented by float64
+    (as parsed by np.loadtxt from an ASCII PLY).
+    :return: Numpy data type.
+    """
+    def prop_dtype(data_type):
+        if not is_binary:
+            return np.float64
+        return np.dtype(ply_dtypes[data_type]).newbyteorder(byte_order)
+
+    fields = []
+    for name, data_type, count_type in props:
+        if count_type is None:
+            fields.append((name, prop_dtype(data_type)))
+        else:
+            fields.append((name + '_count', prop_dtype(count_type)))
+            fields.append((name, prop_dtype(data_type), (list_len,)))
+    return np.dtype(fields)
+
 def load_ply(path):
     """
     Loads a 3D mesh model from a PLY file.
@@ -183,143 +908,118 @@ def load_ply(path):
     'pts' (nx3 ndarray), 'normals' (nx3 ndarray), 'colors' (nx3 ndarray),
     'faces' (mx3 ndarray) - the latter three are optional.
     """
-    f = open(path, 'r')
+    f = open(path, 'rb')
 
-    n_pts = 0
-    n_faces = 0
     face_n_corners = 3 # Only triangular faces are supported
-    pt_props = []
-    face_props = []
+    elems = [] # (name, count, properties)
     is_binary = False
-    header_vertex_section = False
-    header_face_section = False
+    byte_order = '<'
 
     # Read header
     while True:
-        line = f.readline().rstrip('\n').rstrip('\r') # Strip the newline character(s)
-        if line.startswith('element vertex'):
-            n_pts = int(line.split()[-1])
-            header_vertex_section = True
-            header_face_section = False
-        elif line.startswith('element face'):
-            n_faces = int(line.split()[-1])
-            header_vertex_section = False
-            header_face_section = True
-        elif line.startswith('element'): # Some other element
-            header_vertex_section = False
-            header_face_section = False
-        elif line.startswith('property') and header_vertex_section:
-            # (name of the property, data type)
-            pt_props.append((line.split()[-1], line.split()[-2]))
-        elif line.startswith('property list') and header_face_section:
-            elems = line.split()
-            if elems[-1] == 'vertex_indices':
-                # (name of the property, data type)
-                face_props.append(('n_corners', elems[2]))
-                for i in range(face_n_corners):
-                    face_props.append(('ind_' + str(i), elems[3]))
-            else:
-                print('Warning: Not supported face property: ' + elems[-1])
+        line = f.readline().decode('ascii')
+        if line == '':
+            print('Error: Unexpected end of the PLY header.')
+            exit(-1)
+        line = line.rstrip('\n').rstrip('\r') # Strip the newline character(s)
+        if line.startswith('element'):
+            elems.append((line.split()[1], int(line.split()[2]), []))
+        elif line.startswith('property list'):
+            # (name of the property, data type, data type of the list count)
+            elem = line.split()
+            elems[-1][2].append((elem[4], elem[3], elem[2]))
+        elif line.startswith('property'):
+            # (name of the property, data type, None)
+            elems[-1][2].append((line.split()[2], line.split()[1], None))
         elif line.startswith('format'):
             if 'binary' in line:
                 is_binary = True
+            if 'big_endian' in line:
+                byte_order = '>'
         elif line.startswith('end_header'):
             break
 
-    # Prepare data structures
-    model = {}
-    model['pts'] = np.zeros((n_pts, 3), np.float)
-    if n_faces > 0:
-        model['faces'] = np.zeros((n_faces, face_n_corners), np.float)
-
-    pt_props_names = [p[0] for p in pt_props]
-    is_normal = False
-    if {'nx', 'ny', 'nz'}.issubset(set(pt_props_names)):
-        is_normal = True
-        model['normals'] = np.zeros((n_pts, 3), np.float)
-
-    is_color = False
-    if {'red', 'green', 'blue'}.issubset(set(pt_props_names)):
-        is_color = True
-        model['colors'] = np.zeros((n_pts, 3), np.float)
+    data = f.read()
+    f.close()
+    if not is_binary:
+        lines = data.decode('ascii').splitlines()
 
-    is_texture = False
-    if {'texture_u', 'texture_v'}.issubset(set(pt_props_names)):
-        is_texture = True
-        model['texture_uv'] = np.zeros((n_pts, 2), np.float)
-
-    formats = { # For binary format
-        'float': ('f', 4),
-        'double': ('d', 8),
-        'int': ('i', 4),
-        'uchar': ('B', 1)
-    }
+    # Load vertices and faces (each element is read at once as a structured
+    # array - the data of other elements are skipped)
+    pts_data = None
+    faces_data = None
+    offset = 0 # Byte offset (binary) or line offset (ASCII) of the element
+    for elem_name, count, props in elems:
+        if elem_name == 'face':
+            for name, _, count_type in props:
+                if count_type is not None and\
+                        name not in ['vertex_indices', 'vertex_index']:
+                    print('Error: Not supported face property: ' + name)
+                    exit(-1)
+        elif any(count_type is not None for _, _, count_type in props):
+            if elem_name == 'vertex' or (is_binary and faces_data is None):
+                print('Error: Not supported list property in element: ' +
+                      elem_name)
+                exit(-1)
 
-    # Load vertices
-    for pt_id in range(n_pts):
-        prop_vals = {}
-        load_props = ['x', 'y', 'z', 'nx', 'ny', 'nz',
-                      'red', 'green', 'blue', 'texture_u', 'texture_v']
-        if is_binary:
-            for prop in pt_props:
-                format = formats[prop[1]]
-                val = struct.unpack(format[0], f.read(format[1]))[0]
-                if prop[0] in load_props:
-                    prop_vals[prop[0]] = val
-        else:
-            elems = f.readline().rstrip('\n').rstrip('\r').split()
-            for prop_id, prop in enumerate(pt_props):
-                if prop[0] in load_props:
-                    prop_vals[prop[0]] = elems[prop_id]
-
-        model['pts'][pt_id, 0] = float(prop_vals['x'])
-        model['pts'][pt_id, 1] = float(prop_vals['y'])
-        model['pts'][pt_id, 2] = float(prop_vals['z'])
-
-        if is_normal:
-            model['normals'][pt_id, 0] = float(prop_vals['nx'])
-            model['normals'][pt_id, 1] = float(prop_vals['ny'])
-            model['normals'][pt_id, 2] = float(prop_vals['nz'])
-
-        if is_color:
-            model['colors'][pt_id, 0] = float(prop_vals['red'])
-            model['colors'][pt_id, 1] = float(prop_vals['green'])
-            model['colors'][pt_id, 2] = float(prop_vals['blue'])
-
-        if is_texture:
-            model['texture_uv'][pt_id, 0] = float(prop_vals['texture_u'])
-            model['texture_uv'][pt_id, 1] = float(prop_vals['texture_v'])
-
-    # Load faces
-    for face_id in range(n_faces):
-        prop_vals = {}
+        dtype = _ply_elem_dtype(props, byte_order, face_n_corners, is_binary)
         if is_binary:
-            for prop in face_props:
-                format = formats[prop[1]]
-                val = struct.unpack(format[0], f.read(format[1]))[0]
-                if prop[0] == 'n_corners':
-                    if val != face_n_corners:
-                        print('Error: Only triangular faces are supported.')
-                        print('Number of face corners: ' + str(val))
-                        exit(-1)
-                else:
-                    prop_vals[prop[0]] = val
+            elem_data = np.frombuffer(data, dtype, count, offset)
+            offset += count * dtype.itemsize
         else:
-            elems = f.readline().rstrip('\n').rstrip('\r').split()
-            for prop_id, prop in enumerate(face_props):
-                if prop[0] == 'n_corners':
-                    if int(elems[prop_id]) != face_n_corners:
+            elem_lines = lines[offset:(offset + count)]
+            offset += count
+            if elem_name not in ['vertex', 'face']:
+                continue
+            if count == 0:
+                elem_data = np.zeros(0, dtype)
+            else:
+                try:
+                    elem_data = np.loadtxt(elem_lines, np.float64, ndmin=2)
+                    elem_data = np.ascontiguousarray(elem_data).view(dtype)[:, 0]
+                except ValueError:
+                    if elem_name == 'face':
                         print('Error: Only triangular faces are supported.')
-                        print('Number of face corners: ' + str(int(elems[prop_id])))
                         exit(-1)
-                else:
-                    prop_vals[prop[0]] = elems[prop_id]
+                    raise
 
-        model['faces'][face_id, 0] = int(prop_vals['ind_0'])
-        model['faces'][face_id, 1] = int(prop_vals['ind_1'])
-        model['faces'][face_id, 2] = int(prop_vals['ind_2'])
+        if elem_name == 'vertex':
+            pts_data = elem_data
+        elif elem_name == 'face':
+            faces_data = elem_data
+        if pts_data is not None and faces_data is not None:
+            break
 
-    f.close()
+    def stack_props(elem_data, names):
+        return np.column_stack([elem_data[name] for name in names]).astype(
+            np.float64).reshape((-1, len(names)))
+
+    # Prepare the model
+    model = {}
+    pt_props_names = [] if pts_data is None else pts_data.dtype.names
+    model['pts'] = np.zeros((0, 3), np.float64)
+    if {'x', 'y', 'z'}.issubset(set(pt_props_names)):
+        model['pts'] = stack_props(pts_data, ['x', 'y', 'z'])
+
+    if {'nx', 'ny', 'nz'}.issubset(set(pt_props_names)):
+        model['normals'] = stack_props(pts_data, ['nx', 'ny', 'nz'])
+
+    if {'red', 'green', 'blue'}.issubset(set(pt_props_names)):
+        model['colors'] = stack_props(pts_data, ['red', 'green', 'blue'])
+
+    if {'texture_u', 'texture_v'}.issubset(set(pt_props_names)):
+        model['texture_uv'] = stack_props(pts_data, ['texture_u', 'texture_v'])
+
+    if faces_data is not None and len(faces_data) > 0:
+        ind_name = [n for n in ['vertex_indices', 'vertex_index']
+                    if n in faces_data.dtype.names][0]
+        n_corners = faces_data[ind_name + '_count']
+        if np.any(n_corners != face_n_corners):
+            print('Error: Only triangular faces are supported.')
+            print('Number of face corners: ' +
+                  str(int(n_corners[n_corners != face_n_corners][0])))
+            exit(-1)
+        model['faces'] = faces_data[ind_name].astype(np.float64)
 
     return model
 
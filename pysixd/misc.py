@@ -3,8 +3,10 @@
 
 import os
 import math
+from collections import OrderedDict
 import numpy as np
 from PIL import Image, ImageDraw
+from scipy import spatial
 from scipy.spatial import distance
 
 def ensure_dir(path):
@@ -40,7 +42,34 @@ def norm_depth(depth, valid_start=0.2, valid_end=1.0):
     depth_n[mask] += valid_start
     return depth_n
 
-def depth_im_to_dist_im(depth_im, K):
+# Cache of the ray scale images (the least recently used one is evicted when
+# the cache is full)
+ray_scale_cache_size = 16
+_ray_scale_cache = OrderedDict()
+
+def get_ray_scale_im(K, im_size):
+    """
+    Returns image with scale factors converting depth to distance, i.e. the
+    value at [y, x] is sqrt(((x - cx) / fx)^2 + ((y - cy) / fy)^2 + 1). The
+    images are cached (keyed by K and im_size).
+
+    :param K: Camera matrix.
+    :param im_size: Image size (width, height).
+    :return: Read-only ray scale image.
+    """
+    key = (tuple(np.asarray(K, np.float64).flatten()), tuple(im_size))
+    ray_scale = _ray_scale_cache.pop(key, None)
+    if ray_scale is None:
+        xs = (np.arange(im_size[0]) - K[0, 2]) * (1.0 / K[0, 0])
+        ys = (np.arange(im_size[1]) - K[1, 2]) * (1.0 / K[1, 1])
+        ray_scale = np.sqrt(np.add.outer(ys ** 2, xs ** 2) + 1.0)
+        ray_scale.flags.writeable = False
+        if len(_ray_scale_cache) >= ray_scale_cache_size:
+            _ray_scale_cache.popitem(last=False)
+    _ray_scale_cache[key] = ray_scale
+    return ray_scale
+
+def depth_im_to_dist_im(depth_im, K, out=None):
     """
     Converts depth image to distance image.
 
@@ -48,18 +77,13 @@ def depth_im_to_dist_im(depth_im, K):
     of the 3D point [X, Y, Z] that projects to pixel [x, y], or 0 if there is
     no such 3D point (this is a typical output of the Kinect-like sensors).
     :param K: Camera matrix.
+    :param out: Optional output array (of the same shape as depth_im).
     :return: Distance image dist_im, where dist_im[y, x] is the distance from
     the camera center to the 3D point [X, Y, Z] that projects to pixel [x, y],
     or 0 if there is no such 3D point.
     """
-    xs = np.tile(np.arange(depth_im.shape[1]), [depth_im.shape[0], 1])
-    ys = np.tile(np.arange(depth_im.shape[0]), [depth_im.shape[1], 1]).T
-
-    Xs = np.multiply(xs - K[0, 2], depth_im) * (1.0 / K[0, 0])
-    Ys = np.multiply(ys - K[1, 2], depth_im) * (1.0 / K[1, 1])
-
-    dist_im = np.linalg.norm(np.dstack((Xs, Ys, depth_im)), axis=2)
-    return dist_im
+    ray_scale = get_ray_scale_im(K, (depth_im.shape[1], depth_im.shape[0]))
+    return np.multiply(depth_im, ray_scale, out=out)
 
 def rgbd_to_point_cloud(K, depth, rgb=np.array([])):
     vs, us = depth.nonzero()
@@ -169,3 +193,32 @@ def calc_pts_diameter2(pts):
     dists = distance.cdist(pts, pts, 'euclidean')
     diameter = np.max(dists)
     return diameter
+
+def calc_pts_diameter3(pts, max_block_elems=2 ** 24):
+    """
+    Calculates diameter of a set of points (i.e. the maximum distance between
+    any two points in the set). The farthest points lie on the convex hull of
+    the set, so only the hull vertices are searched (in blocks to bound the
+    memory). Exact and much faster than calc_pts_diameter and
+    calc_pts_diameter2 for dense point sets.
+
+    :param pts: nx3 ndarray with 3D points.
+    :param max_block_elems: Maximum number of distances calculated at once
+    (2 ** 24 float64 values = 128 MB).
+    :return: Diameter.
+    """
+    pts = np.asarray(pts, np.float64)
+    try:
+        pts = pts[spatial.ConvexHull(pts).vertices]
+    except Exception: # Degenerate set (e.g. planar or with less than 4 points)
+        pass
+
+    # Number of points processed at once
+    block_size = max(1, max_block_elems // max(1, pts.shape[0]))
+
+    max_sq_dist = 0.0
+    for i in range(0, pts.shape[0], block_size):
+        sq_dists = distance.cdist(pts[i:(i + block_size)], pts[i:],
+                                  'sqeuclidean')
+        max_sq_dist = max(max_sq_dist, sq_dists.max())
+    return math.sqrt(max_sq_dist)
@@ -0,0 +1,167 @@
+# Author: Tomas Hodan (hodantom@cmp.felk.cvut.cz)
+# Center for Machine Perception, Czech Technical University in Prague
+
+# Compiled object models. The first time a PLY model is loaded, its data are
+# stored into a sidecar directory next to the PLY file (<name>_compiled), which
+# contains:
+# - pts.npy, normals.npy, colors.npy, texture_uv.npy (float32), faces.npy
+#   (uint32) - loaded as read-only memory maps (i.e. shared by all processes
+#   loading the same model).
+# - info.npz - Size and modification time of the PLY file (the sidecar is
+#   recompiled if they change), and the diameter and the 3D bounding box of
+#   the model.
+#
+# The KD-tree over the model points (e.g. for ADI) is not stored in the sidecar
+# (no pickles are written into the dataset folder) - it is built in memory
+# from the memory-mapped points when requested.
+
+import os
+import shutil
+import tempfile
+import numpy as np
+from scipy.spatial import cKDTree
+from . import inout, misc
+
+# Version of the sidecar format (sidecars of other versions are recompiled)
+version = 3
+
+# Arrays of the model stored in the sidecar
+model_arrays = {
+    'pts': np.float32,
+    'normals': np.float32,
+    'colors': np.float32,
+    'texture_uv': np.float32,
+    'faces': np.uint32
+}
+
+# Loaded models indexed by the path to the PLY file
+_models = {}
+
+def get_sidecar_path(path):
+    """
+    :param path: Path to a PLY file.
+    :return: Path to the sidecar directory of the compiled model.
+    """
+    return os.path.splitext(path)[0] + '_compiled'
+
+def calc_model_bbox(pts):
+    """
+    :param pts: nx3 ndarray with 3D points.
+    :return: 3D bounding box [min_x, min_y, min_z, size_x, size_y, size_z].
+    """
+    bb_min = pts.min(axis=0)
+    return np.concatenate([bb_min, pts.max(axis=0) - bb_min])
+
+def load_ply_model(path):
+    """
+    Loads a PLY model with the same data as stored in the sidecar.
+
+    :param path: Path to a PLY file.
+    :return: The loaded model (see load_model) with the arrays held in memory.
+    """
+    model_ply = inout.load_ply(path)
+    model = {}
+    for name, dtype in model_arrays.items():
+        if name in model_ply.keys():
+            model[name] = np.ascontiguousarray(model_ply[name], dtype)
+
+    # The derived data are calculated from the stored (float32) points
+    pts = model['pts'].astype(np.float64)
+    model['diameter'] = float(misc.calc_pts_diameter3(pts))
+    model['bbox'] = calc_model_bbox(pts)
+    return model
+
+def compile_model(path, model=None):
+    """
+    Loads a PLY model and stores it into the sidecar directory.
+
+    :param path: Path to a PLY file.
+    :param model: Already loaded model (see load_ply_model).
+    """
+    st = os.stat(path)
+    if model is None:
+        model = load_ply_model(path)
+
+    # The sidecar is written into a temporary directory which is then renamed
+    # (other processes may compile the same model at the same time)
+    sidecar_path = get_sidecar_path(path)
+    tmp_path = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        os.chmod(tmp_path, 0o755)
+        for name in model_arrays.keys():
+            if name in model.keys():
+                np.save(os.path.join(tmp_path, name + '.npy'), model[name])
+        np.savez(os.path.join(tmp_path, 'info.npz'), version=np.array(version),
+                 ply_size=np.array(st.st_size), ply_mtime=np.array(st.st_mtime),
+                 diameter=np.array(model['diameter']), bbox=model['bbox'])
+    except Exception:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    if _is_compiled(path): # Compiled by another process in the meantime
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        return
+
+    # An outdated sidecar is first moved away (renaming is atomic)
+    if os.path.isdir(sidecar_path):
+        old_path = tempfile.mkdtemp(dir=os.path.dirname(sidecar_path))
+        try:
+            os.rename(sidecar_path, os.path.join(old_path, 'old'))
+        except OSError:
+            pass
+        shutil.rmtree(old_path, ignore_errors=True)
+    try:
+        os.rename(tmp_path, sidecar_path)
+    except OSError: # Compiled by another process in the meantime
+        shutil.rmtree(tmp_path, ignore_errors=True)
+
+def _is_compiled(path):
+    info_path = os.path.join(get_sidecar_path(path), 'info.npz')
+    if not os.path.isfile(info_path):
+        return False
+    st = os.stat(path)
+    info = np.load(info_path)
+    return int(info['version']) == version and\
+           int(info['ply_size']) == st.st_size and\
+           float(info['ply_mtime']) == st.st_mtime
+
+def load_model(path, load_kdtree=False):
+    """
+    Loads a compiled object model (the model is compiled if needed).
+
+    :param path: Path to a PLY file.
+    :param load_kdtree: Whether to build also the KD-tree over the model
+    points.
+    :return: The loaded model given by a dictionary with the same items as
+    returned by inout.load_ply ('pts', 'faces' and optionally 'normals',
+    'colors', 'texture_uv' - read-only memory maps) and with items 'diameter',
+    'bbox' (see calc_model_bbox) and 'kdtree' (if load_kdtree is True). If the
+    sidecar cannot be written (e.g. to a read-only dataset folder), the model
+    is loaded from the PLY file and held in memory.
+    """
+    key = os.path.abspath(path)
+    model = _models.get(key)
+    sidecar_path = get_sidecar_path(path)
+    if model is None and not _is_compiled(path):
+        model = load_ply_model(path)
+        try:
+            compile_model(path, model)
+            model = None # Loaded from the sidecar (as memory maps)
+        except (IOError, OSError): # E.g. a read-only dataset folder
+            _models[key] = model
+
+    if model is None:
+        model = {}
+        for name in model_arrays.keys():
+            array_path = os.path.join(sidecar_path, name + '.npy')
+            if os.path.isfile(array_path):
+                model[name] = np.load(array_path, mmap_mode='r')
+        info = np.load(os.path.join(sidecar_path, 'info.npz'))
+        model['diameter'] = float(info['diameter'])
+        model['bbox'] = info['bbox']
+        _models[key] = model
+
+    if load_kdtree and model.get('kdtree') is None:
+        model['kdtree'] = cKDTree(np.asarray(model['pts'], np.float64))
+
+    return model
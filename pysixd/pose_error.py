@@ -9,8 +9,36 @@ import numpy as np
 from scipy import spatial
 from . import renderer, misc, visibility
 
+# Maximum number of point distances calculated at once by the batch error
+# functions (to bound memory)
+max_batch_dists = 2**20
+
+def _calc_roi(model, im_size, K, poses, margin=1):
+    """
+    Calculates the union of the 2D bounding boxes of the model projections.
+
+    :param model: Object model.
+    :param im_size: Image size (width, height).
+    :param K: Camera matrix.
+    :param poses: List of poses given by tuples (R, t).
+    :param margin: Margin added to the bounding box [px].
+    :return: The union box (x, y, width, height) clipped to the image (width or
+    height is <= 0 if the box is outside the image), or None if the projection
+    of the model is not well defined (i.e. a model point is behind the camera).
+    """
+    bboxes = []
+    for R, t in poses:
+        if misc.transform_pts_Rt(model['pts'], R, t)[:, 2].min() <= 0:
+            return None
+        bboxes.append(misc.calc_pose_2d_bbox(model, im_size, K, R, t))
+    x1 = max(min([bb[0] for bb in bboxes]) - margin, 0)
+    y1 = max(min([bb[1] for bb in bboxes]) - margin, 0)
+    x2 = min(max([bb[0] + bb[2] for bb in bboxes]) + margin, im_size[0] - 1)
+    y2 = min(max([bb[1] + bb[3] for bb in bboxes]) + margin, im_size[1] - 1)
+    return [int(x1), int(y1), int(x2 - x1 + 1), int(y2 - y1 + 1)]
+
 def vsd(R_est, t_est, R_gt, t_gt, model, depth_test, K, delta, tau,
-        cost_type='tlinear'):
+        cost_type='tlinear', depth_est=None, depth_gt=None, roi=False):
     """
     Visible Surface Discrepancy.
 
@@ -26,22 +54,54 @@ def vsd(R_est, t_est, R_gt, t_gt, model, depth_test, K, delta, tau,
         'tlinear' - Used in the original definition of VSD in:
             Hodan et al., On Evaluation of 6D Object Pose Estimation, ECCVW 2016
         'step' - Used for SIXD Challenge 2017. It is easier to interpret.
+    :param depth_est, depth_gt: Optional pre-rendered depth images of the model
+    in the estimated and the ground truth pose (e.g. slices of the depth stacks
+    returned by renderer.render_batch with clip_near=100, clip_far=10000).
+    They are rendered if not provided.
+    :param roi: Whether to render and process only the region of interest given
+    by the union of the 2D bounding boxes of the model projections at both
+    poses (the pixels outside do not affect the error, which is the same as
+    when the full images are processed).
     :return: Error of pose_est w.r.t. pose_gt.
     """
 
     im_size = (depth_test.shape[1], depth_test.shape[0])
 
+    # Region of interest
+    roi_box = None
+    if roi:
+        roi_box = _calc_roi(model, im_size, K, [(R_est, t_est), (R_gt, t_gt)])
+    if roi_box is not None:
+        x, y, w, h = roi_box
+        if w <= 0 or h <= 0:
+            return 1.0 # The model is not rendered at any of the poses
+
+        # Crop the images
+        depth_test = depth_test[y:(y + h), x:(x + w)]
+        if depth_est is not None:
+            depth_est = depth_est[y:(y + h), x:(x + w)]
+        if depth_gt is not None:
+            depth_gt = depth_gt[y:(y + h), x:(x + w)]
+
     # Render depth images of the model in the estimated and the ground truth pose
-    depth_est = renderer.render(model, im_size, K, R_est, t_est, clip_near=100,
-                                clip_far=10000, mode='depth')
+    if depth_est is None:
+        depth_est = renderer.render(model, im_size, K, R_est, t_est,
+                                    clip_near=100, clip_far=10000, mode='depth',
+                                    roi=roi_box)
 
-    depth_gt = renderer.render(model, im_size, K, R_gt, t_gt, clip_near=100,
-                               clip_far=10000, mode='depth')
+    if depth_gt is None:
+        depth_gt = renderer.render(model, im_size, K, R_gt, t_gt,
+                                   clip_near=100, clip_far=10000, mode='depth',
+                                   roi=roi_box)
 
-    # Convert depth images to distance images
-    dist_test = misc.depth_im_to_dist_im(depth_test, K)
-    dist_gt = misc.depth_im_to_dist_im(depth_gt, K)
-    dist_est = misc.depth_im_to_dist_im(depth_est, K)
+    # Convert depth images to distance images (with the cached ray scale image
+    # of the full image, cropped to the region of interest)
+    ray_scale = misc.get_ray_scale_im(K, im_size)
+    if roi_box is not None:
+        ray_scale = ray_scale[y:(y + h), x:(x + w)]
+    dist_test = depth_test * ray_scale
+    dist_gt = depth_gt * ray_scale
+    dist_est = depth_est * ray_scale
 
     # Visibility mask of the model in the ground truth pose
     visib_gt = visibility.estimate_visib_mask_gt(dist_test, dist_gt, delta)
@@ -80,7 +140,8 @@ def vsd(R_est, t_est, R_gt, t_gt, model, depth_test, K, delta, tau,
         e = 1.0
     return e
 
-def cou(R_est, t_est, R_gt, t_gt, model, im_size, K):
+def cou(R_est, t_est, R_gt, t_gt, model, im_size, K, depth_est=None,
+        depth_gt=None):
     """
     Complement over Union, i.e. the inverse of the Intersection over Union used
     in the PASCAL VOC challenge - by Everingham et al. (IJCV 2010).
@@ -91,19 +152,22 @@ def cou(R_est, t_est, R_gt, t_gt, model, im_size, K):
     is nx3 ndarray with 3D model points.
     :param im_size: Test image size.
     :param K: Camera matrix.
+    :param depth_est, depth_gt: Optional pre-rendered depth images (see vsd).
     :return: Error of pose_est w.r.t. pose_gt.
     """
 
     # Render depth images of the model in the estimated and the ground truth pose
-    d_est = renderer.render(model, im_size, K, R_est, t_est, clip_near=100,
-                            clip_far=10000, mode='depth')
+    if depth_est is None:
+        depth_est = renderer.render(model, im_size, K, R_est, t_est,
+                                    clip_near=100, clip_far=10000, mode='depth')
 
-    d_gt = renderer.render(model, im_size, K, R_gt, t_gt, clip_near=100,
-                           clip_far=10000, mode='depth')
+    if depth_gt is None:
+        depth_gt = renderer.render(model, im_size, K, R_gt, t_gt,
+                                   clip_near=100, clip_far=10000, mode='depth')
 
     # Masks of the rendered model and their intersection and union
-    mask_est = d_est > 0
-    mask_gt = d_gt > 0
+    mask_est = depth_est > 0
+    mask_gt = depth_gt > 0
     inter = np.logical_and(mask_gt, mask_est)
     union = np.logical_or(mask_gt, mask_est)
 
@@ -130,7 +194,35 @@ def add(R_est, t_est, R_gt, t_gt, model):
     e = np.linalg.norm(pts_est - pts_gt, axis=1).mean()
     return e
 
-def adi(R_est, t_est, R_gt, t_gt, model):
+def get_model_kdtree(model):
+    """
+    Returns KD-tree over the model points (in the model coordinate system). The
+    tree is built once and cached in the model dictionary (item 'kdtree', which
+    is also provided by model_store.load_model).
+
+    :param model: Object model given by a dictionary where item 'pts'
+    is nx3 ndarray with 3D model points.
+    :return: scipy.spatial.cKDTree.
+    """
+    if model.get('kdtree') is None:
+        model['kdtree'] = spatial.cKDTree(np.asarray(model['pts'], np.float64))
+    return model['kdtree']
+
+def _query_nn_dists(nn_index, pts, workers=1):
+    """
+    :param nn_index: scipy.spatial.cKDTree.
+    :param pts: nx3 ndarray with query points.
+    :param workers: Number of threads (-1 = all CPU cores).
+    :return: Distances to the nearest neighbors.
+    """
+    if workers == 1:
+        return nn_index.query(pts, k=1)[0]
+    try:
+        return nn_index.query(pts, k=1, workers=workers)[0]
+    except TypeError: # SciPy < 1.6
+        return nn_index.query(pts, k=1, n_jobs=workers)[0]
+
+def adi(R_est, t_est, R_gt, t_gt, model, workers=1):
     """
     Average Distance of Model Points for objects with indistinguishable views
     - by Hinterstoisser et al. (ACCV 2012).
@@ -139,14 +231,21 @@ def adi(R_est, t_est, R_gt, t_gt, model):
     :param R_gt, t_gt: GT pose (3x3 rot. matrix and 3x1 trans. vector).
     :param model: Object model given by a dictionary where item 'pts'
     is nx3 ndarray with 3D model points.
+    :param workers: Number of threads used for the nearest neighbor search
+    (-1 = all CPU cores).
     :return: Error of pose_est w.r.t. pose_gt.
     """
-    pts_est = misc.transform_pts_Rt(model['pts'], R_est, t_est)
-    pts_gt = misc.transform_pts_Rt(model['pts'], R_gt, t_gt)
+    # The error is invariant to applying the inverse of the estimated pose to
+    # both sets of points - the model points transformed by the GT pose are
+    # therefore mapped to the model coordinate system of the estimated pose,
+    # where the KD-tree over the model points is reused
+    R_rel = R_est.T.dot(R_gt)
+    t_rel = R_est.T.dot(t_gt.reshape((3, 1)) - t_est.reshape((3, 1)))
+    pts_gt = misc.transform_pts_Rt(model['pts'], R_rel, t_rel)
 
-    # Calculate distances to the nearest neighbors from pts_gt to pts_est
-    nn_index = spatial.cKDTree(pts_est)
-    nn_dists, _ = nn_index.query(pts_gt, k=1)
+    # Calculate distances to the nearest neighbors from pts_gt to the model
+    # points
+    nn_dists = _query_nn_dists(get_model_kdtree(model), pts_gt, workers)
 
     e = nn_dists.mean()
     return e
@@ -177,3 +276,119 @@ def te(t_est, t_gt):
     assert(t_est.size == t_gt.size == 3)
     error = np.linalg.norm(t_gt - t_est)
     return error
+
+def _pose_stack(Rs, ts):
+    """
+    :param Rs: List or nx3x3 ndarray with rotation matrices.
+    :param ts: List or nx3x1 ndarray with translation vectors.
+    :return: nx3x3 ndarray with rotation matrices, nx3 ndarray with translation
+    vectors.
+    """
+    Rs = np.asarray(Rs, np.float64).reshape((-1, 3, 3))
+    ts = np.asarray(ts, np.float64).reshape((-1, 3))
+    assert(len(Rs) == len(ts))
+    return Rs, ts
+
+def add_batch(R_ests, t_ests, R_gts, t_gts, model):
+    """
+    ADD (see add()) of n estimated poses w.r.t. m GT poses.
+
+    :param R_ests, t_ests: Estimated poses (nx3x3 and nx3x1 ndarray).
+    :param R_gts, t_gts: GT poses (mx3x3 and mx3x1 ndarray).
+    :param model: Object model given by a dictionary where item 'pts'
+    is nx3 ndarray with 3D model points.
+    :return: nxm ndarray with errors.
+    """
+    R_ests, t_ests = _pose_stack(R_ests, t_ests)
+    R_gts, t_gts = _pose_stack(R_gts, t_gts)
+    n, m = len(R_ests), len(R_gts)
+    pts = model['pts']
+
+    # The squared distance of a point p is |dR p + dt|^2 = p^T A p + b^T p + c,
+    # where dR = R_est - R_gt, dt = t_est - t_gt, A = dR^T dR, b = 2 dR^T dt
+    # and c = dt^T dt, i.e. a linear function of the monomials of p (the
+    # distances for all pose pairs are then given by one matrix product)
+    R_diffs = (R_ests[:, None] - R_gts[None, :]).reshape((-1, 3, 3))
+    t_diffs = (t_ests[:, None] - t_gts[None, :]).reshape((-1, 3))
+    A = np.einsum('kji,kjl->kil', R_diffs, R_diffs)
+    b = 2.0 * np.einsum('kji,kj->ki', R_diffs, t_diffs)
+    c = (t_diffs ** 2).sum(axis=1)
+    coefs = np.stack([A[:, 0, 0], A[:, 1, 1], A[:, 2, 2], 2.0 * A[:, 0, 1],
+                      2.0 * A[:, 0, 2], 2.0 * A[:, 1, 2], b[:, 0], b[:, 1],
+                      b[:, 2], c])
+
+    dist_sums = np.zeros(n * m)
+    chunk_size = max(1, max_batch_dists // max(1, n * m))
+    for i in range(0, len(pts), chunk_size):
+        x, y, z = np.asarray(pts[i:(i + chunk_size)], np.float64).T
+        monomials = np.column_stack([x * x, y * y, z * z, x * y, x * z, y * z,
+                                     x, y, z, np.ones(len(x))])
+        sq_dists = monomials.dot(coefs)
+        np.maximum(sq_dists, 0.0, out=sq_dists) # Avoid negative rounding errors
+        dist_sums += np.sqrt(sq_dists).sum(axis=0)
+    return (dist_sums / len(pts)).reshape((n, m))
+
+def adi_batch(R_ests, t_ests, R_gts, t_gts, model, workers=1):
+    """
+    ADI (see adi()) of n estimated poses w.r.t. m GT poses.
+
+    :param R_ests, t_ests: Estimated poses (nx3x3 and nx3x1 ndarray).
+    :param R_gts, t_gts: GT poses (mx3x3 and mx3x1 ndarray).
+    :param model: Object model given by a dictionary where item 'pts'
+    is nx3 ndarray with 3D model points.
+    :param workers: Number of threads used for the nearest neighbor search
+    (-1 = all CPU cores).
+    :return: nxm ndarray with errors.
+    """
+    R_ests, t_ests = _pose_stack(R_ests, t_ests)
+    R_gts, t_gts = _pose_stack(R_gts, t_gts)
+    n, m = len(R_ests), len(R_gts)
+    pts = np.asarray(model['pts'], np.float64)
+    nn_index = get_model_kdtree(model)
+
+    # Transformations of the model points in the GT poses to the model
+    # coordinate system of the estimated poses (see adi())
+    R_rels = np.einsum('nji,mjk->nmik', R_ests, R_gts).reshape((-1, 3))
+    t_rels = np.einsum('nji,nmj->nmi', R_ests,
+                       t_gts[None, :] - t_ests[:, None]).reshape((-1, 3))
+
+    # The pose pairs are processed in chunks
+    errs = np.zeros(n * m)
+    chunk_size = 3 * max(1, max_batch_dists // max(1, len(pts)))
+    for i in range(0, 3 * n * m, chunk_size):
+        pts_gts = pts.dot(R_rels[i:(i + chunk_size)].T).reshape(
+            (len(pts), -1, 3)) + t_rels[(i // 3):((i + chunk_size) // 3)]
+        nn_dists = _query_nn_dists(nn_index, pts_gts.reshape((-1, 3)), workers)
+        errs[(i // 3):((i + chunk_size) // 3)] =\
+            nn_dists.reshape((len(pts), -1)).mean(axis=0)
+    return errs.reshape((n, m))
+
+def re_batch(R_ests, R_gts):
+    """
+    Rotational Error (see re()) of n estimated rotations w.r.t. m GT rotations.
+
+    :param R_ests: nx3x3 ndarray with estimated rotation matrices.
+    :param R_gts: mx3x3 ndarray with GT rotation matrices.
+    :return: nxm ndarray with errors [deg].
+    """
+    R_ests = np.asarray(R_ests, np.float64).reshape((-1, 3, 3))
+    R_gts = np.asarray(R_gts, np.float64).reshape((-1, 3, 3))
+
+    # trace(R_est * R_gt^T) is the sum of the element-wise products
+    # (the inverse of a rotation matrix is its transpose)
+    error_cos = 0.5 * (np.einsum('nij,mij->nm', R_ests, R_gts) - 1.0)
+    error_cos = np.clip(error_cos, -1.0, 1.0) # Avoid invalid values due to numerical errors
+    return np.degrees(np.arccos(error_cos)) # [rad] -> [deg]
+
+def te_batch(t_ests, t_gts):
+    """
+    Translational Error (see te()) of n estimated translations w.r.t. m GT
+    translations.
+
+    :param t_ests: nx3x1 ndarray with estimated translation vectors.
+    :param t_gts: mx3x1 ndarray with GT translation vectors.
+    :return: nxm ndarray with errors.
+    """
+    t_ests = np.asarray(t_ests, np.float64).reshape((-1, 3))
+    t_gts = np.asarray(t_gts, np.float64).reshape((-1, 3))
+    return np.linalg.norm(t_ests[:, None] - t_gts[None, :], axis=2)
@@ -1,6 +1,9 @@
 # Author: Tomas Hodan (hodantom@cmp.felk.cvut.cz)
 # Center for Machine Perception, Czech Technical University in Prague
 
+import numpy as np
+from scipy import sparse
+
 def match_poses(errs, error_thresh, max_ests_count=-1, gt_valid_mask=None):
 
     # Sort the estimated poses by decreasing confidence score
@@ -34,3 +37,204 @@ def match_poses(errs, error_thresh, max_ests_count=-1, gt_valid_mask=None):
                             'error': best_error,
                             'error_norm': best_error_norm})
     return matches
+
+def _get_candidate_pairs(errors, scores, max_ests_count=-1, est_groups=None):
+    """
+    :return: Tuple (pair_ests, pair_gts, pair_errors, est_ranks) with the
+    candidate pairs of estimated and GT poses (i.e. pairs with a defined error
+    and with the estimated pose among max_ests_count estimated poses with the
+    highest score in its group) and with the rank of each estimated pose by
+    decreasing score. See match_poses_batch for the parameters.
+    """
+    scores = np.asarray(scores, np.float64)
+    n_ests = scores.shape[0]
+
+    # Defined errors (i.e. candidate pairs of estimated and GT poses)
+    if sparse.issparse(errors):
+        errors = errors.tocoo()
+        pair_ests, pair_gts, pair_errors = errors.row, errors.col, errors.data
+    else:
+        errors = np.asarray(errors)
+        pair_ests, pair_gts = np.nonzero(np.isfinite(errors))
+        pair_errors = errors[pair_ests, pair_gts]
+    pair_errors = np.asarray(pair_errors, np.float64)
+
+    # Rank of the estimated poses by decreasing confidence score (the sort is
+    # stable, i.e. the same as by sorted(..., reverse=True))
+    order = np.argsort(-scores, kind='mergesort')
+    est_ranks = np.empty(n_ests, np.int64)
+    est_ranks[order] = np.arange(n_ests)
+
+    # Keep only the estimated poses with the highest confidence score
+    if max_ests_count > 0:
+        est_ok = np.ones(n_ests, np.bool_)
+        if est_groups is None:
+            est_ok[order[max_ests_count:]] = False
+        else:
+            groups_sorted = np.asarray(est_groups)[order]
+            order_g = np.argsort(groups_sorted, kind='mergesort')
+            groups_g = groups_sorted[order_g]
+            starts = np.concatenate([[True], groups_g[1:] != groups_g[:-1]])
+            start_inds = np.maximum.accumulate(
+                np.where(starts, np.arange(n_ests), 0))
+            ranks_in_group = np.empty(n_ests, np.int64)
+            ranks_in_group[order_g] = np.arange(n_ests) - start_inds
+            est_ok[order] = ranks_in_group < max_ests_count
+        keep = est_ok[pair_ests]
+        pair_ests, pair_gts, pair_errors =\
+            pair_ests[keep], pair_gts[keep], pair_errors[keep]
+
+    return pair_ests, pair_gts, pair_errors, est_ranks
+
+def match_poses_batch(errors, scores, error_thresh, gt_valid_mask=None,
+                      max_ests_count=-1, est_groups=None):
+    """
+    Greedily matches estimated poses to GT poses - the same matching as done
+    by match_poses, but for an error matrix (which can cover e.g. all images
+    and objects of a scene or a dataset).
+
+    :param errors: nxm ndarray with errors of n estimated poses w.r.t. m GT
+    poses (np.inf where the error is not defined, e.g. for GT poses of other
+    objects or in other images), or a scipy.sparse matrix where only the
+    stored entries are defined.
+    :param scores: Confidence scores of the estimated poses (n-vector).
+    :param error_thresh: Threshold of correctness (a scalar or n-vector).
+    :param gt_valid_mask: Mask of valid GT poses (m-vector, all are valid
+    if None).
+    :param max_ests_count: Maximum number of estimated poses with the highest
+    score considered in each group (all are considered if <= 0).
+    :param est_groups: Group labels of the estimated poses (n-vector, e.g.
+    image and object IDs encoded to a single integer). All estimated poses are
+    in one group if None.
+    :return: Tuple (gt_match_ests, gt_match_errors), where gt_match_ests is
+    m-vector with indices of the estimated poses matched to the GT poses
+    (-1 for unmatched GT poses) and gt_match_errors is m-vector with errors of
+    the matched estimated poses (-1 for unmatched GT poses).
+    """
+    n_ests = len(scores)
+    n_gts = errors.shape[1]
+    error_thresh = np.broadcast_to(np.asarray(error_thresh, np.float64),
+                                   (n_ests,))
+    pair_ests, pair_gts, pair_errors, est_ranks = _get_candidate_pairs(
+        errors, scores, max_ests_count, est_groups)
+
+    # An estimated pose is matched to the valid and not yet matched GT pose with
+    # the lowest error if the error is below the threshold. Pairs with errors
+    # above the threshold can be therefore skipped (the GT poses with lower
+    # errors are considered first).
+    keep = pair_errors < error_thresh[pair_ests]
+    if gt_valid_mask is not None and len(gt_valid_mask):
+        keep &= np.asarray(gt_valid_mask, np.bool_)[pair_gts]
+    pair_ests, pair_gts, pair_errors =\
+        pair_ests[keep], pair_gts[keep], pair_errors[keep]
+
+    # Process the pairs in the order of the estimated poses and of the errors
+    pair_order = np.lexsort((pair_gts, pair_errors, est_ranks[pair_ests]))
+
+    gt_match_ests = -np.ones(n_gts, np.int64)
+    gt_match_errors = -np.ones(n_gts, np.float64)
+    gt_taken = np.zeros(n_gts, np.bool_)
+    est_matched = np.zeros(n_ests, np.bool_)
+    for est, gt, error in zip(pair_ests[pair_order].tolist(),
+                              pair_gts[pair_order].tolist(),
+                              pair_errors[pair_order].tolist()):
+        if not est_matched[est] and not gt_taken[gt]:
+            est_matched[est] = True
+            gt_taken[gt] = True
+            gt_match_ests[gt] = est
+            gt_match_errors[gt] = error
+
+    return gt_match_ests, gt_match_errors
+
+def match_poses_sweep(errors, scores, error_threshs, gt_visib_fracts,
+                      visib_gt_mins, max_ests_count=-1, est_groups=None):
+    """
+    Greedy matching (the same as done by match_poses_batch) for all
+    combinations of thresholds of correctness and minimum visible fractions of
+    valid GT poses at once. The matching is done in a single pass over the
+    candidate pairs of estimated and GT poses - the state of the matching
+    (i.e. which estimated and GT poses are already matched) is kept for all
+    the combinations in bits of an integer.
+
+    :param errors: See match_poses_batch.
+    :param scores: See match_poses_batch.
+    :param error_threshs: Thresholds of correctness (t-vector).
+    :param gt_visib_fracts: Visible fractions of the GT poses (m-vector).
+    :param visib_gt_mins: Minimum visible fractions of valid GT poses
+    (v-vector; GT poses with visible fraction >= the minimum are valid).
+    :param max_ests_count: See match_poses_batch.
+    :param est_groups: See match_poses_batch.
+    :return: vxtxm ndarray with indices of the estimated poses matched to the
+    GT poses (-1 for unmatched GT poses) for each combination of the minimum
+    visible fraction and the threshold of correctness.
+    """
+    n_gts = errors.shape[1]
+    error_threshs = np.asarray(error_threshs, np.float64)
+    visib_gt_mins = np.asarray(visib_gt_mins, np.float64)
+    n_threshs = len(error_threshs)
+    n_visibs = len(visib_gt_mins)
+    pair_ests, pair_gts, pair_errors, est_ranks = _get_candidate_pairs(
+        errors, scores, max_ests_count, est_groups)
+
+    # Combination (visib_id, thresh_id) is represented by bit
+    # visib_id * n_threshs + thresh_id. The pair is a candidate for the
+    # combinations with error < threshold and visib_fract >= minimum, which are
+    # given by thresh_id >= pair_thresh_starts and visib_id < gt_visib_ends.
+    thresh_order = np.argsort(error_threshs, kind='mergesort')
+    visib_order = np.argsort(visib_gt_mins, kind='mergesort')
+    pair_thresh_starts = np.searchsorted(error_threshs[thresh_order],
+                                         pair_errors, side='right')
+    gt_visib_ends = np.searchsorted(visib_gt_mins[visib_order],
+                                    np.asarray(gt_visib_fracts, np.float64),
+                                    side='right')
+    pair_visib_ends = gt_visib_ends[pair_gts]
+
+    keep = (pair_thresh_starts < n_threshs) & (pair_visib_ends > 0)
+    pair_ests, pair_gts, pair_errors, pair_thresh_starts, pair_visib_ends =\
+        pair_ests[keep], pair_gts[keep], pair_errors[keep],\
+        pair_thresh_starts[keep], pair_visib_ends[keep]
+
+    # Bit masks of the combinations indexed by [visib_end][thresh_start]
+    row_masks = [((1 << n_threshs) - 1) & ~((1 << k) - 1)
+                 for k in range(n_threshs + 1)]
+    masks = [[sum(m << (v * n_threshs) for v in range(visib_end))
+              for m in row_masks] for visib_end in range(n_visibs + 1)]
+
+    # Process the pairs in the order of the estimated poses and of the errors
+    pair_order = np.lexsort((pair_gts, pair_errors, est_ranks[pair_ests]))
+
+    est_matched = {}
+    gt_taken = {}
+    match_ests, match_gts, match_bits = [], [], []
+    for est, gt, thresh_start, visib_end in zip(
+            pair_ests[pair_order].tolist(), pair_gts[pair_order].tolist(),
+            pair_thresh_starts[pair_order].tolist(),
+            pair_visib_ends[pair_order].tolist()):
+        bits = masks[visib_end][thresh_start] &\
+               ~(est_matched.get(est, 0) | gt_taken.get(gt, 0))
+        if bits:
+            est_matched[est] = est_matched.get(est, 0) | bits
+            gt_taken[gt] = gt_taken.get(gt, 0) | bits
+            match_ests.append(est)
+            match_gts.append(gt)
+            match_bits.append(bits)
+
+    # Decode the bits (split into 62-bit words which fit to int64)
+    n_combs = n_visibs * n_threshs
+    n_words = (n_combs + 61) // 62
+    word_mask = (1 << 62) - 1
+    words = np.array([[(b >> (62 * w)) & word_mask for w in range(n_words)]
+                      for b in match_bits], np.int64).reshape((-1, n_words))
+    comb_bits = (words[:, :, np.newaxis] >> np.arange(62)) & 1
+    comb_bits = comb_bits.reshape((len(match_bits), 62 * n_words))[:, :n_combs]
+    match_inds, combs = np.nonzero(comb_bits)
+
+    gt_match_ests = -np.ones((n_combs, n_gts), np.int64)
+    gt_match_ests[combs, np.array(match_gts, np.int64)[match_inds]] =\
+        np.array(match_ests, np.int64)[match_inds]
+    gt_match_ests = gt_match_ests.reshape((n_visibs, n_threshs, n_gts))
+
+    # Restore the order of the thresholds and the minimum visible fractions
+    gt_match_ests_org = np.empty_like(gt_match_ests)
+    gt_match_ests_org[np.ix_(visib_order, thresh_order)] = gt_match_ests
+    return gt_match_ests_org
@@ -4,17 +4,34 @@
 # Renders rgb/depth image of a 3D mesh model.
 
 import numpy as np
-from glumpy import app, gloo, gl
+from . import renderer_cpu
 
-# Set backend (http://glumpy.readthedocs.io/en/latest/api/app-backends.html)
-app.use('glfw')
-# app.use('qt5')
-# app.use('pyside')
+# The OpenGL rendering is optional - the software renderer from renderer_cpu.py
+# can be used on machines without Glumpy, a display or a GPU
+try:
+    from glumpy import app, gloo, gl
 
-# Set logging level
-from glumpy.log import log
-import logging
-log.setLevel(logging.WARNING) # ERROR, WARNING, DEBUG, INFO
+    # Set backend (http://glumpy.readthedocs.io/en/latest/api/app-backends.html)
+    app.use('glfw')
+    # app.use('qt5')
+    # app.use('pyside')
+
+    # Set logging level
+    from glumpy.log import log
+    import logging
+    log.setLevel(logging.WARNING) # ERROR, WARNING, DEBUG, INFO
+
+    gl_available = True
+except ImportError:
+    gl_available = False
+
+# Rendering backend used when it is not specified in the call of render():
+# 'gl' - OpenGL (Glumpy), 'cpu' - software renderer (renderer_cpu.py)
+default_backend = 'gl' if gl_available else 'cpu'
+
+# Maximum width/height of the frame buffer into which render_batch() renders
+# a tiled atlas of depth images
+max_atlas_size = 8192
 
 # Color vertex shader
 #-------------------------------------------------------------------------------
@@ -200,8 +217,7 @@ def _compute_calib_proj(K, x0, y0, w, h, nc, fc, window_coords='y_down'):
     return proj.T
 
 #-------------------------------------------------------------------------------
-def draw_color(shape, vertex_buffer, index_buffer, texture, mat_model, mat_view,
-               mat_proj, ambient_weight, bg_color, shading):
+def _create_color_program(vertex_buffer, texture, shading):
 
     # Set shader for the selected shading
     if shading == 'flat':
@@ -212,28 +228,66 @@ def draw_color(shape, vertex_buffer, index_buffer, texture, mat_model, mat_view,
     program = gloo.Program(_color_vertex_code, color_fragment_code)
     program.bind(vertex_buffer)
     program['u_light_eye_pos'] = [0, 0, 0] # Camera origin
-    program['u_light_ambient_w'] = ambient_weight
-    program['u_mv'] = _compute_model_view(mat_model, mat_view)
-    program['u_nm'] = _compute_normal_matrix(mat_model, mat_view)
-    program['u_mvp'] = _compute_model_view_proj(mat_model, mat_view, mat_proj)
     if texture is not None:
         program['u_use_texture'] = int(True)
         program['u_texture'] = texture
     else:
         program['u_use_texture'] = int(False)
         program['u_texture'] = np.zeros((1, 1, 4), np.float32)
+    return program
 
-    # Frame buffer object
+def _create_depth_program(vertex_buffer):
+    program = gloo.Program(_depth_vertex_code, _depth_fragment_code)
+    program.bind(vertex_buffer)
+    return program
+
+def _create_fbo(shape):
     color_buf = np.zeros((shape[0], shape[1], 4), np.float32).view(gloo.TextureFloat2D)
     depth_buf = np.zeros((shape[0], shape[1]), np.float32).view(gloo.DepthTexture)
-    fbo = gloo.FrameBuffer(color=color_buf, depth=depth_buf)
+    return gloo.FrameBuffer(color=color_buf, depth=depth_buf)
+
+def _delete_gl_objects(objs):
+    """
+    Releases the GPU memory of OpenGL objects (buffers, textures, programs).
+    Objects which were not uploaded to the GPU (e.g. a texture given as ndarray)
+    are skipped.
+    """
+    for obj in objs:
+        if obj is not None and hasattr(obj, 'delete'):
+            obj.delete()
+
+def _delete_fbo(fbo):
+    """
+    Releases the GPU memory of a frame buffer object and of its buffers.
+    """
+    _delete_gl_objects(list(fbo.color) + [fbo.depth])
+    fbo.delete()
+
+def draw_color(shape, vertex_buffer, index_buffer, texture, mat_model, mat_view,
+               mat_proj, ambient_weight, bg_color, shading, program=None,
+               fbo=None, viewport=None):
+
+    # Compiled program and frame buffer object can be reused from previous calls
+    if program is None:
+        program = _create_color_program(vertex_buffer, texture, shading)
+    if fbo is None:
+        fbo = _create_fbo(shape)
+
+    program['u_light_ambient_w'] = ambient_weight
+    program['u_mv'] = _compute_model_view(mat_model, mat_view)
+    program['u_nm'] = _compute_normal_matrix(mat_model, mat_view)
+    program['u_mvp'] = _compute_model_view_proj(mat_model, mat_view, mat_proj)
+
+    # Frame buffer object
     fbo.activate()
 
     # OpenGL setup
     gl.glEnable(gl.GL_DEPTH_TEST)
     gl.glClearColor(bg_color[0], bg_color[1], bg_color[2], bg_color[3])
     gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
-    gl.glViewport(0, 0, shape[1], shape[0])
+    if viewport is None:
+        viewport = (0, 0, shape[1], shape[0])
+    gl.glViewport(*viewport)
 
     # gl.glEnable(gl.GL_BLEND)
     # gl.glBlendFunc(gl.GL_SRC_ALPHA, gl.GL_ONE_MINUS_SRC_ALPHA)
@@ -263,24 +317,28 @@ def draw_color(shape, vertex_buffer, index_buffer, texture, mat_model, mat_view,
 
     return rgb
 
-def draw_depth(shape, vertex_buffer, index_buffer, mat_model, mat_view, mat_proj):
+def draw_depth(shape, vertex_buffer, index_buffer, mat_model, mat_view, mat_proj,
+               program=None, fbo=None, viewport=None):
+
+    # Compiled program and frame buffer object can be reused from previous calls
+    if program is None:
+        program = _create_depth_program(vertex_buffer)
+    if fbo is None:
+        fbo = _create_fbo(shape)
 
-    program = gloo.Program(_depth_vertex_code, _depth_fragment_code)
-    program.bind(vertex_buffer)
     program['u_mv'] = _compute_model_view(mat_model, mat_view)
     program['u_mvp'] = _compute_model_view_proj(mat_model, mat_view, mat_proj)
 
     # Frame buffer object
-    color_buf = np.zeros((shape[0], shape[1], 4), np.float32).view(gloo.TextureFloat2D)
-    depth_buf = np.zeros((shape[0], shape[1]), np.float32).view(gloo.DepthTexture)
-    fbo = gloo.FrameBuffer(color=color_buf, depth=depth_buf)
     fbo.activate()
 
     # OpenGL setup
     gl.glEnable(gl.GL_DEPTH_TEST)
     gl.glClearColor(0.0, 0.0, 0.0, 0.0)
     gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
-    gl.glViewport(0, 0, shape[1], shape[0])
+    if viewport is None:
+        viewport = (0, 0, shape[1], shape[0])
+    gl.glViewport(*viewport)
 
     # Keep the back-face culling disabled because of objects which do not have
     # well-defined surface (e.g. the lamp from the dataset of Hinterstoisser)
@@ -302,13 +360,66 @@ def draw_depth(shape, vertex_buffer, index_buffer, mat_model, mat_view, mat_proj
 
     return depth
 
+def draw_depth_batch(shape, n_cols, vertex_buffer, index_buffer, mat_model,
+                     mat_views, mat_proj, program, fbo):
+    """
+    Renders depth images of a model in multiple poses into a tiled atlas
+    (one viewport per pose) in a single pass.
+
+    :param shape: Shape (height, width) of one depth image.
+    :param n_cols: Number of tiles in one row of the atlas.
+    :param mat_views: List of view matrices (one per pose).
+    :param fbo: Frame buffer object (it can be larger than the atlas, only its
+    bottom-left part is used).
+    :return: List of the rendered depth images.
+    """
+    n_rows = int(np.ceil(len(mat_views) / float(n_cols)))
+    atlas_shape = (n_rows * shape[0], n_cols * shape[1])
+
+    fbo.activate()
+
+    # OpenGL setup
+    gl.glEnable(gl.GL_DEPTH_TEST)
+    gl.glClearColor(0.0, 0.0, 0.0, 0.0)
+    gl.glClear(gl.GL_COLOR_BUFFER_BIT | gl.GL_DEPTH_BUFFER_BIT)
+
+    # Keep the back-face culling disabled (see draw_depth)
+    gl.glDisable(gl.GL_CULL_FACE)
+
+    # Rendering (the rows of the atlas are counted from the top of the final
+    # image, i.e. from the top of the OpenGL window)
+    for i, mat_view in enumerate(mat_views):
+        row, col = divmod(i, n_cols)
+        gl.glViewport(col * shape[1], (n_rows - 1 - row) * shape[0],
+                      shape[1], shape[0])
+        program['u_mv'] = _compute_model_view(mat_model, mat_view)
+        program['u_mvp'] = _compute_model_view_proj(mat_model, mat_view, mat_proj)
+        program.draw(gl.GL_TRIANGLES, index_buffer)
+
+    # Retrieve the contents of the FBO texture
+    atlas = np.zeros((atlas_shape[0], atlas_shape[1], 4), dtype=np.float32)
+    gl.glReadPixels(0, 0, atlas_shape[1], atlas_shape[0], gl.GL_RGBA,
+                    gl.GL_FLOAT, atlas)
+    atlas.shape = atlas_shape[0], atlas_shape[1], 4
+    atlas = atlas[::-1, :, 0] # Depth is saved in the first channel
+
+    fbo.deactivate()
+
+    depths = []
+    for i in range(len(mat_views)):
+        row, col = divmod(i, n_cols)
+        depths.append(atlas[row * shape[0]:(row + 1) * shape[0],
+                            col * shape[1]:(col + 1) * shape[1]])
+    return depths
+
 #-------------------------------------------------------------------------------
-def render(model, im_size, K, R, t, clip_near=100, clip_far=2000,
-           texture=None, surf_color=None, bg_color=(0.0, 0.0, 0.0, 0.0),
-           ambient_weight=0.5, shading='flat', mode='rgb+depth'):
+def _prepare_vertices(model, texture, surf_color, shading, mode):
+    """
+    Prepares the vertex data and the texture of a model for rendering.
 
-    # Process input data
-    #---------------------------------------------------------------------------
+    :return: Structured ndarray with the vertex data and the texture (flipped
+    and with values in [0, 1]) or None.
+    """
     # Make sure vertices and faces are provided in the model
     assert({'pts', 'faces'}.issubset(set(model.keys())))
 
@@ -326,7 +437,7 @@ def render(model, im_size, K, R, t, clip_near=100, clip_far=2000,
                 assert(model['pts'].shape[0] == model['colors'].shape[0])
                 colors = model['colors']
                 if colors.max() > 1.0:
-                    colors /= 255.0 # Color values are expected in range [0, 1]
+                    colors = colors / 255.0 # Color values are expected in range [0, 1]
             else:
                 colors = np.ones((model['pts'].shape[0], 3), np.float32) * 0.5
         else:
@@ -352,14 +463,9 @@ def render(model, im_size, K, R, t, clip_near=100, clip_far=2000,
             vertices = np.array(zip(model['pts'], model['normals'],
                                     colors, texture_uv), vertices_type)
 
-    # Rendering
-    #---------------------------------------------------------------------------
-    render_rgb = mode in ['rgb', 'rgb+depth']
-    render_depth = mode in ['depth', 'rgb+depth']
-
-    # Model matrix
-    mat_model = np.eye(4, dtype=np.float32) # From object space to world space
+    return vertices, texture
 
+def _compute_view_matrix(R, t):
     # View matrix (transforming also the coordinate system from OpenCV to
     # OpenGL camera space)
     mat_view = np.eye(4, dtype=np.float32) # From world space to eye space
@@ -369,9 +475,84 @@ def render(model, im_size, K, R, t, clip_near=100, clip_far=2000,
     mat_view = yz_flip.dot(mat_view) # OpenCV to OpenGL camera system
     mat_view = mat_view.T # OpenGL expects column-wise matrix format
 
+    return mat_view
+
+def _compute_roi_viewport(im_size, roi):
+    """
+    Calculates shape of the frame buffer and the OpenGL viewport for rendering
+    a region of the image.
+
+    :param im_size: Image size (width, height).
+    :param roi: Region of the image (x, y, width, height) or None (full image).
+    :return: Shape (height, width) of the frame buffer and the viewport
+    (x, y, width, height) - in OpenGL window coordinates, i.e. with the origin
+    in the bottom left corner.
+    """
+    if roi is None:
+        return (im_size[1], im_size[0]), (0, 0, im_size[0], im_size[1])
+    x, y, w, h = roi
+    return (h, w), (-x, y + h - im_size[1], im_size[0], im_size[1])
+
+#-------------------------------------------------------------------------------
+def render(model, im_size, K, R, t, clip_near=100, clip_far=2000,
+           texture=None, surf_color=None, bg_color=(0.0, 0.0, 0.0, 0.0),
+           ambient_weight=0.5, shading='flat', mode='rgb+depth', backend=None,
+           roi=None):
+    """
+    Renders rgb/depth image of a 3D mesh model.
+
+    :param model: Object model given by a dictionary with items 'pts', 'faces'
+    and optionally 'normals', 'colors' and 'texture_uv'.
+    :param im_size: Image size (width, height).
+    :param K: Camera matrix.
+    :param R, t: Pose of the model (3x3 rot. matrix and 3x1 trans. vector).
+    :param clip_near, clip_far: Near and far clipping planes.
+    :param texture, surf_color: Texture image or a uniform surface color.
+    :param bg_color: Background color (RGBA).
+    :param ambient_weight: Weight of the ambient light.
+    :param shading: 'flat' or 'phong'.
+    :param mode: 'rgb', 'depth' or 'rgb+depth'.
+    :param backend: 'gl' or 'cpu' (None = default_backend).
+    :param roi: Optional region (x, y, width, height) of the image to be
+    rendered. The output is the same as the corresponding crop of the full
+    rendering - the camera matrix is effectively adjusted by shifting the
+    viewport, i.e. the projection of the vertices is not changed.
+    """
+
+    # Select the rendering backend
+    if backend is None:
+        backend = default_backend
+    if backend == 'cpu':
+        return renderer_cpu.render(model, im_size, K, R, t, clip_near, clip_far,
+                                   texture, surf_color, bg_color,
+                                   ambient_weight, shading, mode, roi)
+    elif backend != 'gl':
+        print('Error: Unknown rendering backend.')
+        exit(-1)
+    assert gl_available, 'Glumpy is required for the OpenGL rendering.'
+
+    # Process input data
+    #---------------------------------------------------------------------------
+    vertices, texture = _prepare_vertices(model, texture, surf_color, shading,
+                                          mode)
+
+    # Rendering
+    #---------------------------------------------------------------------------
+    render_rgb = mode in ['rgb', 'rgb+depth']
+    render_depth = mode in ['depth', 'rgb+depth']
+
+    # Model matrix
+    mat_model = np.eye(4, dtype=np.float32) # From object space to world space
+
+    # View matrix
+    mat_view = _compute_view_matrix(R, t)
+
     # Projection matrix
     mat_proj = _compute_calib_proj(K, 0, 0, im_size[0], im_size[1], clip_near, clip_far)
 
+    # Size of the rendered image and the viewport
+    shape, viewport = _compute_roi_viewport(im_size, roi)
+
     # Create buffers
     vertex_buffer = vertices.view(gloo.VertexBuffer)
     index_buffer = model['faces'].flatten().astype(np.uint32).view(gloo.IndexBuffer)
@@ -392,17 +573,17 @@ def render(model, im_size, K, R, t, clip_near=100, clip_far=2000,
     @window.event
     def on_draw(dt):
         window.clear()
-        shape = (im_size[1], im_size[0])
         if render_rgb:
             # Render color image
             global rgb
             rgb = draw_color(shape, vertex_buffer, index_buffer, texture, mat_model,
-                             mat_view, mat_proj, ambient_weight, bg_color, shading)
+                             mat_view, mat_proj, ambient_weight, bg_color, shading,
+                             viewport=viewport)
         if render_depth:
             # Render depth image
             global depth
             depth = draw_depth(shape, vertex_buffer, index_buffer, mat_model,
-                               mat_view, mat_proj)
+                               mat_view, mat_proj, viewport=viewport)
 
     app.run(framecount=0) # The on_draw function is called framecount+1 times
     window.close()
@@ -418,3 +599,279 @@ def render(model, im_size, K, R, t, clip_near=100, clip_far=2000,
     else:
         print('Error: Unknown rendering mode.')
         exit(-1)
+
+def render_batch(model, im_size, K, poses, clip_near=100, clip_far=2000,
+                 backend=None):
+    """
+    Renders depth images of a model in multiple poses at once.
+
+    :param model: Object model.
+    :param im_size: Image size (width, height).
+    :param K: Camera matrix.
+    :param poses: List of poses, each given by a dictionary with items 'R'
+    (3x3 rot. matrix) and 't' (3x1 trans. vector).
+    :param clip_near, clip_far: Near and far clipping planes.
+    :param backend: 'gl' or 'cpu' (None = default_backend).
+    :return: NxHxW ndarray with the depth images.
+    """
+    ren = Renderer(im_size, clip_near, clip_far, backend=backend)
+    ren.add_object(0, model)
+    depths = ren.render_batch(0, K, poses)
+    ren.close()
+    return depths
+
+#-------------------------------------------------------------------------------
+class Renderer(object):
+    """
+    Renderer which keeps one hidden OpenGL context alive and reuses the compiled
+    programs, the vertex/index buffers of the added models (per obj_id) and the
+    frame buffer objects (per image size) across the render calls. Setup cost
+    is therefore paid only once per model (render() creates and destroys
+    everything in each call).
+
+    Usage:
+        ren = Renderer(im_size, clip_near=100, clip_far=10000)
+        ren.add_object(obj_id, model)
+        depth = ren.render(obj_id, K, R, t, mode='depth')
+    """
+    def __init__(self, im_size, clip_near=100, clip_far=2000,
+                 bg_color=(0.0, 0.0, 0.0, 0.0), ambient_weight=0.5,
+                 shading='flat', backend=None):
+        """
+        :param im_size: Default size (width, height) of the rendered images.
+        :param clip_near, clip_far: Near and far clipping planes.
+        :param bg_color, ambient_weight, shading: See render().
+        :param backend: 'gl' or 'cpu' (None = default_backend).
+        """
+        self.im_size = tuple(im_size)
+        self.clip_near = clip_near
+        self.clip_far = clip_far
+        self.bg_color = bg_color
+        self.ambient_weight = ambient_weight
+        self.shading = shading
+        self.backend = default_backend if backend is None else backend
+
+        self.models = {} # Models and their textures/colors (per obj_id)
+        self.vertex_buffers = {}
+        self.index_buffers = {}
+        self.textures = {}
+        self.programs = {} # Compiled programs (per obj_id and image type)
+        self.fbos = {} # Frame buffer objects (per image size)
+
+        # Frame buffer objects for atlases of render_batch (one per tile size,
+        # enlarged when a larger atlas is needed)
+        self.atlas_fbos = {}
+
+        self.window = None
+        if self.backend == 'gl':
+            assert gl_available, 'Glumpy is required for the OpenGL rendering.'
+            self.window = app.Window(visible=False)
+        elif self.backend != 'cpu':
+            print('Error: Unknown rendering backend.')
+            exit(-1)
+
+    def add_object(self, obj_id, model, texture=None, surf_color=None):
+        """
+        Uploads a model to the GPU (if not already added).
+
+        :param obj_id: ID used to refer to the model in render().
+        :param model: Object model (as loaded by inout.load_ply).
+        :param texture, surf_color: See render().
+        """
+        if obj_id in self.models:
+            return
+        self.models[obj_id] = {'model': model, 'texture': texture,
+                               'surf_color': surf_color}
+
+        if self.backend == 'gl':
+            vertices, texture = _prepare_vertices(
+                model, texture, surf_color, self.shading, 'rgb+depth')
+            self.vertex_buffers[obj_id] = vertices.view(gloo.VertexBuffer)
+            self.index_buffers[obj_id] = model['faces'].flatten().astype(
+                np.uint32).view(gloo.IndexBuffer)
+            self.textures[obj_id] = texture
+
+    def remove_object(self, obj_id):
+        """
+        Releases the buffers and programs of a model.
+
+        :param obj_id: ID of the model.
+        """
+        self.models.pop(obj_id, None)
+        _delete_gl_objects([self.programs.pop(k) for k in list(self.programs)
+                            if k[0] == obj_id])
+        _delete_gl_objects([d.pop(obj_id, None) for d in [
+            self.vertex_buffers, self.index_buffers, self.textures]])
+
+    def _get_program(self, obj_id, im_type):
+        key = (obj_id, im_type)
+        if key not in self.programs:
+            if im_type == 'rgb':
+                self.programs[key] = _create_color_program(
+                    self.vertex_buffers[obj_id], self.textures[obj_id],
+                    self.shading)
+            else:
+                self.programs[key] = _create_depth_program(
+                    self.vertex_buffers[obj_id])
+        return self.programs[key]
+
+    def _get_fbo(self, shape):
+        if shape not in self.fbos:
+            self.fbos[shape] = _create_fbo(shape)
+        return self.fbos[shape]
+
+    def _get_atlas_fbo(self, tile_shape, atlas_shape):
+        """
+        Returns a frame buffer object which can hold an atlas of the given shape
+        (the atlas is rendered into its bottom-left part). Only one frame buffer
+        object is kept per tile shape, so the GPU memory is bounded by the
+        number of image sizes and not by the number of rendered poses.
+
+        :param tile_shape: Shape (height, width) of one image in the atlas.
+        :param atlas_shape: Shape (height, width) of the atlas.
+        :return: Frame buffer object.
+        """
+        fbo_shape, fbo = self.atlas_fbos.get(tile_shape, ((0, 0), None))
+        if atlas_shape[0] > fbo_shape[0] or atlas_shape[1] > fbo_shape[1]:
+            if fbo is not None:
+                _delete_fbo(fbo)
+            fbo_shape = (max(fbo_shape[0], atlas_shape[0]),
+                         max(fbo_shape[1], atlas_shape[1]))
+            fbo = _create_fbo(fbo_shape)
+            self.atlas_fbos[tile_shape] = (fbo_shape, fbo)
+        return fbo
+
+    def render(self, obj_id, K, R, t, mode='rgb+depth', im_size=None,
+               roi=None):
+        """
+        Renders an added model.
+
+        :param obj_id: ID of the model (see add_object()).
+        :param K: Camera matrix.
+        :param R, t: Pose of the model (3x3 rot. matrix and 3x1 trans. vector).
+        :param mode: 'rgb', 'depth' or 'rgb+depth'.
+        :param im_size: Image size (None = the default size).
+        :param roi: Optional region of the image to be rendered (see render()).
+        :return: Rendered rgb and/or depth image (as returned by render()).
+        """
+        if im_size is None:
+            im_size = self.im_size
+
+        if self.backend == 'cpu':
+            m = self.models[obj_id]
+            return renderer_cpu.render(
+                m['model'], im_size, K, R, t, self.clip_near, self.clip_far,
+                m['texture'], m['surf_color'], self.bg_color,
+                self.ambient_weight, self.shading, mode, roi)
+
+        if mode not in ['rgb', 'depth', 'rgb+depth']:
+            print('Error: Unknown rendering mode.')
+            exit(-1)
+        render_rgb = mode in ['rgb', 'rgb+depth']
+        render_depth = mode in ['depth', 'rgb+depth']
+
+        shape, viewport = _compute_roi_viewport(im_size, roi)
+        mat_model = np.eye(4, dtype=np.float32)
+        mat_view = _compute_view_matrix(R, t)
+        mat_proj = _compute_calib_proj(K, 0, 0, im_size[0], im_size[1],
+                                       self.clip_near, self.clip_far)
+        vertex_buffer = self.vertex_buffers[obj_id]
+        index_buffer = self.index_buffers[obj_id]
+        fbo = self._get_fbo(shape)
+
+        out = {}
+
+        @self.window.event
+        def on_draw(dt):
+            self.window.clear()
+            if render_rgb:
+                out['rgb'] = draw_color(
+                    shape, vertex_buffer, index_buffer, self.textures[obj_id],
+                    mat_model, mat_view, mat_proj, self.ambient_weight,
+                    self.bg_color, self.shading,
+                    self._get_program(obj_id, 'rgb'), fbo, viewport)
+            if render_depth:
+                out['depth'] = draw_depth(
+                    shape, vertex_buffer, index_buffer, mat_model, mat_view,
+                    mat_proj, self._get_program(obj_id, 'depth'), fbo, viewport)
+
+        app.run(framecount=0) # The on_draw function is called framecount+1 times
+
+        if mode == 'rgb':
+            return out['rgb']
+        elif mode == 'depth':
+            return out['depth']
+        else:
+            return out['rgb'], out['depth']
+
+    def render_batch(self, obj_id, K, poses, im_size=None):
+        """
+        Renders depth images of an added model in multiple poses. With the
+        OpenGL backend, the images are rendered in a single pass into a tiled
+        atlas (or a few atlases if they do not fit into max_atlas_size).
+
+        :param obj_id: ID of the model (see add_object()).
+        :param K: Camera matrix.
+        :param poses: List of poses, each given by a dictionary with items 'R'
+        (3x3 rot. matrix) and 't' (3x1 trans. vector).
+        :param im_size: Image size (None = the default size).
+        :return: NxHxW ndarray with the depth images.
+        """
+        if im_size is None:
+            im_size = self.im_size
+        w, h = im_size
+
+        depths = np.zeros((len(poses), h, w), np.float32)
+        if self.backend == 'cpu':
+            for i, pose in enumerate(poses):
+                depths[i] = self.render(obj_id, K, pose['R'], pose['t'],
+                                        mode='depth', im_size=im_size)
+            return depths
+
+        n_cols = max(1, min(len(poses), max_atlas_size // w))
+        n_per_atlas = n_cols * max(1, max_atlas_size // h)
+
+        mat_model = np.eye(4, dtype=np.float32)
+        mat_proj = _compute_calib_proj(K, 0, 0, w, h,
+                                       self.clip_near, self.clip_far)
+        program = self._get_program(obj_id, 'depth')
+
+        for start in range(0, len(poses), n_per_atlas):
+            poses_atlas = poses[start:(start + n_per_atlas)]
+            mat_views = [_compute_view_matrix(p['R'], p['t'])
+                         for p in poses_atlas]
+            n_rows = int(np.ceil(len(poses_atlas) / float(n_cols)))
+            fbo = self._get_atlas_fbo((h, w), (n_rows * h, n_cols * w))
+
+            out = {}
+
+            @self.window.event
+            def on_draw(dt):
+                self.window.clear()
+                out['depths'] = draw_depth_batch(
+                    (h, w), n_cols, self.vertex_buffers[obj_id],
+                    self.index_buffers[obj_id], mat_model, mat_views, mat_proj,
+                    program, fbo)
+
+            app.run(framecount=0)
+            depths[start:(start + len(poses_atlas))] = out['depths']
+
+        return depths
+
+    def close(self):
+        """
+        Releases all resources and closes the hidden window.
+        """
+        _delete_gl_objects(self.programs.values())
+        _delete_gl_objects(list(self.vertex_buffers.values()) +
+                           list(self.index_buffers.values()) +
+                           list(self.textures.values()))
+        for fbo in list(self.fbos.values()) +\
+                [fbo for _, fbo in self.atlas_fbos.values()]:
+            _delete_fbo(fbo)
+        self.models, self.vertex_buffers, self.index_buffers = {}, {}, {}
+        self.textures, self.programs, self.fbos = {}, {}, {}
+        self.atlas_fbos = {}
+        if self.window is not None:
+            self.window.close()
+            self.window = None
@@ -0,0 +1,295 @@
+# Author: Tomas Hodan (hodantom@cmp.felk.cvut.cz)
+# Center for Machine Perception, Czech Technical University in Prague
+
+# Software (CPU-only) renderer of rgb/depth images of a 3D mesh model.
+#
+# It is a vectorized tile-based z-buffer rasterizer implemented in pure NumPy,
+# which does not need a display, a GPU or an OpenGL context. It follows the
+# conventions of the OpenGL renderer (renderer.py) so the outputs of both
+# renderers match up to the numerical precision:
+# - Pixel [x, y] is sampled at the image coordinates (x + 0.5, y + 0.5).
+# - The depth and the vertex attributes are interpolated perspective-correctly.
+# - Fragments outside the range [clip_near, clip_far] are discarded.
+# - Back-face culling is disabled.
+# - If more triangles project to a pixel at the same depth, the first one wins.
+#
+# Triangles with a vertex behind the camera (i.e. with Z <= 0) are skipped
+# (they do not appear in the SIXD datasets).
+
+import numpy as np
+from . import misc
+
+# Size of the square image tiles [px] to which the triangles are binned
+tile_size = 8
+
+# Maximum number of pixel samples processed at once (bounds the memory usage)
+max_chunk_samples = 2 ** 20
+
+def _setup_triangles(faces, pts_im, pts_z, roi, clip_near, clip_far):
+    """
+    Calculates coefficients of the edge functions and the pixel bounding boxes
+    of the projected triangles.
+
+    :param faces: mx3 ndarray with vertex indices of the triangles.
+    :param pts_im: nx2 ndarray with 2D projections of the vertices.
+    :param pts_z: n ndarray with Z coordinates of the vertices in the camera
+    coordinate system.
+    :param roi: Rendered region of the image (x, y, width, height).
+    :param clip_near, clip_far: Near and far clipping planes.
+    :return: Dictionary with the triangle setup.
+    """
+    x0, y0, w, h = roi
+    xs = pts_im[faces, 0]
+    ys = pts_im[faces, 1]
+    zs = pts_z[faces]
+
+    # Edge i is the edge opposite to vertex i. The edge functions are normalized
+    # by the signed doubled area of the triangle, which makes them equal to the
+    # barycentric coordinates (positive inside the triangle for both windings).
+    ia, ib = [1, 2, 0], [2, 0, 1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        e_a = ys[:, ia] - ys[:, ib]
+        e_b = xs[:, ib] - xs[:, ia]
+        e_c = xs[:, ia] * ys[:, ib] - xs[:, ib] * ys[:, ia]
+        area2 = e_c.sum(axis=1)
+        e_a /= area2[:, None]
+        e_b /= area2[:, None]
+        e_c /= area2[:, None]
+
+        # Range of pixels whose centers may be covered by the triangles
+        col_min = np.maximum(np.ceil(xs.min(axis=1) - 0.5), x0)
+        col_max = np.minimum(np.floor(xs.max(axis=1) - 0.5), x0 + w - 1)
+        row_min = np.maximum(np.ceil(ys.min(axis=1) - 0.5), y0)
+        row_max = np.minimum(np.floor(ys.max(axis=1) - 0.5), y0 + h - 1)
+
+    valid = np.logical_and.reduce([
+        np.all(zs > 0, axis=1),
+        area2 != 0,
+        np.isfinite(area2),
+        zs.max(axis=1) >= clip_near,
+        zs.min(axis=1) <= clip_far,
+        col_min <= col_max,
+        row_min <= row_max
+    ])
+
+    # Samples lying exactly on an edge are assigned to the triangle only if it
+    # is a top or a left edge (i.e. they are not rasterized twice)
+    top_left = np.logical_or(e_a > 0, np.logical_and(e_a == 0, e_b > 0))
+
+    return {
+        'e_a': e_a, 'e_b': e_b, 'e_c': e_c, 'top_left': top_left, 'zs': zs,
+        'valid': valid,
+        'bbox': np.vstack([col_min, row_min, col_max, row_max]).T
+    }
+
+def _rasterize(tris, roi, clip_near, clip_far):
+    """
+    Rasterizes triangles into a z-buffer.
+
+    :param tris: Triangle setup as returned by _setup_triangles().
+    :param roi: Rendered region of the image (x, y, width, height).
+    :param clip_near, clip_far: Near and far clipping planes.
+    :return: Depth image of the region (0 = no surface) and image with indices
+    of the visible triangles (-1 = no surface).
+    """
+    x0, y0, w, h = roi
+    ts = tile_size
+
+    # Bin the triangles to the image tiles
+    tri_ids = np.nonzero(tris['valid'])[0]
+    bbox = tris['bbox'][tri_ids].astype(np.int64)
+    tx0, ty0 = bbox[:, 0] // ts, bbox[:, 1] // ts
+    tx_count = bbox[:, 2] // ts - tx0 + 1
+    tile_counts = tx_count * (bbox[:, 3] // ts - ty0 + 1)
+
+    # (triangle, tile) pairs ordered by the triangle index
+    pair_tri = np.repeat(np.arange(len(tri_ids)), tile_counts)
+    pair_local = np.arange(pair_tri.size) - np.repeat(
+        np.cumsum(tile_counts) - tile_counts, tile_counts)
+    pair_tx = tx0[pair_tri] + pair_local % tx_count[pair_tri]
+    pair_ty = ty0[pair_tri] + pair_local // tx_count[pair_tri]
+
+    # Pixel offsets within a tile
+    off_x = np.tile(np.arange(ts), ts)
+    off_y = np.repeat(np.arange(ts), ts)
+
+    zbuf = np.full(w * h, np.inf)
+    tribuf = np.full(w * h, -1, np.int64)
+
+    chunk_size = max(1, max_chunk_samples // (ts * ts))
+    for start in range(0, pair_tri.size, chunk_size):
+        sl = slice(start, start + chunk_size)
+        t = pair_tri[sl]
+        b = bbox[t]
+        cols = pair_tx[sl, None] * ts + off_x
+        rows = pair_ty[sl, None] * ts + off_y
+
+        # Keep only the samples inside the triangle bounding box
+        mask = np.logical_and.reduce([
+            cols >= b[:, 0:1], rows >= b[:, 1:2],
+            cols <= b[:, 2:3], rows <= b[:, 3:4]
+        ])
+
+        # Coverage test and perspective-correct depth
+        tg = tri_ids[t]
+        xc = cols + 0.5
+        yc = rows + 0.5
+        inv_z = np.zeros(cols.shape)
+        for i in range(3):
+            l_i = tris['e_a'][tg, i, None] * xc + tris['e_b'][tg, i, None] * yc\
+                  + tris['e_c'][tg, i, None]
+            mask &= np.logical_or(l_i > 0, np.logical_and(
+                l_i == 0, tris['top_left'][tg, i, None]))
+            inv_z += l_i / tris['zs'][tg, i, None]
+
+        pair_ids, off_ids = np.nonzero(mask)
+        if pair_ids.size == 0:
+            continue
+        frag_z = 1.0 / inv_z[pair_ids, off_ids]
+        frag_tri = tg[pair_ids]
+        frag_pix = (rows[pair_ids, off_ids] - y0) * w +\
+                   (cols[pair_ids, off_ids] - x0)
+
+        depth_ok = np.logical_and(frag_z >= clip_near, frag_z <= clip_far)
+        frag_z, frag_tri, frag_pix =\
+            frag_z[depth_ok], frag_tri[depth_ok], frag_pix[depth_ok]
+
+        # The closest fragment for each pixel (the first triangle on a tie)
+        order = np.lexsort((frag_tri, frag_z, frag_pix))
+        pix_s = frag_pix[order]
+        first = np.ones(pix_s.size, np.bool_)
+        first[1:] = pix_s[1:] != pix_s[:-1]
+        sel = order[first]
+
+        # Depth test against the fragments from the previous chunks
+        upd = frag_z[sel] < zbuf[frag_pix[sel]]
+        sel = sel[upd]
+        zbuf[frag_pix[sel]] = frag_z[sel]
+        tribuf[frag_pix[sel]] = frag_tri[sel]
+
+    zbuf[tribuf == -1] = 0
+    return zbuf.reshape((h, w)), tribuf.reshape((h, w))
+
+def _interp_weights(tris, tri_ids, xs, ys):
+    """
+    Calculates perspective-correct interpolation weights of the triangle
+    vertices at the centers of the specified pixels.
+
+    :param tris: Triangle setup as returned by _setup_triangles().
+    :param tri_ids: k ndarray with indices of the triangles.
+    :param xs, ys: k ndarrays with pixel coordinates.
+    :return: kx3 ndarray with the interpolation weights.
+    """
+    l = tris['e_a'][tri_ids] * (xs[:, None] + 0.5) +\
+        tris['e_b'][tri_ids] * (ys[:, None] + 0.5) + tris['e_c'][tri_ids]
+    weights = l / tris['zs'][tri_ids]
+    weights /= weights.sum(axis=1)[:, None]
+    return weights
+
+def _normalize(vecs):
+    norms = np.linalg.norm(vecs, axis=1)
+    norms[norms == 0] = 1.0
+    return vecs / norms[:, None]
+
+def render(model, im_size, K, R, t, clip_near=100, clip_far=2000,
+           texture=None, surf_color=None, bg_color=(0.0, 0.0, 0.0, 0.0),
+           ambient_weight=0.5, shading='flat', mode='rgb+depth', roi=None):
+    """
+    Renders rgb/depth image of a 3D mesh model. The parameters and the output
+    are the same as for renderer.render().
+    """
+    if roi is None:
+        roi = (0, 0, im_size[0], im_size[1])
+
+    # Make sure vertices and faces are provided in the model
+    assert({'pts', 'faces'}.issubset(set(model.keys())))
+
+    if mode not in ['rgb', 'depth', 'rgb+depth']:
+        print('Error: Unknown rendering mode.')
+        exit(-1)
+
+    # Project the vertices
+    pts_c = misc.transform_pts_Rt(model['pts'], R, t)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pts_h = K.dot(pts_c.T).T
+        pts_im = pts_h[:, :2] / pts_h[:, 2:3]
+    faces = model['faces'].astype(np.int64)
+
+    tris = _setup_triangles(faces, pts_im, pts_c[:, 2], roi,
+                            clip_near, clip_far)
+    depth, tri_map = _rasterize(tris, roi, clip_near, clip_far)
+    depth = depth.astype(np.float32)
+
+    if mode == 'depth':
+        return depth
+
+    # Shading
+    #---------------------------------------------------------------------------
+    n_pts = model['pts'].shape[0]
+    if texture is not None:
+        if texture.max() > 1.0:
+            texture = texture.astype(np.float32) / 255.0
+        texture_uv = model['texture_uv']
+    elif not surf_color:
+        if 'colors' in model.keys():
+            assert(n_pts == model['colors'].shape[0])
+            colors = model['colors']
+            if colors.max() > 1.0:
+                colors = colors / 255.0 # Color values are expected in range [0, 1]
+        else:
+            colors = np.ones((n_pts, 3), np.float32) * 0.5
+    else:
+        colors = np.tile(list(surf_color)[:3], [n_pts, 1])
+
+    rgb = np.zeros((roi[3], roi[2], 3), np.float64)
+    rgb[:, :] = bg_color[:3]
+
+    ys, xs = np.nonzero(tri_map >= 0)
+    tri_ids = tri_map[ys, xs]
+    face_ids = faces[tri_ids]
+    weights = _interp_weights(tris, tri_ids, xs + roi[0], ys + roi[1])
+
+    def interp(vals):
+        return np.einsum('ij,ijk->ik', weights, vals[face_ids])
+
+    # Vector to the light (placed in the camera origin)
+    light = _normalize(interp(_normalize(-pts_c)))
+
+    if shading == 'flat':
+        # Face normal oriented towards the camera
+        tri_pts = pts_c[face_ids]
+        normals = np.cross(tri_pts[:, 1] - tri_pts[:, 0],
+                           tri_pts[:, 2] - tri_pts[:, 0])
+        flip = np.sum(normals * tri_pts[:, 0], axis=1) > 0
+        normals[flip] *= -1
+    else: # 'phong'
+        # Vertex normals transformed by the same normal matrix as in the
+        # shader of the OpenGL renderer (i.e. including the homogeneous part)
+        normals_c = R.dot(model['normals'].T).T
+        normals_w = 1.0 - normals_c.dot(t.reshape((3,)))
+        normals_c /= np.sqrt(np.sum(normals_c ** 2, axis=1) +
+                             normals_w ** 2)[:, None]
+        normals = interp(normals_c)
+    normals = _normalize(normals)
+
+    light_w = ambient_weight + np.maximum(np.sum(light * normals, axis=1), 0.0)
+    light_w = np.minimum(light_w, 1.0)
+
+    if texture is not None:
+        # Nearest-neighbor texture lookup (the texture is not flipped here,
+        # so the V coordinate is inverted instead)
+        uv = interp(texture_uv)
+        tex_h, tex_w = texture.shape[:2]
+        tex_xs = np.clip(np.floor(uv[:, 0] * tex_w), 0, tex_w - 1).astype(int)
+        tex_ys = np.clip(np.floor(uv[:, 1] * tex_h), 0, tex_h - 1).astype(int)
+        surf = texture[tex_h - 1 - tex_ys, tex_xs, :3]
+    else:
+        surf = interp(colors[:, :3])
+
+    rgb[ys, xs] = light_w[:, None] * surf
+    rgb = np.round(rgb * 255).astype(np.uint8) # Convert to [0, 255]
+
+    if mode == 'rgb':
+        return rgb
+    else:
+        return rgb, depth
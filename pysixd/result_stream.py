@@ -0,0 +1,118 @@
+# Author: Tomas Hodan (hodantom@cmp.felk.cvut.cz)
+# Center for Machine Perception, Czech Technical University in Prague
+
+# Streaming of 6D object pose estimates from result directories in the SIXD
+# format (<result_path>/<scene_id:02d>/<im_id:04d>_<obj_id:02d>.yml). The result
+# files (and optionally the depth images) of the next images are loaded on a
+# pool of threads while the current image is being processed.
+
+import os
+import glob
+import itertools
+import collections
+from multiprocessing.pool import ThreadPool
+from . import inout
+
+def list_results(result_path, scene_ids=None):
+    """
+    Lists result files in a result directory.
+
+    :param result_path: Path to the result directory.
+    :param scene_ids: IDs of the scenes to consider (all if None).
+    :return: List of (scene_id, im_id, obj_id, res_path) sorted by scene ID,
+    image ID and object ID.
+    """
+    res_units = []
+    for scene_dir in glob.glob(os.path.join(result_path, '*')):
+        if not os.path.isdir(scene_dir):
+            continue
+        scene_id = int(os.path.basename(scene_dir))
+        if scene_ids is not None and scene_id not in scene_ids:
+            continue
+        res_paths = glob.glob(os.path.join(scene_dir, '*.yml')) +\
+                    glob.glob(os.path.join(scene_dir, '*.yaml'))
+        for res_path in res_paths:
+            im_id, obj_id = map(int, os.path.basename(res_path).split(
+                '.')[0].split('_')[:2])
+            res_units.append((scene_id, im_id, obj_id, res_path))
+    return sorted(res_units)
+
+def group_by_image(res_units):
+    """
+    :param res_units: List of (scene_id, im_id, obj_id, res_path) (as returned
+    by list_results).
+    :return: List of (scene_id, im_id, [(obj_id, res_path), ...]) (the order of
+    res_units is preserved).
+    """
+    groups = itertools.groupby(res_units, key=lambda u: (u[0], u[1]))
+    return [(scene_id, im_id, [(u[2], u[3]) for u in units])
+            for (scene_id, im_id), units in groups]
+
+def load_image_results(im_task):
+    """
+    Loads results (and the depth image) of one image.
+
+    :param im_task: Tuple (scene_id, im_id, obj_res_paths, depth_path,
+    depth_scale), where obj_res_paths is a list of (obj_id, res_path) and
+    depth_path can be None.
+    :return: Tuple (scene_id, im_id, im_res, depth_im), where im_res is a list
+    of (obj_id, ests) (ests as returned by inout.load_results_sixd17) and
+    depth_im is the depth image in [mm] (None if depth_path is None).
+    """
+    scene_id, im_id, obj_res_paths, depth_path, depth_scale = im_task
+    im_res = [(obj_id, inout.load_results_sixd17(res_path)['ests'])
+              for obj_id, res_path in obj_res_paths]
+    depth_im = None
+    if depth_path is not None:
+        depth_im = inout.load_depth(depth_path, depth_scale=depth_scale) # [mm]
+    return scene_id, im_id, im_res, depth_im
+
+def iter_results(res_units, depth_mpath=None, depth_scale=1.0, n_threads=4,
+                 max_prefetch=8):
+    """
+    Iterates over results grouped by images. The results are loaded in the
+    background, at most max_prefetch images ahead of the consumer (i.e. the
+    memory usage is bounded even if the consumer is slow).
+
+    :param res_units: List of (scene_id, im_id, obj_id, res_path) (e.g. as
+    returned by list_results). The results of one image must be consecutive.
+    :param depth_mpath: Mask of path to the depth images (formatted with
+    scene_id and im_id, e.g. dp['test_depth_mpath']). The depth images are not
+    loaded if None.
+    :param depth_scale: Factor converting the depth images to [mm].
+    :param n_threads: Number of loading threads (0 = loading in the calling
+    thread).
+    :param max_prefetch: Maximum number of images loaded in advance.
+    :return: Generator of (scene_id, im_id, im_res, depth_im) - see
+    load_image_results.
+    """
+    im_tasks = []
+    for scene_id, im_id, obj_res_paths in group_by_image(res_units):
+        depth_path = None
+        if depth_mpath is not None:
+            depth_path = depth_mpath.format(scene_id, im_id)
+        im_tasks.append((scene_id, im_id, obj_res_paths, depth_path,
+                         depth_scale))
+
+    if n_threads == 0:
+        for im_task in im_tasks:
+            yield load_image_results(im_task)
+        return
+
+    pool = ThreadPool(n_threads)
+    try:
+        # Loaded (or being loaded) images in the order of the tasks
+        pending = collections.deque()
+        im_tasks_iter = iter(im_tasks)
+        for im_task in itertools.islice(im_tasks_iter, max(1, max_prefetch)):
+            pending.append(pool.apply_async(load_image_results, (im_task,)))
+        while pending:
+            im_loaded = pending.popleft().get()
+
+            # A new image is loaded only when one is taken by the consumer
+            for im_task in itertools.islice(im_tasks_iter, 1):
+                pending.append(pool.apply_async(load_image_results, (im_task,)))
+            yield im_loaded
+    finally:
+        pool.terminate()
+        pool.join()
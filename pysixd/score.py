@@ -31,12 +31,88 @@ def ap(rec, pre):
     mrec = np.concatenate(([0], np.array(rec)[i], [1]))
     mpre = np.concatenate(([0], np.array(pre)[i], [0]))
     assert(mrec.shape == mpre.shape)
-    for i in range(mpre.size - 3, -1, -1):
-        mpre[i] = max(mpre[i], mpre[i + 1])
+    mpre = np.maximum.accumulate(mpre[::-1])[::-1]
     i = np.nonzero(mrec[1:] != mrec[:-1])[0] + 1
     ap = np.sum((mrec[i] - mrec[i - 1]) * mpre[i])
     return ap
 
+def pr_curves(scores, tps, targets_count, groups=None, groups_count=None):
+    '''
+    Precision/recall curves and Average Precision (AP, calculated as by ap())
+    for groups of detections (e.g. detections of individual objects), all
+    calculated at once.
+
+    :param scores: Confidence scores of the detections (n-vector).
+    :param tps: Flags indicating true positive detections (n-vector).
+    :param targets_count: Number of targets (i.e. objects to be detected) in
+           each group (a scalar or g-vector).
+    :param groups: Group indices of the detections (n-vector with integers in
+           0..g-1; all detections are in one group if None).
+    :param groups_count: Number of groups g (max(groups) + 1 if None).
+    :return: Dictionary with:
+             - 'order': Indices of the detections sorted by group and by
+               decreasing score (the curves are given in this order).
+             - 'group_starts': Index of the first detection of each group in
+               the sorted detections (g-vector).
+             - 'recall', 'precision': Recall and precision after each
+               detection in its group (n-vectors).
+             - 'precision_env': Monotonically decreasing version of the
+               precision (used to calculate AP, see ap()).
+             - 'ap': AP of each group (g-vector).
+    '''
+    scores = np.asarray(scores, np.float64)
+    n = scores.size
+    if groups is None:
+        groups = np.zeros(n, np.int64)
+    groups = np.asarray(groups, np.int64)
+    if groups_count is None:
+        groups_count = groups.max() + 1 if n else 1
+    targets_count = np.broadcast_to(
+        np.asarray(targets_count, np.float64), (groups_count,))
+
+    # Sort by group and by decreasing score (stable for equal scores)
+    order = np.lexsort((-scores, groups))
+    groups_s = groups[order]
+    tps_s = np.asarray(tps, np.bool_)[order].astype(np.float64)
+
+    # Start of each group in the sorted detections (empty groups start where
+    # the next group starts)
+    group_starts = np.searchsorted(groups_s, np.arange(groups_count))
+    starts = group_starts[groups_s]
+
+    # Cumulative counts of true positives and detections within the groups
+    tp_c = np.cumsum(tps_s)
+    tp_c -= np.concatenate([[0], tp_c])[starts]
+    det_c = np.arange(1, n + 1) - starts
+    targets_s = targets_count[groups_s]
+    recall = tp_c / np.maximum(targets_s, 1) * (targets_s > 0)
+    precision = tp_c / det_c
+
+    # Precision envelope - maximum precision at any higher recall within the
+    # group. The groups are separated by adding an offset which increases
+    # towards the beginning of the sorted detections (precision is <= 1).
+    offsets = 2.0 * (groups_count - groups_s)
+    precision_env =\
+        np.maximum.accumulate((precision + offsets)[::-1])[::-1] - offsets
+
+    # AP = sum of the precision envelope at true positives / number of targets
+    # (recall changes only at true positives)
+    ap_sums = np.zeros(groups_count)
+    nonempty = np.flatnonzero(np.bincount(groups_s, minlength=groups_count))
+    if len(nonempty):
+        ap_sums[nonempty] = np.add.reduceat(tps_s * precision_env,
+                                            group_starts[nonempty])
+    aps = ap_sums / np.maximum(targets_count, 1) * (targets_count > 0)
+
+    return {
+        'order': order,
+        'group_starts': group_starts,
+        'recall': recall,
+        'precision': precision,
+        'precision_env': precision_env,
+        'ap': aps
+    }
+
 if __name__ == '__main__':
     # AP test
     tp = np.array([False, True, True, False, True, False])
@@ -46,3 +122,5 @@ if __name__ == '__main__':
     rec = tp_c / tp.size
     pre = tp_c / (fp_c + tp_c)
     print('Average Precision: ' + str(ap(rec, pre)))
+    print('Average Precision (pr_curves): ' +
+          str(pr_curves(np.arange(tp.size, 0, -1), tp, tp.size)['ap'][0]))
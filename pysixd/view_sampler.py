@@ -58,109 +58,266 @@ def fibonacci_sampling(n_pts, radius=1):
 
     return pts
 
+# Refinement levels of the icosahedron (unordered points, faces and levels of
+# the points), each level is calculated from the previous one
+_hinter_levels = []
+
+# Points of the refinement levels in the final order (memoized, see
+# _get_hinter_sphere)
+_hinter_spheres = {}
+
+def _subdivide_icosphere(pts, faces, pts_level, ref_level):
+    '''
+    Replaces each face by 4 new smaller faces. A new point is added in the middle
+    of each edge, the points are numbered in the order in which the edges are
+    first visited when going through the faces.
+
+    :param pts: nx3 ndarray with the points.
+    :param faces: mx3 ndarray with the faces (point indices).
+    :param pts_level: n-vector with the refinement levels of the points.
+    :param ref_level: Refinement level of the new points.
+    :return: Points, faces and levels of the points after the refinement.
+    '''
+    n_pts = pts.shape[0]
+
+    # Edges in the order of visiting - for each face (i, (i + 1) % 3), i = 0..2
+    edges = np.stack([faces, np.roll(faces, -1, axis=1)], axis=2).reshape(-1, 2)
+    edges.sort(axis=1)
+
+    # Unique edges numbered in the order of their first occurrence
+    _, first_inds, edge_inv = np.unique(edges[:, 0] * n_pts + edges[:, 1],
+                                        return_index=True, return_inverse=True)
+    edge_order = np.argsort(first_inds)
+    edge_ids = np.empty(len(first_inds), np.int64)
+    edge_ids[edge_order] = np.arange(len(first_inds))
+    edge_pt_ids = (n_pts + edge_ids[edge_inv.ravel()]).reshape(-1, 3)
+
+    # New points in the middle of the unique edges
+    edges_u = edges[first_inds[edge_order]]
+    pts_new = 0.5 * (pts[edges_u[:, 0]] + pts[edges_u[:, 1]])
+
+    # Each face is replaced by 4 new faces
+    p = np.hstack([faces, edge_pt_ids])
+    faces_new = np.stack([p[:, [0, 3, 5]], p[:, [3, 1, 4]],
+                          p[:, [3, 4, 5]], p[:, [5, 4, 2]]], axis=1)
+
+    return np.vstack([pts, pts_new]), faces_new.reshape(-1, 3),\
+        np.concatenate([pts_level, np.full(len(pts_new), ref_level, np.int64)])
+
+def _order_hinter_pts(pts, faces):
+    '''
+    Orders the points - starting from the top one and adding the connected
+    points (i.e. rings of points with the same graph distance from the top
+    one), each ring sorted by azimuth.
+
+    :param pts: nx3 ndarray with the points.
+    :param faces: mx3 ndarray with the faces (point indices).
+    :return: n-vector with indices of the points in the final order.
+    '''
+    n_pts = pts.shape[0]
+
+    # Point connections (in the compressed sparse row format)
+    conns = np.vstack([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]])
+    conns = np.vstack([conns, conns[:, ::-1]])
+    conns = np.unique(conns[:, 0] * n_pts + conns[:, 1])
+    conns_src, conns_dst = conns // n_pts, conns % n_pts
+    conns_ptr = np.searchsorted(conns_src, np.arange(n_pts + 1))
+
+    # Graph distance of the points from the top point
+    pts_ring = -np.ones(n_pts, np.int64)
+    ring = np.array([np.argmax(pts[:, 2])])
+    ring_id = 0
+    while len(ring):
+        pts_ring[ring] = ring_id
+        starts = conns_ptr[ring]
+        counts = conns_ptr[ring + 1] - starts
+        inds = np.repeat(starts - np.cumsum(counts) + counts, counts) +\
+            np.arange(counts.sum())
+        ring = np.unique(conns_dst[inds])
+        ring = ring[pts_ring[ring] < 0]
+        ring_id += 1
+
+    # Sort the points by ring and by azimuth (points with the same azimuth are
+    # sorted by index)
+    azimuth = np.mod(np.arctan2(pts[:, 1], pts[:, 0]) + 2.0 * math.pi,
+                     2.0 * math.pi)
+    return np.lexsort((np.arange(n_pts), azimuth, pts_ring))
+
+def _get_hinter_sphere(ref_level):
+    '''
+    Returns the points of the given refinement level of the icosahedron in the
+    final order (memoized, the sphere is calculated only once per level).
+
+    :param ref_level: Refinement level.
+    :return: Points (not projected to the sphere), their norms and refinement
+             levels of the points.
+    '''
+    if ref_level not in _hinter_spheres:
+        if not _hinter_levels:
+            # Vertices and faces of icosahedron
+            a, b, c = 0.0, 1.0, (1.0 + math.sqrt(5.0)) / 2.0
+            pts = [(-b, c, a), (b, c, a), (-b, -c, a), (b, -c, a),
+                   (a, -b, c), (a, b, c), (a, -b, -c), (a, b, -c),
+                   (c, a, -b), (c, a, b), (-c, a, -b), (-c, a, b)]
+            faces = [(0, 11, 5), (0, 5, 1), (0, 1, 7), (0, 7, 10),
+                     (0, 10, 11), (1, 5, 9), (5, 11, 4), (11, 10, 2),
+                     (10, 7, 6), (7, 1, 8), (3, 9, 4), (3, 4, 2), (3, 2, 6),
+                     (3, 6, 8), (3, 8, 9), (4, 9, 5), (2, 4, 11), (6, 2, 10),
+                     (8, 6, 7), (9, 8, 1)]
+            _hinter_levels.append((np.array(pts), np.array(faces, np.int64),
+                                   np.zeros(len(pts), np.int64)))
+        while len(_hinter_levels) <= ref_level:
+            _hinter_levels.append(_subdivide_icosphere(
+                *(_hinter_levels[-1] + (len(_hinter_levels),))))
+
+        # The points are ordered on the unit sphere
+        pts, faces, pts_level = _hinter_levels[ref_level]
+        pts_norm = np.linalg.norm(pts, axis=1)
+        pts_ordered = _order_hinter_pts(
+            pts * np.reshape(1.0 / pts_norm, (pts.shape[0], 1)), faces)
+        _hinter_spheres[ref_level] = (pts[pts_ordered], pts_norm[pts_ordered],
+                                      pts_level[pts_ordered])
+
+    return _hinter_spheres[ref_level]
+
 def hinter_sampling(min_n_pts, radius=1):
     '''
     Sphere sampling based on refining icosahedron as described in:
     Hinterstoisser et al., Simultaneous Recognition and Homography Extraction of
     Local Patches with a Simple Linear Classifier, BMVC 2008
 
+    The refined icosahedrons are memoized, i.e. repeated calls with the same
+    min_n_pts only scale the already calculated points by the radius.
+
     :param min_n_pts: Minimum required number of points on the whole view sphere.
     :param radius: Radius of the view sphere.
     :return: 3D points on the sphere surface and a list that indicates on which
              refinement level the points were created.
     '''
-
-    # Get vertices and faces of icosahedron
-    a, b, c = 0.0, 1.0, (1.0 + math.sqrt(5.0)) / 2.0
-    pts = [(-b, c, a), (b, c, a), (-b, -c, a), (b, -c, a), (a, -b, c), (a, b, c),
-           (a, -b, -c), (a, b, -c), (c, a, -b), (c, a, b), (-c, a, -b), (-c, a, b)]
-    faces = [(0, 11, 5), (0, 5, 1), (0, 1, 7), (0, 7, 10), (0, 10, 11), (1, 5, 9),
-             (5, 11, 4), (11, 10, 2), (10, 7, 6), (7, 1, 8), (3, 9, 4), (3, 4, 2),
-             (3, 2, 6), (3, 6, 8), (3, 8, 9), (4, 9, 5), (2, 4, 11), (6, 2, 10),
-             (8, 6, 7), (9, 8, 1)]
-
-    # Refinement level on which the points were created
-    pts_level = [0 for _ in range(len(pts))]
-
+    # Refinement level with at least min_n_pts points (the icosahedron has 12
+    # points, each refinement adds a point on each edge)
     ref_level = 0
-    while len(pts) < min_n_pts:
+    n_pts, n_edges = 12, 30
+    while n_pts < min_n_pts:
         ref_level += 1
-        edge_pt_map = {} # Mapping from an edge to a newly added point on that edge
-        faces_new = [] # New set of faces
-
-        # Each face is replaced by 4 new smaller faces
-        for face in faces:
-            pt_inds = list(face) # List of point IDs involved in the new faces
-            for i in range(3):
-                # Add a new point if this edge hasn't been processed yet,
-                # or get ID of the already added point.
-                edge = (face[i], face[(i + 1) % 3])
-                edge = (min(edge), max(edge))
-                if edge not in edge_pt_map.keys():
-                    pt_new_id = len(pts)
-                    edge_pt_map[edge] = pt_new_id
-                    pt_inds.append(pt_new_id)
-
-                    pt_new = 0.5 * (np.array(pts[edge[0]]) + np.array(pts[edge[1]]))
-                    pts.append(pt_new.tolist())
-                    pts_level.append(ref_level)
-                else:
-                    pt_inds.append(edge_pt_map[edge])
-
-            # Replace the current face with 4 new faces
-            faces_new += [(pt_inds[0], pt_inds[3], pt_inds[5]),
-                          (pt_inds[3], pt_inds[1], pt_inds[4]),
-                          (pt_inds[3], pt_inds[4], pt_inds[5]),
-                          (pt_inds[5], pt_inds[4], pt_inds[2])]
-        faces = faces_new
+        n_pts, n_edges = n_pts + n_edges, 4 * n_edges
 
     # Project the points to a sphere
-    pts = np.array(pts)
-    pts *= np.reshape(radius / np.linalg.norm(pts, axis=1), (pts.shape[0], 1))
-
-    # Collect point connections
-    pt_conns = {}
-    for face in faces:
-        for i in range(len(face)):
-            pt_conns.setdefault(face[i], set()).add(face[(i + 1) % len(face)])
-            pt_conns[face[i]].add(face[(i + 2) % len(face)])
-
-    # Order the points - starting from the top one and adding the connected points
-    # sorted by azimuth
-    top_pt_id = np.argmax(pts[:, 2])
-    pts_ordered = []
-    pts_todo = [top_pt_id]
-    pts_done = [False for _ in range(pts.shape[0])]
-
-    def calc_azimuth(x, y):
-        two_pi = 2.0 * math.pi
-        return (math.atan2(y, x) + two_pi) % two_pi
-
-    while len(pts_ordered) != pts.shape[0]:
-        # Sort by azimuth
-        pts_todo = sorted(pts_todo, key=lambda i: calc_azimuth(pts[i][0], pts[i][1]))
-        pts_todo_new = []
-        for pt_id in pts_todo:
-            pts_ordered.append(pt_id)
-            pts_done[pt_id] = True
-            pts_todo_new += [i for i in pt_conns[pt_id]] # Find the connected points
-
-        # Points to be processed in the next iteration
-        pts_todo = [i for i in set(pts_todo_new) if not pts_done[i]]
-
-    # Re-order the points and faces
-    pts = pts[np.array(pts_ordered), :]
-    pts_level = [pts_level[i] for i in pts_ordered]
-    pts_order = np.zeros((pts.shape[0],))
-    pts_order[np.array(pts_ordered)] = np.arange(pts.shape[0])
-    for face_id in range(len(faces)):
-        faces[face_id] = [pts_order[i] for i in faces[face_id]]
+    pts, pts_norm, pts_level = _get_hinter_sphere(ref_level)
+    pts = pts * np.reshape(radius / pts_norm, (pts.shape[0], 1))
 
     # import inout
-    # inout.save_ply('output/hinter_sampling.ply', pts=pts, faces=np.array(faces))
+    # inout.save_ply('output/hinter_sampling.ply', pts=pts)
 
+    return pts, pts_level.tolist()
+
+def _sample_pts(min_n_views, radius=1):
+    '''
+    :return: Points on a view sphere and their refinement levels.
+    '''
+    if True:
+        pts, pts_level = hinter_sampling(min_n_views, radius=radius)
+    else:
+        pts = fibonacci_sampling(min_n_views + 1, radius=radius)
+        pts_level = [0 for _ in range(len(pts))]
     return pts, pts_level
 
+def sample_views_arrays(min_n_views, radii=1,
+                        azimuth_range=(0, 2 * math.pi),
+                        elev_range=(-0.5 * math.pi, 0.5 * math.pi),
+                        inplane_angles=0):
+    '''
+    Viewpoint sampling from a view sphere - the same views as by sample_views,
+    but calculated at once for all viewpoints and returned as arrays. The views
+    are generated for all combinations of the radii, the viewpoints and the
+    in-plane rotation angles (in this order, i.e. the in-plane rotation angle
+    changes the fastest).
+
+    :param min_n_views: Minimum required number of views on the whole view sphere.
+    :param radii: Radius of the view sphere (a scalar or a list).
+    :param azimuth_range: Azimuth range from which the viewpoints are sampled.
+    :param elev_range: Elevation range from which the viewpoints are sampled.
+    :param inplane_angles: In-plane rotation angle(s) [rad] - rotation of the
+           camera around its optical axis (a scalar or a list).
+    :return: Dictionary with (N is the number of views):
+             - 'R': Nx3x3 ndarray with rotation matrices.
+             - 't': Nx3x1 ndarray with translation vectors.
+             - 'pt_id': Index of the viewpoint on the view sphere (N-vector,
+               the index to the points of hinter_sampling).
+             - 'level': Refinement level of the viewpoint (N-vector).
+             - 'radius': Radius of the view sphere (N-vector).
+             - 'inplane_angle': In-plane rotation angle (N-vector).
+             - 'pts_level': Refinement levels of all points on the view sphere
+               (including the points outside the azimuth and elevation ranges,
+               i.e. the same as returned by hinter_sampling).
+    '''
+    radii = np.atleast_1d(np.asarray(radii, np.float64))
+    inplane_angles = np.atleast_1d(np.asarray(inplane_angles, np.float64))
+
+    # Get points on a unit sphere
+    pts, pts_level = _sample_pts(min_n_views)
+    pts = np.asarray(pts, np.float64)
+    pts_level = np.asarray(pts_level, np.int64)
+
+    # Azimuth from (0, 2 * pi)
+    azimuth = np.arctan2(pts[:, 1], pts[:, 0])
+    azimuth[azimuth < 0] += 2.0 * math.pi
+
+    # Elevation from (-0.5 * pi, 0.5 * pi)
+    a = np.linalg.norm(pts, axis=1)
+    b = np.linalg.norm(pts[:, :2], axis=1)
+    elev = np.arccos(np.clip(b / a, -1.0, 1.0))
+    elev[pts[:, 2] < 0] *= -1.0
+
+    # Keep only the viewpoints in the given ranges
+    pt_ids = np.flatnonzero((azimuth_range[0] <= azimuth) &
+                            (azimuth <= azimuth_range[1]) &
+                            (elev_range[0] <= elev) & (elev <= elev_range[1]))
+    pts = pts[pt_ids]
+
+    # Rotation matrices (the same for all radii)
+    # The code was adopted from gluLookAt function (uses OpenGL coordinate system):
+    # [1] http://stackoverflow.com/questions/5717654/glulookat-explanation
+    # [2] https://www.opengl.org/wiki/GluLookAt_code
+    f = -pts / np.linalg.norm(pts, axis=1)[:, np.newaxis] # Forward direction
+    u = np.array([0.0, 0.0, 1.0]) # Up direction
+    s = np.cross(f, u) # Side direction
+    # f and u are parallel, i.e. we are looking along or against Z axis
+    s[~np.any(s, axis=1)] = [1.0, 0.0, 0.0]
+    s /= np.linalg.norm(s, axis=1)[:, np.newaxis]
+    u = np.cross(s, f) # Recompute up
+    Rs = np.stack([s, u, -f], axis=1)
+
+    # Convert from OpenGL to OpenCV coordinate system
+    R_yz_flip = transform.rotation_matrix(math.pi, [1, 0, 0])[:3, :3]
+    Rs = np.matmul(R_yz_flip, Rs)
+
+    # In-plane rotations (around Z axis of the camera)
+    Rs_inplane = np.array([transform.rotation_matrix(angle, [0, 0, 1])[:3, :3]
+                           for angle in inplane_angles])
+    Rs = np.matmul(Rs_inplane[np.newaxis], Rs[:, np.newaxis]) # pts x inplane
+
+    # Translation vectors (pts x inplane) for all radii
+    ts = -np.matmul(Rs, pts[:, np.newaxis, :, np.newaxis])
+    ts = radii[:, np.newaxis, np.newaxis, np.newaxis, np.newaxis] *\
+        ts[np.newaxis]
+
+    n_radii, n_pts, n_inplane = len(radii), len(pt_ids), len(inplane_angles)
+    n_views = n_radii * n_pts * n_inplane
+    grid = np.meshgrid(np.arange(n_radii), np.arange(n_pts),
+                       np.arange(n_inplane), indexing='ij')
+    radius_inds, pt_inds, inplane_inds = [g.ravel() for g in grid]
+
+    return {
+        'R': np.repeat(Rs[np.newaxis], n_radii, axis=0).reshape((n_views, 3, 3)),
+        't': ts.reshape((n_views, 3, 1)),
+        'pt_id': pt_ids[pt_inds],
+        'level': pts_level[pt_ids][pt_inds],
+        'radius': radii[radius_inds],
+        'inplane_angle': inplane_angles[inplane_inds],
+        'pts_level': pts_level
+    }
+
 def sample_views(min_n_views, radius=1,
                  azimuth_range=(0, 2 * math.pi),
                  elev_range=(-0.5 * math.pi, 0.5 * math.pi)):
@@ -174,60 +331,13 @@ def sample_views(min_n_views, radius=1,
     :return: List of views, each represented by a 3x3 rotation matrix and
              a 3x1 translation vector.
     '''
+    # The views are calculated at once by sample_views_arrays
+    views_arr = sample_views_arrays(min_n_views, radius, azimuth_range,
+                                    elev_range)
+    views = [{'R': R, 't': t} for R, t in zip(views_arr['R'], views_arr['t'])]
 
-    # Get points on a sphere
-    if True:
-        pts, pts_level = hinter_sampling(min_n_views, radius=radius)
-    else:
-        pts = fibonacci_sampling(min_n_views + 1, radius=radius)
-        pts_level = [0 for _ in range(len(pts))]
-
-    views = []
-    for pt in pts:
-        # Azimuth from (0, 2 * pi)
-        azimuth = math.atan2(pt[1], pt[0])
-        if azimuth < 0:
-            azimuth += 2.0 * math.pi
-
-        # Elevation from (-0.5 * pi, 0.5 * pi)
-        a = np.linalg.norm(pt)
-        b = np.linalg.norm([pt[0], pt[1], 0])
-        elev = math.acos(b / a)
-        if pt[2] < 0:
-            elev = -elev
-
-        # if hemisphere and (pt[2] < 0 or pt[0] < 0 or pt[1] < 0):
-        if not (azimuth_range[0] <= azimuth <= azimuth_range[1] and
-                elev_range[0] <= elev <= elev_range[1]):
-            continue
-
-        # Rotation matrix
-        # The code was adopted from gluLookAt function (uses OpenGL coordinate system):
-        # [1] http://stackoverflow.com/questions/5717654/glulookat-explanation
-        # [2] https://www.opengl.org/wiki/GluLookAt_code
-        f = -np.array(pt) # Forward direction
-        f /= np.linalg.norm(f)
-        u = np.array([0.0, 0.0, 1.0]) # Up direction
-        s = np.cross(f, u) # Side direction
-        if np.count_nonzero(s) == 0:
-            # f and u are parallel, i.e. we are looking along or against Z axis
-            s = np.array([1.0, 0.0, 0.0])
-        s /= np.linalg.norm(s)
-        u = np.cross(s, f) # Recompute up
-        R = np.array([[s[0], s[1], s[2]],
-                      [u[0], u[1], u[2]],
-                      [-f[0], -f[1], -f[2]]])
-
-        # Convert from OpenGL to OpenCV coordinate system
-        R_yz_flip = transform.rotation_matrix(math.pi, [1, 0, 0])[:3, :3]
-        R = R_yz_flip.dot(R)
-
-        # Translation vector
-        t = -R.dot(np.array(pt).reshape((3, 1)))
-
-        views.append({'R': R, 't': t})
-
-    return views, pts_level
+    # Refinement levels of all points on the sphere
+    return views, views_arr['pts_level'].tolist()
 
 def save_vis(path, views, views_level=None):
     '''
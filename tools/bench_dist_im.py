@@ -0,0 +1,71 @@
+# Author: Tomas Hodan (hodantom@cmp.felk.cvut.cz)
+# Center for Machine Perception, Czech Technical University in Prague
+
+# Compares the conversion of depth images to distance images based on the
+# cached ray scale images (misc.depth_im_to_dist_im) with the original
+# conversion (which calculates the 3D points explicitly), at the image
+# resolutions of all datasets (see params/dataset_params.py).
+
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pysixd import misc
+
+# Image resolutions (width, height) of the datasets
+im_sizes = [
+    (640, 480), # Hinterstoisser, TU Dresden Light, Rutgers, Tejani, ...
+    (720, 540), # T-LESS - Primesense
+    (2560, 1920), # T-LESS - Canon
+    (400, 400), # T-LESS - Primesense (train)
+    (1900, 1900), # T-LESS - Canon (train)
+    (1280, 1024), # T-LESS - Kinect (train)
+]
+
+n_repeats = 20 # Number of conversions per resolution
+
+def depth_im_to_dist_im_orig(depth_im, K):
+    xs = np.tile(np.arange(depth_im.shape[1]), [depth_im.shape[0], 1])
+    ys = np.tile(np.arange(depth_im.shape[0]), [depth_im.shape[1], 1]).T
+
+    Xs = np.multiply(xs - K[0, 2], depth_im) * (1.0 / K[0, 0])
+    Ys = np.multiply(ys - K[1, 2], depth_im) * (1.0 / K[1, 1])
+
+    dist_im = np.linalg.norm(np.dstack((Xs, Ys, depth_im)), axis=2)
+    return dist_im
+
+for im_size in im_sizes:
+    w, h = im_size
+    K = np.array([[1.1 * w, 0, 0.5 * w], [0, 1.1 * w, 0.5 * h], [0, 0, 1]])
+    depth = np.random.uniform(500, 1500, (h, w)).astype(np.float32)
+    depth[depth < 600] = 0
+    out = np.empty((h, w), np.float64)
+
+    t = time.time()
+    for _ in range(n_repeats):
+        dist_orig = depth_im_to_dist_im_orig(depth, K)
+    time_orig = (time.time() - t) / n_repeats
+
+    # The first conversion includes the calculation of the ray scale image
+    t = time.time()
+    dist = misc.depth_im_to_dist_im(depth, K)
+    time_first = time.time() - t
+
+    t = time.time()
+    for _ in range(n_repeats):
+        dist = misc.depth_im_to_dist_im(depth, K)
+    time_cached = (time.time() - t) / n_repeats
+
+    t = time.time()
+    for _ in range(n_repeats):
+        misc.depth_im_to_dist_im(depth, K, out=out)
+    time_out = (time.time() - t) / n_repeats
+
+    print('{}x{}: orig: {:.4f}s, first: {:.4f}s, cached: {:.4f}s, '
+          'cached+out: {:.4f}s, speedup: {:.1f}x, max diff: {:.2e}'.format(
+        w, h, time_orig, time_first, time_cached, time_out,
+        time_orig / max(time_out, 1e-9), np.abs(dist - dist_orig).max()))
+
+print('Done.')
@@ -0,0 +1,89 @@
+# Author: Tomas Hodan (hodantom@cmp.felk.cvut.cz)
+# Center for Machine Perception, Czech Technical University in Prague
+
+# Compares the speed of loading of 16-bit depth images (PNG) by PyPNG (the
+# original implementation of inout.load_depth) and by inout.load_depth, for
+# the image resolutions of all supported datasets.
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import numpy as np
+import png
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pysixd import inout
+
+# Resolutions (width, height) of the train/test images of the datasets (see
+# params/dataset_params.py)
+im_sizes = [
+    ((640, 480), 'hinterstoisser, tudlight, toyotalight, rutgers, tejani, '
+                 'doumanoglou'),
+    ((400, 400), 'tless - train primesense/kinect'),
+    ((720, 540), 'tless - test primesense/kinect'),
+    ((1280, 1024), 'tless - train'),
+    ((1900, 1900), 'tless - train canon'),
+    ((2560, 1920), 'tless - test canon'),
+]
+
+# Number of loaded images per resolution
+n_ims = 10
+
+# Depth scale applied when loading (e.g. 0.1 for T-LESS)
+depth_scale = 0.1
+
+def load_depth_pypng(path):
+    r = png.Reader(filename=path)
+    return np.vstack(list(map(np.uint16, r.asDirect()[2]))).astype(np.float32)
+
+def gen_depth(im_size, seed=0):
+    """
+    :return: Synthetic depth image (a tilted plane with noise and holes).
+    """
+    rs = np.random.RandomState(seed)
+    w, h = im_size
+    xs, ys = np.meshgrid(np.arange(w), np.arange(h))
+    depth = 5000.0 + 2.0 * xs + 1.0 * ys + rs.normal(0.0, 5.0, (h, w))
+    depth[rs.rand(h, w) < 0.1] = 0
+    return depth
+
+def time_func(func, paths):
+    t_start = time.time()
+    for path in paths:
+        func(path)
+    return (time.time() - t_start) / len(paths)
+
+if __name__ == '__main__':
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        print('{:>12} {:>12} {:>12} {:>12} {:>8}  {}'.format(
+            'resolution', 'pypng [ms]', 'float [ms]', 'out= [ms]', 'speedup',
+            'datasets'))
+        for im_size, datasets in im_sizes:
+            paths = []
+            for i in range(n_ims):
+                path = os.path.join(tmp_dir, '{}x{}_{}.png'.format(
+                    im_size[0], im_size[1], i))
+                inout.save_depth(path, gen_depth(im_size, i))
+                paths.append(path)
+
+            # The results must be the same
+            depth_ref = load_depth_pypng(paths[0])
+            depth_ref *= depth_scale
+            depth = inout.load_depth(paths[0], depth_scale=depth_scale)
+            assert(np.array_equal(depth, depth_ref))
+
+            t_pypng = time_func(
+                lambda p: load_depth_pypng(p) * depth_scale, paths)
+            t_float = time_func(
+                lambda p: inout.load_depth(p, depth_scale=depth_scale), paths)
+            out = np.empty((im_size[1], im_size[0]), np.uint16)
+            t_out = time_func(lambda p: inout.load_depth(p, out=out), paths)
+
+            print('{:>12} {:>12.2f} {:>12.2f} {:>12.2f} {:>7.1f}x  {}'.format(
+                '{}x{}'.format(*im_size), 1000 * t_pypng, 1000 * t_float,
+                1000 * t_out, t_pypng / t_float, datasets))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
@@ -0,0 +1,82 @@
+# Author: Tomas Hodan (hodantom@cmp.felk.cvut.cz)
+# Center for Machine Perception, Czech Technical University in Prague
+
+# Compares the software renderer (renderer_cpu.py) with the OpenGL renderer
+# on the object models of a dataset - in terms of speed and differences of the
+# rendered images.
+
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pysixd import inout, renderer, view_sampler
+from params.dataset_params import get_dataset_params
+
+dataset = 'hinterstoisser'
+# dataset = 'tless'
+# dataset = 'tudlight'
+# dataset = 'rutgers'
+# dataset = 'tejani'
+# dataset = 'doumanoglou'
+# dataset = 'toyotalight'
+
+# Rendering modes to compare ('depth', 'rgb')
+modes = ['depth', 'rgb']
+
+# Minimum number of views per object (sampled from a view sphere)
+min_n_views = 20
+radius = 700 # Radius of the view sphere [mm]
+
+# Depth difference tolerance [mm] used to count mismatched pixels
+depth_tol = 1.0
+
+dp = get_dataset_params(dataset)
+obj_ids = range(1, dp['obj_count'] + 1)
+im_size = dp['test_im_size']
+K = dp['cam']['K']
+
+views, _ = view_sampler.sample_views(min_n_views, radius)
+print('Sampled views: {}'.format(len(views)))
+
+times = {b: {m: 0.0 for m in modes} for b in ['gl', 'cpu']}
+for obj_id in obj_ids:
+    model = inout.load_ply(dp['model_mpath'].format(obj_id))
+
+    for mode in modes:
+        mask_diffs = []
+        val_diffs = []
+        for view in views:
+            ims = {}
+            for backend in ['gl', 'cpu']:
+                t = time.time()
+                ims[backend] = renderer.render(
+                    model, im_size, K, view['R'], view['t'], mode=mode,
+                    backend=backend)
+                times[backend][mode] += time.time() - t
+
+            if mode == 'depth':
+                mask_gl = ims['gl'] > 0
+                mask_cpu = ims['cpu'] > 0
+                both = np.logical_and(mask_gl, mask_cpu)
+                diff = np.abs(ims['gl'][both] - ims['cpu'][both])
+                val_diffs.append(diff.max() if diff.size else 0.0)
+                mask_diffs.append(np.sum(mask_gl != mask_cpu) +
+                                  np.sum(diff > depth_tol))
+            else:
+                diff = np.abs(ims['gl'].astype(np.int32) -
+                              ims['cpu'].astype(np.int32)).max(axis=2)
+                val_diffs.append(diff.max())
+                mask_diffs.append(np.sum(diff > 1))
+
+        print('obj: {}, mode: {}, mismatched px per view: {:.2f}, '
+              'max diff: {:.4f}'.format(obj_id, mode, np.mean(mask_diffs),
+                                        np.max(val_diffs)))
+
+print('')
+n_ims = len(views) * len(obj_ids)
+for mode in modes:
+    print('{}: gl: {:.4f}s/im, cpu: {:.4f}s/im'.format(
+        mode, times['gl'][mode] / n_ims, times['cpu'][mode] / n_ims))
+print('Done.')
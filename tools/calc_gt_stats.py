@@ -9,7 +9,8 @@ import sys
 import numpy as np
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from pysixd import inout, misc, renderer, visibility
+from pysixd import inout, misc, renderer, visibility, gt_depth_cache,\
+    im_cache, model_store
 from params.dataset_params import get_dataset_params
 
 # dataset = 'hinterstoisser'
@@ -27,6 +28,26 @@ use_image_subset = True # Whether to use only the specified subset of images
 delta = 15 # Tolerance used in the visibility test [mm]
 do_vis = True # Whether to save visualizations of visibility masks
 
+# Clipping planes used for rendering (the same as in pose_error.vsd, so the
+# cached GT depth images can be reused by eval_calc_errors.py). The cache of GT
+# depth renderings is keyed on them.
+clip_near = 100 # [mm]
+clip_far = 10000 # [mm]
+
+# Far clipping plane applied to the GT depth renderings when calculating the
+# statistics (the original clip_far of the GT renderings, which clips objects
+# farther than 2 m, e.g. some GT poses in TUD-Light) - the statistics are the
+# same as when rendering with clip_far = 2000 mm
+clip_far_stats = 2000 # [mm]
+
+# Whether to store the GT depth renderings to the on-disk cache
+use_depth_cache = True
+
+# Whether to read the depth images through the cache of decoded images (the
+# cache is built from the considered images and reused e.g. by
+# eval_calc_errors.py)
+use_im_cache = True
+
 # Select data type
 if dataset == 'tless':
     data_type = 'primesense'
@@ -54,6 +75,8 @@ if dataset_part == 'train':
     info_mpath_key = 'obj_info_mpath'
     gt_mpath_key = 'obj_gt_mpath'
     gt_stats_mpath_key = 'obj_gt_stats_mpath'
+    depth_cache_mpath_key = 'obj_gt_depth_cache_mpath'
+    im_cache_mpath_key = 'obj_im_cache_mpath'
 
 else: # 'test'
     data_ids = range(1, dp['scene_count'] + 1)
@@ -61,6 +84,8 @@ else: # 'test'
     info_mpath_key = 'scene_info_mpath'
     gt_mpath_key = 'scene_gt_mpath'
     gt_stats_mpath_key = 'scene_gt_stats_mpath'
+    depth_cache_mpath_key = 'scene_gt_depth_cache_mpath'
+    im_cache_mpath_key = 'scene_im_cache_mpath'
 
 # Path masks of the output visualizations
 vis_base = '../output/vis_gt_visib_{}_delta={}/{:02d}/'
@@ -70,8 +95,12 @@ vis_mpath = vis_base + '{:' + str(dp['im_id_pad']).zfill(2) + 'd}_{:02d}.jpg'
 
 print('Loading object models...')
 models = {}
+model_paths = [dp['model_mpath'].format(obj_id) for obj_id in obj_ids]
 for obj_id in obj_ids:
-    models[obj_id] = inout.load_ply(dp['model_mpath'].format(obj_id))
+    models[obj_id] = model_store.load_model(dp['model_mpath'].format(obj_id))
+
+# The images are saved in the background
+im_writer = inout.AsyncImageWriter()
 
 # visib_to_below_delta_fracs = []
 for data_id in data_ids:
@@ -83,27 +112,54 @@ for data_id in data_ids:
     info = inout.load_info(dp[info_mpath_key].format(data_id))
     gts = inout.load_gt(dp[gt_mpath_key].format(data_id))
 
+    # Cache of the GT depth renderings
+    depth_cache = None
+    if use_depth_cache:
+        depth_cache = gt_depth_cache.load_scene_cache(
+            dp[depth_cache_mpath_key].format(data_id),
+            dp[gt_mpath_key].format(data_id), dp[info_mpath_key].format(data_id),
+            model_paths, clip_near, clip_far, renderer.default_backend)
+
     # Considered subset of images for the current scene
     if im_ids_sets is not None:
         im_ids = im_ids_sets[data_id]
     else:
         im_ids = sorted(gts.keys())
 
+    # Cache of the decoded depth images (of the considered images)
+    depth_im_cache = None
+    if use_im_cache:
+        depth_im_cache = im_cache.load_scene_cache(
+            dp[im_cache_mpath_key].format(data_id, 'depth'),
+            dp[depth_mpath_key], data_id, im_ids)
+
     gt_stats = {}
     for im_id in im_ids:
         print('dataset: {}, scene/obj: {}, im: {}'.format(dataset, data_id, im_id))
 
         K = info[im_id]['cam_K']
-        depth_path = dp[depth_mpath_key].format(data_id, im_id)
-        depth_im = inout.load_depth(depth_path)
-        depth_im *= dp['cam']['depth_scale'] # to [mm]
+        if depth_im_cache is not None:
+            depth_im = depth_im_cache.get_depth(
+                im_id, dp['cam']['depth_scale']) # [mm]
+        else:
+            depth_path = dp[depth_mpath_key].format(data_id, im_id)
+            depth_im = inout.load_depth(
+                depth_path, depth_scale=dp['cam']['depth_scale']) # [mm]
         im_size = (depth_im.shape[1], depth_im.shape[0])
 
         gt_stats[im_id] = []
         for gt_id, gt in enumerate(gts[im_id]):
-            depth_gt = renderer.render(models[gt['obj_id']], im_size, K,
-                                       gt['cam_R_m2c'], gt['cam_t_m2c'],
-                                       mode='depth')
+            depth_gt = None
+            if depth_cache is not None:
+                depth_gt = depth_cache.get(im_id, gt_id, im_size)
+            if depth_gt is None:
+                depth_gt = renderer.render(models[gt['obj_id']], im_size, K,
+                                           gt['cam_R_m2c'], gt['cam_t_m2c'],
+                                           clip_near=clip_near,
+                                           clip_far=clip_far, mode='depth')
+                if depth_cache is not None:
+                    depth_cache.put(im_id, gt_id, depth_gt)
+            depth_gt = depth_gt * (depth_gt <= clip_far_stats)
 
             # Get distance images
             dist_gt = misc.depth_im_to_dist_im(depth_gt, K)
@@ -177,7 +233,7 @@ for data_id in data_ids:
                 vis[vis > 1] = 1
                 vis_path = vis_mpath.format(
                     dataset, delta, data_id, im_id, gt_id)
-                inout.save_im(vis_path, vis)
+                im_writer.save_im(vis_path, vis)
 
                 # Mask of depth differences below delta
                 # mask_below_delta_vis = np.dstack([mask_below_delta,
@@ -188,10 +244,15 @@ for data_id in data_ids:
                 #     dataset, delta, data_id, im_id, gt_id, delta)
                 # inout.save_im(vis_delta_path, vis_delta)
 
+    if depth_cache is not None:
+        depth_cache.save()
+
     res_path = dp[gt_stats_mpath_key].format(data_id, delta)
     misc.ensure_dir(os.path.dirname(res_path))
     inout.save_yaml(res_path, gt_stats)
 
+im_writer.close()
+
 # visib_to_below_delta_fracs = sorted(visib_to_below_delta_fracs,
 #                                     key=lambda x: x['frac'], reverse=True)
 # for i in range(200):
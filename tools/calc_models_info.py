@@ -0,0 +1,71 @@
+# Author: Tomas Hodan (hodantom@cmp.felk.cvut.cz)
+# Center for Machine Perception, Czech Technical University in Prague
+
+# Calculates information about the object models (diameter and 3D bounding
+# box) and saves it to models_info.yml (used e.g. by eval_loc.py to set the
+# correctness threshold of ADD and ADI).
+
+import os
+import sys
+import multiprocessing
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pysixd import inout, misc
+from params.dataset_params import get_dataset_params
+
+dataset = 'hinterstoisser'
+# dataset = 'tless'
+# dataset = 'tudlight'
+# dataset = 'rutgers'
+# dataset = 'tejani'
+# dataset = 'doumanoglou'
+# dataset = 'toyotalight'
+
+# Type of the models (e.g. 'cad', 'cad_subdivided' or 'reconst' for T-LESS)
+model_type = ''
+
+# Number of worker processes (0 = number of CPU cores)
+n_workers = 0
+
+# Path to the output file (None = models_info.yml of the dataset)
+out_models_info_path = None
+
+def calc_model_info(model_path):
+    """
+    :param model_path: Path to a PLY model.
+    :return: Dictionary with the diameter and the 3D bounding box.
+    """
+    pts = inout.load_ply(model_path)['pts']
+    bb_min = pts.min(axis=0)
+    bb_max = pts.max(axis=0)
+    info = {'diameter': float(misc.calc_pts_diameter3(pts))}
+    for i, axis in enumerate(['x', 'y', 'z']):
+        info['min_' + axis] = float(bb_min[i])
+        info['max_' + axis] = float(bb_max[i])
+        info['size_' + axis] = float(bb_max[i] - bb_min[i])
+    return info
+
+if __name__ == '__main__':
+    cam_type = 'primesense' if dataset == 'tless' else ''
+    dp = get_dataset_params(dataset, model_type=model_type, cam_type=cam_type)
+    obj_ids = list(range(1, dp['obj_count'] + 1))
+    model_paths = [dp['model_mpath'].format(obj_id) for obj_id in obj_ids]
+
+    if n_workers == 0:
+        n_workers = multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(n_workers)
+    infos = pool.map(calc_model_info, model_paths)
+    pool.close()
+    pool.join()
+
+    models_info = {}
+    for obj_id, info in zip(obj_ids, infos):
+        print('obj: {}, diameter: {}'.format(obj_id, info['diameter']))
+        models_info[obj_id] = info
+
+    if out_models_info_path is None:
+        out_models_info_path = dp['models_info_path']
+    print('Saving: ' + out_models_info_path)
+    inout.save_yaml(out_models_info_path, models_info)
+
+    print('Done.')
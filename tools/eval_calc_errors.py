@@ -6,11 +6,14 @@
 import os
 from os.path import join as pjoin
 import sys
-import glob
-# import time
+import time
+import itertools
+import multiprocessing
+import numpy as np
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from pysixd import inout, pose_error, misc
+from pysixd import inout, pose_error, misc, renderer, gt_depth_cache,\
+    im_cache, model_store, result_stream
 from params.dataset_params import get_dataset_params
 
 # Results for which the errors will be calculated
@@ -25,7 +28,14 @@ result_paths = [
 #-------------------------------------------------------------------------------
 # Mask of path to the output file with calculated errors
 errors_mpath = pjoin('{result_path}', '..', '..', 'eval', '{result_name}',
-                     '{error_sign}', 'errors_{scene_id:02d}.yml')
+                     '{error_sign}', 'errors_{scene_id:02d}.{errors_format}')
+
+# Mask of path to the manifest with signatures of the (im_id, obj_id) units
+# whose errors are in the output file (used to recalculate only the errors of
+# new or changed results)
+manifest_mpath = pjoin('{result_path}', '..', '..', 'eval', '{result_name}',
+                       '{error_sign}',
+                       'manifest_{scene_id:02d}_{errors_format}.yml')
 
 # Parameters
 #-------------------------------------------------------------------------------
@@ -40,6 +50,36 @@ error_type = 'vsd' # 'vsd', 'adi', 'add', 'cou', 're', 'te'
 vsd_delta = 15
 vsd_tau = 20
 vsd_cost = 'step' # 'step', 'tlinear'
+vsd_roi = True # Whether to process only the region of interest (faster)
+
+# Number of threads used for the nearest neighbor search in ADI (-1 = all CPU
+# cores; the KD-tree over the model points is built once per model)
+adi_workers = 1
+
+# Whether to use the cache of GT depth renderings (filled by calc_gt_stats.py)
+use_depth_cache = True
+
+# Whether to read the test depth images (for VSD) from the cache of decoded
+# images (built from the evaluated images in the main process, shared by the
+# workers through a memory map)
+use_im_cache = True
+
+# Format of the output files with errors ('bin' = columnar binary format,
+# which is much faster to load than 'yml')
+errors_format = 'bin' # 'bin', 'yml'
+
+# Number of images after which the errors calculated so far are saved, so an
+# interrupted calculation can be resumed (0 = only when a scene is finished)
+checkpoint_interval = 100
+
+# Number of threads loading the results and depth images of the next images in
+# the background (used if n_workers == 1)
+load_threads = 4
+
+# Number of worker processes (1 = the errors are calculated in the main
+# process, 0 = number of CPU cores). The work is split by (scene_id, im_id),
+# each worker has its own renderer and object models.
+n_workers = 1
 
 # Error signature
 error_sign = 'error=' + error_type + '_ntop=' + str(n_top)
@@ -47,147 +87,515 @@ if error_type == 'vsd':
     error_sign += '_delta={}_tau={}_cost={}'.format(
         vsd_delta, vsd_tau, vsd_cost)
 
-# Error calculation
-#-------------------------------------------------------------------------------
-for result_path in result_paths:
-    print('Processing: ' + result_path)
-
-    result_name = os.path.basename(result_path)
-    info = os.path.basename(result_path).split('_')
-    method = info[0]
-    dataset = info[1]
-    test_type = info[2] if len(info) > 2 else ''
-
-    # Select data type
-    if dataset == 'tless':
-        cam_type = test_type
-        if error_type in ['adi', 'add']:
-            model_type = 'cad_subdivided'
-        else:
-            model_type = 'cad'
-    else:
-        model_type = ''
-        cam_type = ''
+# State of the current (worker) process
+_worker = {}
 
-    # Load dataset parameters
+def init_worker(dataset, model_type, test_type, cam_type):
+    """
+    Loads dataset parameters and object models, and creates a renderer.
+
+    :param dataset, model_type, test_type, cam_type: See get_dataset_params().
+    """
     dp = get_dataset_params(dataset, model_type=model_type, test_type=test_type,
                             cam_type=cam_type)
 
     # Load object models
+    models = {}
     if error_type in ['vsd', 'add', 'adi', 'cou']:
         print('Loading object models...')
-        models = {}
         for obj_id in range(1, dp['obj_count'] + 1):
-            models[obj_id] = inout.load_ply(dp['model_mpath'].format(obj_id))
-
-    # Directories with results for individual scenes
-    scene_dirs = sorted([d for d in glob.glob(os.path.join(result_path, '*'))
-                         if os.path.isdir(d)])
-
-    for scene_dir in scene_dirs:
-        scene_id = int(os.path.basename(scene_dir))
+            models[obj_id] = model_store.load_model(
+                dp['model_mpath'].format(obj_id),
+                load_kdtree=(error_type == 'adi'))
+
+    # Renderer for VSD and COU (the clipping planes are the same as used in
+    # pose_error.vsd and pose_error.cou)
+    ren = None
+    if error_type in ['vsd', 'cou']:
+        ren = renderer.Renderer(dp['test_im_size'], clip_near=100,
+                                clip_far=10000)
+        for obj_id, model in models.items():
+            ren.add_object(obj_id, model)
+
+    _worker.clear()
+    _worker.update({'dp': dp, 'models': models, 'ren': ren, 'scene_id': None})
+
+def close_worker():
+    if _worker.get('ren') is not None:
+        _worker['ren'].close()
+    _worker.clear()
+
+def load_scene(scene_id):
+    """
+    Loads info, GT poses, the cache of GT depth renderings and the cache of
+    test depth images (both read-only) of a scene (the last loaded scene is
+    kept in the worker state).
+
+    :param scene_id: Scene ID.
+    """
+    if _worker['scene_id'] == scene_id:
+        return
+    dp = _worker['dp']
+    _worker['scene_info'] =\
+        inout.load_info(dp['scene_info_mpath'].format(scene_id))
+    _worker['scene_gt'] = inout.load_gt(dp['scene_gt_mpath'].format(scene_id),
+                                        use_index=True)
+    _worker['depth_cache'] = None
+    if use_depth_cache and error_type in ['vsd', 'cou']:
+        _worker['depth_cache'] = open_depth_cache(dp, scene_id, read_only=True)
+    _worker['im_cache'] = None
+    if use_im_cache and error_type == 'vsd':
+        # The cache was checked (or built) by the main process
+        _worker['im_cache'] = im_cache.open_cache(
+            dp['scene_im_cache_mpath'].format(scene_id, 'depth'))
+    _worker['scene_id'] = scene_id
+
+def open_depth_cache(dp, scene_id, read_only=False):
+    model_paths = [dp['model_mpath'].format(obj_id)
+                   for obj_id in range(1, dp['obj_count'] + 1)]
+    return gt_depth_cache.load_scene_cache(
+        dp['scene_gt_depth_cache_mpath'].format(scene_id),
+        dp['scene_gt_mpath'].format(scene_id),
+        dp['scene_info_mpath'].format(scene_id),
+        model_paths, 100, 10000, renderer.default_backend, read_only)
+
+def calc_errors_im(task, im_res=None, depth_im=None):
+    """
+    Calculates errors of the pose estimates in one test image.
+
+    :param task: Tuple (scene_id, im_id, obj_res_paths), where obj_res_paths
+    is a list of (obj_id, res_path) (sorted by object ID).
+    :param im_res, depth_im: Already loaded results and depth image of the
+    image (see result_stream.iter_results). They are loaded if im_res is None.
+    :return: Dictionary with the errors ('errs'), the newly rendered GT depth
+    images to be added to the cache ('depths_gt_new', {gt_id: depth}) and
+    statistics of the worker ('pid', 'n_ests', 'time').
+    """
+    scene_id, im_id, obj_res_paths = task
+    t_start = time.time()
+
+    load_scene(scene_id)
+    dp = _worker['dp']
+    models = _worker['models']
+    ren = _worker['ren']
+    scene_info = _worker['scene_info']
+    scene_gt = _worker['scene_gt']
+    depth_cache = _worker['depth_cache']
+    scene_im_cache = _worker['im_cache']
+
+    # Load pose estimates
+    if im_res is None:
+        _, _, im_res, _ = result_stream.load_image_results(
+            (scene_id, im_id, obj_res_paths, None, None))
+
+    # Load depth image (if VSD is selected and it was not loaded yet)
+    if error_type == 'vsd' and depth_im is None:
+        if scene_im_cache is not None and im_id in scene_im_cache:
+            depth_im = scene_im_cache.get_depth(im_id,
+                                                dp['cam']['depth_scale'])
+        else:
+            depth_im = inout.load_depth(
+                dp['test_depth_mpath'].format(scene_id, im_id),
+                depth_scale=dp['cam']['depth_scale'])
+
+    # Load camera matrix
+    if error_type in ['vsd', 'cou']:
+        K = scene_info[im_id]['cam_K']
+
+    errs = []
+    depths_gt_new = {}
+    n_ests = 0
+    for obj_id, ests in im_res:
+        # Sort the estimates by score (in descending order)
+        ests_sorted = sorted(enumerate(ests), key=lambda x: x[1]['score'],
+                             reverse=True)
+
+        # Select the required number of top estimated poses
+        if n_top == 0: # All estimates are considered
+            n_top_curr = None
+        elif n_top == -1: # Given by the number of GT poses
+            n_gt = sum([gt['obj_id'] == obj_id for gt in scene_gt[im_id]])
+            n_top_curr = n_gt
+        else:
+            n_top_curr = n_top
+        ests_sorted = ests_sorted[slice(0, n_top_curr)]
+        n_ests += len(ests_sorted)
+
+        gt_ids_obj = [gt_id for gt_id, gt in enumerate(scene_gt[im_id])
+                      if gt['obj_id'] == obj_id]
+
+        # Errors of all the estimated poses w.r.t. all the GT poses of the
+        # object at once
+        if error_type in ['add', 'adi', 're', 'te']:
+            R_es = [est['R'] for _, est in ests_sorted]
+            t_es = [est['t'] for _, est in ests_sorted]
+            R_gs = [scene_gt[im_id][gt_id]['cam_R_m2c'] for gt_id in gt_ids_obj]
+            t_gs = [scene_gt[im_id][gt_id]['cam_t_m2c'] for gt_id in gt_ids_obj]
+            if error_type == 'add':
+                errs_batch = pose_error.add_batch(R_es, t_es, R_gs, t_gs,
+                                                  models[obj_id])
+            elif error_type == 'adi':
+                errs_batch = pose_error.adi_batch(R_es, t_es, R_gs, t_gs,
+                                                  models[obj_id], adi_workers)
+            elif error_type == 're':
+                errs_batch = pose_error.re_batch(R_es, R_gs)
+            elif error_type == 'te':
+                errs_batch = pose_error.te_batch(t_es, t_gs)
+
+        # Render depth images of the model at all the estimated and all the
+        # GT poses at once (the GT renderings are reused for all estimates)
+        if error_type in ['vsd', 'cou']:
+            if error_type == 'vsd':
+                im_size = (depth_im.shape[1], depth_im.shape[0])
+            else:
+                im_size = dp['test_im_size']
+            depths_est = ren.render_batch(
+                obj_id, K, [est for _, est in ests_sorted], im_size)
+
+            # GT depth images are taken from the cache if available
+            depths_gt = {}
+            if depth_cache is not None:
+                for gt_id in gt_ids_obj:
+                    depth_gt = depth_cache.get(im_id, gt_id, im_size)
+                    if depth_gt is not None:
+                        depths_gt[gt_id] = depth_gt
+            gt_ids_ren = [i for i in gt_ids_obj if i not in depths_gt]
+            depths_gt_ren = ren.render_batch(
+                obj_id, K, [{'R': scene_gt[im_id][gt_id]['cam_R_m2c'],
+                             't': scene_gt[im_id][gt_id]['cam_t_m2c']}
+                            for gt_id in gt_ids_ren], im_size)
+            for gt_id, depth_gt in zip(gt_ids_ren, depths_gt_ren):
+                depths_gt[gt_id] = depth_gt
+                if depth_cache is not None:
+                    depths_gt_new[gt_id] = depth_gt
+
+        for est_i, (est_id, est) in enumerate(ests_sorted):
+            R_e = est['R']
+            t_e = est['t']
+
+            errs_gts = {} # Errors w.r.t. GT poses of the same object
+            for gt_i, gt_id in enumerate(gt_ids_obj):
+                gt = scene_gt[im_id][gt_id]
+                e = -1.0
+                R_g = gt['cam_R_m2c']
+                t_g = gt['cam_t_m2c']
+
+                if error_type == 'vsd':
+                    e = pose_error.vsd(R_e, t_e, R_g, t_g, models[obj_id],
+                                       depth_im, K, vsd_delta, vsd_tau,
+                                       vsd_cost, depths_est[est_i],
+                                       depths_gt[gt_id], vsd_roi)
+                elif error_type in ['add', 'adi', 're', 'te']:
+                    e = errs_batch[est_i, gt_i]
+                elif error_type == 'cou':
+                    e = pose_error.cou(R_e, t_e, R_g, t_g, models[obj_id],
+                                       dp['test_im_size'], K,
+                                       depths_est[est_i], depths_gt[gt_id])
+
+                errs_gts[gt_id] = e
+
+            errs.append({
+                'im_id': im_id,
+                'obj_id': obj_id,
+                'est_id': est_id,
+                'score': est['score'],
+                'errors': errs_gts
+            })
+
+    return {'errs': errs, 'depths_gt_new': depths_gt_new, 'pid': os.getpid(),
+            'n_ests': n_ests, 'time': time.time() - t_start}
+
+def calc_unit_signature(dp, scene_id, im_id, obj_id, res_path):
+    """
+    Calculates a signature of the inputs the errors of one (im_id, obj_id) unit
+    are calculated from, i.e. the result file, the GT poses, the object model
+    (plus the camera parameters and the depth image for VSD and COU) and the
+    error parameters. The content of the small files (YAML) is hashed, the large
+    files (the object model and the depth image) are represented by their size
+    and modification time (hashing them would be as slow as loading them).
+
+    :return: Hexadecimal MD5 digest.
+    """
+    paths = [res_path, dp['scene_gt_mpath'].format(scene_id)]
+    stat_paths = [dp['model_mpath'].format(obj_id)]
+    if error_type in ['vsd', 'cou']:
+        paths.append(dp['scene_info_mpath'].format(scene_id))
+    if error_type == 'vsd':
+        stat_paths.append(dp['test_depth_mpath'].format(scene_id, im_id))
+    return gt_depth_cache.calc_signature(paths, (error_sign,), stat_paths)
+
+def load_manifest(manifest_path, errors_path):
+    """
+    :return: Dictionary {(im_id, obj_id): signature} of the units whose errors
+    are saved in the errors file (empty if the manifest or the errors file
+    does not exist).
+    """
+    if not os.path.isfile(manifest_path) or not os.path.isfile(errors_path):
+        return {}
+    manifest = inout.load_yaml(manifest_path)
+    return {(im_id, obj_id): sig for im_id, sigs in manifest.items()
+            for obj_id, sig in sigs.items()}
+
+def load_unit_errors(errors_path):
+    """
+    Loads errors and splits them by (im_id, obj_id) units (the errors of each
+    unit are saved in a continuous block).
+
+    :return: Errors in the columnar format (see inout.load_errors_bin) and a
+    dictionary {(im_id, obj_id): (first estimate, last estimate + 1)}.
+    """
+    if errors_format == 'bin':
+        errs = inout.load_errors_bin(errors_path)
+    else:
+        # An empty file (e.g. no estimates in the scene) is loaded as None
+        errs = inout.errors_to_arrays(inout.load_errors(errors_path) or [])
+    im_ids = np.asarray(errs['im_id'])
+    obj_ids = np.asarray(errs['obj_id'])
+    if len(im_ids) == 0:
+        return errs, {}
+    starts = np.flatnonzero(np.concatenate(
+        [[True], (im_ids[1:] != im_ids[:-1]) | (obj_ids[1:] != obj_ids[:-1])]))
+    ends = np.concatenate([starts[1:], [len(im_ids)]])
+    unit_ranges = {}
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        unit_ranges[(int(im_ids[start]), int(obj_ids[start]))] = (start, end)
+    return errs, unit_ranges
+
+def save_scene_errors(errors_path, manifest_path, units, unit_sigs, old_errs,
+                      old_unit_ranges, new_errs):
+    """
+    Saves errors of the finished units of a scene and the manifest.
+
+    :param units: List of (im_id, obj_id) units of the scene (in the order in
+    which their errors are saved).
+    :param unit_sigs: Signatures of the finished units.
+    :param old_errs, old_unit_ranges: Up-to-date errors loaded from the
+    existing errors file (see load_unit_errors).
+    :param new_errs: Dictionary {(im_id, obj_id): errors} with newly
+    calculated errors (lists as returned by calc_errors_im).
+    """
+    if errors_format == 'bin':
+        writer = inout.ErrorsWriter(errors_path)
+    else:
+        errs = []
+    for unit in units:
+        if unit not in unit_sigs:
+            continue
+        if unit in new_errs:
+            errs_unit = new_errs[unit]
+            if errors_format == 'bin':
+                writer.add(errs_unit)
+            else:
+                errs += errs_unit
+        elif unit in old_unit_ranges:
+            start, end = old_unit_ranges[unit]
+            errs_unit = {name: old_errs[name][start:end]
+                         for name in ['im_id', 'obj_id', 'est_id', 'score']}
+            errs_unit['indptr'] = old_errs['indptr'][start:end + 1]
+            errs_unit['gt_id'] = old_errs['gt_id']
+            errs_unit['error'] = old_errs['error']
+            if errors_format == 'bin':
+                writer.add_arrays(errs_unit)
+            else:
+                errs += inout.errors_from_arrays(errs_unit)
+    if errors_format == 'bin':
+        writer.close()
+    else:
+        inout.save_errors(errors_path + '.tmp', errs)
+        os.rename(errors_path + '.tmp', errors_path)
 
-        # Load info and GT poses for the current scene
-        scene_info = inout.load_info(dp['scene_info_mpath'].format(scene_id))
-        scene_gt = inout.load_gt(dp['scene_gt_mpath'].format(scene_id))
+    # The manifest is saved after the errors (an interrupted saving can
+    # therefore only cause recalculation of some units)
+    manifest = {}
+    for (im_id, obj_id), sig in unit_sigs.items():
+        manifest.setdefault(im_id, {})[obj_id] = sig
+    inout.save_yaml(manifest_path + '.tmp', manifest)
+    os.rename(manifest_path + '.tmp', manifest_path)
 
-        res_paths = sorted(glob.glob(os.path.join(scene_dir, '*.yml')))
-        errs = []
-        im_id = -1
-        depth_im = None
-        for res_id, res_path in enumerate(res_paths):
-            # t = time.time()
-
-            # Parse image ID and object ID from the filename
-            filename = os.path.basename(res_path).split('.')[0]
-            im_id_prev = im_id
-            im_id, obj_id = map(int, filename.split('_'))
-
-            if res_id % 10 == 0:
-                dataset_str = dataset
-                if test_type != '':
-                    dataset_str += ' - {}'.format(test_type)
-                print('Calculating error: {}, {}, {}, {}, {}, {}'.format(
-                    error_type, method, dataset_str, scene_id, im_id, obj_id))
-
-            # Load depth image if VSD is selected
-            if error_type == 'vsd' and im_id != im_id_prev:
-                depth_path = dp['test_depth_mpath'].format(scene_id, im_id)
-                # depth_im = inout.load_depth(depth_path)
-                depth_im = inout.load_depth2(depth_path) # Faster
-                depth_im *= dp['cam']['depth_scale'] # to [mm]
-
-            # Load camera matrix
-            if error_type in ['vsd', 'cou']:
-                K = scene_info[im_id]['cam_K']
-
-            # Load pose estimates
-            res = inout.load_results_sixd17(res_path)
-            ests = res['ests']
-
-            # Sort the estimates by score (in descending order)
-            ests_sorted = sorted(enumerate(ests), key=lambda x: x[1]['score'],
-                                 reverse=True)
-
-            # Select the required number of top estimated poses
-            if n_top == 0: # All estimates are considered
-                n_top_curr = None
-            elif n_top == -1: # Given by the number of GT poses
-                n_gt = sum([gt['obj_id'] == obj_id for gt in scene_gt[im_id]])
-                n_top_curr = n_gt
+# Error calculation
+#-------------------------------------------------------------------------------
+if __name__ == '__main__':
+    if n_workers == 0:
+        n_workers = multiprocessing.cpu_count()
+
+    for result_path in result_paths:
+        print('Processing: ' + result_path)
+        t_start = time.time()
+
+        result_name = os.path.basename(result_path)
+        info = os.path.basename(result_path).split('_')
+        method = info[0]
+        dataset = info[1]
+        test_type = info[2] if len(info) > 2 else ''
+
+        # Select data type
+        if dataset == 'tless':
+            cam_type = test_type
+            if error_type in ['adi', 'add']:
+                model_type = 'cad_subdivided'
             else:
-                n_top_curr = n_top
-            ests_sorted = ests_sorted[slice(0, n_top_curr)]
-
-            for est_id, est in ests_sorted:
-                est_errs = []
-                R_e = est['R']
-                t_e = est['t']
-
-                errs_gts = {} # Errors w.r.t. GT poses of the same object
-                for gt_id, gt in enumerate(scene_gt[im_id]):
-                    if gt['obj_id'] != obj_id:
-                        continue
-
-                    e = -1.0
-                    R_g = gt['cam_R_m2c']
-                    t_g = gt['cam_t_m2c']
-
-                    if error_type == 'vsd':
-                        e = pose_error.vsd(R_e, t_e, R_g, t_g, models[obj_id],
-                                           depth_im, K, vsd_delta, vsd_tau,
-                                           vsd_cost)
-                    elif error_type == 'add':
-                        e = pose_error.add(R_e, t_e, R_g, t_g, models[obj_id])
-                    elif error_type == 'adi':
-                        e = pose_error.adi(R_e, t_e, R_g, t_g, models[obj_id])
-                    elif error_type == 'cou':
-                        e = pose_error.cou(R_e, t_e, R_g, t_g, models[obj_id],
-                                           dp['test_im_size'], K)
-                    elif error_type == 're':
-                        e = pose_error.re(R_e, R_g)
-                    elif error_type == 'te':
-                        e = pose_error.te(t_e, t_g)
-
-                    errs_gts[gt_id] = e
-
-                errs.append({
-                    'im_id': im_id,
-                    'obj_id': obj_id,
-                    'est_id': est_id,
-                    'score': est['score'],
-                    'errors': errs_gts
-                })
-            # print('Evaluation time: {}s'.format(time.time() - t))
-
-        print('Saving errors...')
-        errors_path = errors_mpath.format(result_path=result_path,
-                                          result_name=result_name,
-                                          error_sign=error_sign,
-                                          scene_id=scene_id)
-
-        misc.ensure_dir(os.path.dirname(errors_path))
-        inout.save_errors(errors_path, errs)
-
-    print('')
-print('Done.')
+                model_type = 'cad'
+        else:
+            model_type = ''
+            cam_type = ''
+
+        dataset_str = dataset
+        if test_type != '':
+            dataset_str += ' - {}'.format(test_type)
+
+        # Load dataset parameters
+        dp = get_dataset_params(dataset, model_type=model_type,
+                                test_type=test_type, cam_type=cam_type)
+
+        # Split the work by (scene_id, im_id). Only the (im_id, obj_id) units
+        # whose signature differs from the manifest are (re)calculated.
+        scene_ids = []
+        scene_units = {}
+        scene_sigs = {}
+        scene_fresh = {}
+        scene_n_tasks = {}
+        tasks = []
+        stale_units = []
+        scene_groups = itertools.groupby(
+            result_stream.list_results(result_path), key=lambda u: u[0])
+        for scene_id, units in scene_groups:
+            units = list(units)
+            res_units = [(im_id, obj_id) for _, im_id, obj_id, _ in units]
+            sigs = {}
+            for _, im_id, obj_id, res_path in units:
+                sigs[(im_id, obj_id)] = calc_unit_signature(
+                    dp, scene_id, im_id, obj_id, res_path)
+
+            path_args = {'result_path': result_path,
+                         'result_name': result_name,
+                         'error_sign': error_sign, 'scene_id': scene_id}
+            manifest = load_manifest(
+                manifest_mpath.format(errors_format=errors_format, **path_args),
+                errors_mpath.format(errors_format=errors_format, **path_args))
+            fresh = set(u for u, sig in sigs.items() if manifest.get(u) == sig)
+
+            scene_stale_units = [u for u in units if (u[1], u[2]) not in fresh]
+            scene_tasks = result_stream.group_by_image(scene_stale_units)
+
+            # Nothing to do if all units are up to date and no unit was removed
+            if not scene_tasks and set(manifest.keys()) == fresh:
+                print('Scene {}: errors are up to date'.format(scene_id))
+                continue
+            print('Scene {}: {} of {} results to be evaluated'.format(
+                scene_id, len(scene_stale_units), len(units)))
+
+            # Cache of the decoded depth images of the evaluated test images
+            # (built before the workers are started, they only read it)
+            if use_im_cache and error_type == 'vsd':
+                im_cache.load_scene_cache(
+                    dp['scene_im_cache_mpath'].format(scene_id, 'depth'),
+                    dp['test_depth_mpath'], scene_id,
+                    [im_id for _, im_id, _ in scene_tasks])
+
+            scene_ids.append(scene_id)
+            scene_units[scene_id] = res_units
+            scene_sigs[scene_id] = sigs
+            scene_fresh[scene_id] = fresh
+            scene_n_tasks[scene_id] = len(scene_tasks)
+            tasks += scene_tasks
+            stale_units += scene_stale_units
+
+        # The results are returned in the order of the tasks
+        init_args = (dataset, model_type, test_type, cam_type)
+        if n_workers > 1:
+            pool = multiprocessing.Pool(n_workers, initializer=init_worker,
+                                        initargs=init_args)
+            results = pool.imap(calc_errors_im, tasks)
+        else:
+            pool = None
+            init_worker(*init_args)
+
+            # The results and depth images are loaded ahead in the background
+            # (the depth images are read from the cache if it is used)
+            depth_mpath = None
+            if error_type == 'vsd' and not use_im_cache:
+                depth_mpath = dp['test_depth_mpath']
+            ims = result_stream.iter_results(
+                stale_units, depth_mpath, dp['cam']['depth_scale'],
+                n_threads=load_threads)
+            results = (calc_errors_im(task, *next(ims)[2:]) for task in tasks)
+
+        worker_stats = {} # pid -> [n_ims, n_ests, time]
+        task_id = 0
+        for scene_id in scene_ids:
+            path_args = {'result_path': result_path, 'result_name': result_name,
+                         'error_sign': error_sign, 'scene_id': scene_id}
+            errors_path = errors_mpath.format(errors_format=errors_format,
+                                              **path_args)
+            manifest_path = manifest_mpath.format(errors_format=errors_format,
+                                                  **path_args)
+            misc.ensure_dir(os.path.dirname(errors_path))
+
+            # Up-to-date errors from the existing errors file
+            unit_sigs = {u: scene_sigs[scene_id][u]
+                         for u in scene_fresh[scene_id]}
+            old_errs, old_unit_ranges = None, {}
+            if unit_sigs:
+                old_errs, old_unit_ranges = load_unit_errors(errors_path)
+
+            # Cache of the GT depth renderings (filled in the main process)
+            depth_cache = None
+            if use_depth_cache and error_type in ['vsd', 'cou'] and\
+                    scene_n_tasks[scene_id] > 0:
+                depth_cache = open_depth_cache(dp, scene_id)
+
+            new_errs = {}
+            for task_i in range(scene_n_tasks[scene_id]):
+                _, im_id, obj_res_paths = tasks[task_id]
+                if task_id % 10 == 0:
+                    print('Calculating error: {}, {}, {}, {}, {}'.format(
+                        error_type, method, dataset_str, scene_id, im_id))
+                task_id += 1
+
+                res = next(results)
+                for obj_id, _ in obj_res_paths:
+                    new_errs[(im_id, obj_id)] = []
+                    unit_sigs[(im_id, obj_id)] =\
+                        scene_sigs[scene_id][(im_id, obj_id)]
+                for e in res['errs']:
+                    new_errs[(im_id, e['obj_id'])].append(e)
+                if depth_cache is not None:
+                    for gt_id, depth_gt in sorted(res['depths_gt_new'].items()):
+                        depth_cache.put(im_id, gt_id, depth_gt)
+
+                stats = worker_stats.setdefault(res['pid'], [0, 0, 0.0])
+                stats[0] += 1
+                stats[1] += res['n_ests']
+                stats[2] += res['time']
+
+                # Checkpoint
+                if checkpoint_interval > 0 and\
+                        (task_i + 1) % checkpoint_interval == 0 and\
+                        task_i + 1 < scene_n_tasks[scene_id]:
+                    save_scene_errors(errors_path, manifest_path,
+                                      scene_units[scene_id], unit_sigs,
+                                      old_errs, old_unit_ranges, new_errs)
+
+            if depth_cache is not None:
+                depth_cache.save()
+
+            print('Saving errors...')
+            save_scene_errors(errors_path, manifest_path, scene_units[scene_id],
+                              unit_sigs, old_errs, old_unit_ranges, new_errs)
+
+        if pool is not None:
+            pool.close()
+            pool.join()
+        else:
+            close_worker()
+
+        # Throughput of the workers
+        print('')
+        for pid, (n_ims, n_ests, t) in sorted(worker_stats.items()):
+            print('Worker {}: {} images, {} estimates, {:.1f}s, '
+                  '{:.2f} estimates/s'.format(pid, n_ims, n_ests, t,
+                                              n_ests / max(t, 1e-6)))
+        print('Total time: {:.1f}s'.format(time.time() - t_start))
+
+        print('')
+    print('Done.')
@@ -18,28 +18,81 @@ from os.path import join as pjoin
 import sys
 from collections import defaultdict
 import numpy as np
+from scipy import sparse
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from pysixd import inout, pose_matching
+from pysixd import inout, pose_matching, score
 from params.dataset_params import get_dataset_params
 
 
+def calc_error_matrix(gts, errs):
+    """
+    :param gts: GT poses of a scene (as returned by inout.load_gt).
+    :param errs: Errors of the pose estimates in the scene in the columnar
+    format (as returned by inout.load_errors_bin).
+    :return: Tuple (errors, est_groups), where errors is a sparse matrix with
+    errors of the estimated poses w.r.t. the GT poses (the GT poses are ordered
+    as in gts) and est_groups are labels of (im_id, obj_id) groups of the
+    estimated poses.
+    """
+    # Index of the first GT pose of each image (only the estimates in the
+    # considered images are matched)
+    im_gt_starts = {}
+    n_gts = 0
+    for im_id, gts_im in gts.items():
+        im_gt_starts[im_id] = n_gts
+        n_gts += len(gts_im)
+    im_ids = np.array(sorted(gts.keys()), np.int64)
+    im_gt_starts = np.array([im_gt_starts[im_id] for im_id in im_ids], np.int64)
+    im_gt_counts = np.array([len(gts[im_id]) for im_id in im_ids], np.int64)
+
+    # Sparse matrix of errors of the estimated poses w.r.t. the GT poses
+    # (built directly from the errors in the CSR format)
+    n_ests = len(errs['score'])
+    est_im_ids = np.asarray(errs['im_id'], np.int64)
+    est_obj_ids = np.asarray(errs['obj_id'], np.int64)
+    indptr = np.asarray(errs['indptr'], np.int64)
+    pair_ests = np.repeat(np.arange(n_ests), np.diff(indptr))
+    pair_gt_ids = np.asarray(errs['gt_id'], np.int64)[indptr[0]:indptr[-1]]
+    pair_errors = np.asarray(errs['error'], np.float64)[indptr[0]:indptr[-1]]
+
+    est_im_inds = np.minimum(np.searchsorted(im_ids, est_im_ids),
+                             len(im_ids) - 1)
+    est_ok = im_ids[est_im_inds] == est_im_ids
+    pair_im_inds = est_im_inds[pair_ests]
+    pair_ok = est_ok[pair_ests] & (pair_gt_ids >= 0) &\
+              (pair_gt_ids < im_gt_counts[pair_im_inds])
+    pair_gt_inds = im_gt_starts[pair_im_inds] + pair_gt_ids
+    errors = sparse.coo_matrix(
+        (pair_errors[pair_ok], (pair_ests[pair_ok], pair_gt_inds[pair_ok])),
+        shape=(n_ests, n_gts))
+
+    # Estimates of each object in each image form a separate group
+    est_groups = est_im_ids * (est_obj_ids.max() + 1) + est_obj_ids
+
+    return errors, est_groups
+
+
+def get_est_values(errs, values_obj, default=np.nan):
+    """
+    :param errs: Errors of the pose estimates in the columnar format.
+    :param values_obj: Dictionary with a value for each object ID.
+    :return: Array with the value for each estimated pose.
+    """
+    obj_ids, est_obj_inds = np.unique(errs['obj_id'], return_inverse=True)
+    return np.array([values_obj.get(obj_id, default)
+                     for obj_id in obj_ids.tolist()], np.float64)[est_obj_inds]
+
+
 def match_poses(gts, gt_stats, errs, scene_id, visib_gt_min,
                 error_threshs, n_top):
 
-    # Organize the errors by image id and object id (for faster query)
-    errs_org = {}
-    for e in errs:
-        errs_org.setdefault(e['im_id'], {}). \
-            setdefault(e['obj_id'], []).append(e)
-
-    # Matching
+    # GT poses of the scene (the matching is done for the whole scene at once)
     matches = []
     for im_id, gts_im in gts.items():
-        matches_im = []
         for gt_id, gt in enumerate(gts_im):
             valid = gt_stats[im_id][gt_id]['visib_fract'] >= visib_gt_min
-            matches_im.append({
+            matches.append({
                 'scene_id': scene_id,
                 'im_id': im_id,
                 'obj_id': gt['obj_id'],
@@ -51,33 +104,87 @@ def match_poses(gts, gt_stats, errs, scene_id, visib_gt_min,
                 # 'stats': gt_stats[im_id][gt_id],
                 'valid': int(valid)
             })
+    if not matches or not len(errs['score']):
+        return matches
+
+    # Mask of valid GT poses (i.e. GT poses with sufficient visibility)
+    gt_valid_mask = np.array([m['valid'] for m in matches], np.bool_)
+
+    # Errors and threshold of correctness of each estimated pose
+    errors, est_groups = calc_error_matrix(gts, errs)
+    threshs = get_est_values(errs, error_threshs)
+
+    # Greedily match the estimated poses to the ground truth poses in the order
+    # of decreasing score
+    gt_match_ests, gt_match_errors = pose_matching.match_poses_batch(
+        errors, errs['score'], threshs, gt_valid_mask, n_top, est_groups)
 
-        # Mask of valid GT poses (i.e. GT poses with sufficient visibility)
-        gt_valid_mask = [m['valid'] for m in matches_im]
-
-        # Treat estimates of each object separately
-        im_obj_ids = set([gt['obj_id'] for gt in gts_im])
-        for obj_id in im_obj_ids:
-            if im_id in errs_org.keys() and obj_id in errs_org[im_id].keys():
-
-                # Greedily match the estimated poses to the ground truth
-                # poses in the order of decreasing score
-                errs_im_obj = errs_org[im_id][obj_id]
-                ms = pose_matching.match_poses(errs_im_obj,
-                                               error_threshs[obj_id],
-                                               n_top, gt_valid_mask)
-                for m in ms:
-                    g = matches_im[m['gt_id']]
-                    g['est_id'] = m['est_id']
-                    g['score'] = m['score']
-                    g['error'] = m['error']
-                    g['error_norm'] = m['error_norm']
-
-        matches += matches_im
+    for gt_ind in np.flatnonzero(gt_match_ests >= 0):
+        est_ind = gt_match_ests[gt_ind]
+        g = matches[gt_ind]
+        g['est_id'] = int(errs['est_id'][est_ind])
+        g['score'] = float(errs['score'][est_ind])
+        g['error'] = float(gt_match_errors[gt_ind])
+        g['error_norm'] = g['error'] / float(threshs[est_ind])
 
     return matches
 
 
+def sweep_scene(gts, gt_stats, errs, scene_id, error_scales, error_threshs,
+                visib_gt_mins, n_top):
+    """
+    Matches estimated poses to GT poses for all combinations of thresholds of
+    correctness and minimum visible fractions of valid GT poses.
+
+    :param error_scales: Dictionary with a scale of errors for each object ID
+    (the errors are divided by the scale, e.g. by the object diameter for ADD
+    and ADI, before being compared with the thresholds).
+    :param error_threshs: Thresholds of correctness (t-vector).
+    :param visib_gt_mins: Minimum visible fractions of valid GT poses
+    (v-vector).
+    :return: Dictionary with arrays 'scene_id', 'im_id', 'obj_id',
+    'visib_fract' (describing the GT poses, m-vectors) and 'matched' (vxtxm
+    ndarray indicating which GT poses have a matching estimated pose).
+    """
+    gt_im_ids = [im_id for im_id, gts_im in gts.items() for _ in gts_im]
+    gt_obj_ids = [gt['obj_id'] for gts_im in gts.values() for gt in gts_im]
+    gt_visib_fracts = [gt_stats[im_id][gt_id]['visib_fract']
+                       for im_id, gts_im in gts.items()
+                       for gt_id in range(len(gts_im))]
+    n_gts = len(gt_im_ids)
+    sweep = {
+        'scene_id': scene_id * np.ones(n_gts, np.int64),
+        'im_id': np.array(gt_im_ids, np.int64),
+        'obj_id': np.array(gt_obj_ids, np.int64),
+        'visib_fract': np.array(gt_visib_fracts, np.float64),
+        'matched': np.zeros((len(visib_gt_mins), len(error_threshs), n_gts),
+                            np.bool_)
+    }
+    if n_gts == 0 or not len(errs['score']):
+        return sweep
+
+    errors, est_groups = calc_error_matrix(gts, errs)
+    errors.data /= get_est_values(errs, error_scales)[errors.row]
+    gt_match_ests = pose_matching.match_poses_sweep(
+        errors, errs['score'], error_threshs, sweep['visib_fract'],
+        visib_gt_mins, n_top, est_groups)
+    sweep['matched'] = gt_match_ests >= 0
+    return sweep
+
+
+def concat_arrays(arrays_list, mask=None):
+    """
+    Concatenates dictionaries of arrays (e.g. results of sweep_scene or
+    calc_detections) along the last axis (and selects elements given by mask).
+    """
+    arrays = {}
+    for key in arrays_list[0].keys():
+        arrays[key] = np.concatenate([a[key] for a in arrays_list], axis=-1)
+        if mask is not None:
+            arrays[key] = arrays[key][..., mask]
+    return arrays
+
+
 def calc_recall(tp_count, targets_count):
     if targets_count == 0:
         return 0.0
@@ -85,8 +192,12 @@ def calc_recall(tp_count, targets_count):
         return tp_count / float(targets_count)
 
 
-def calc_scores(scene_ids, obj_ids, matches, n_top, do_print=True):
-
+def count_targets(scene_ids, obj_ids, matches, n_top):
+    """
+    :return: Tuple (tars, obj_tars, scene_tars) with the total number of
+    targets, and dictionaries with the number of targets per object and per
+    scene.
+    """
     # Count the number of visible object instances in each image
     insts = {i: {j: defaultdict(lambda: 0) for j in scene_ids} for i in obj_ids}
     for m in matches:
@@ -113,6 +224,15 @@ def calc_scores(scene_ids, obj_ids, matches, n_top, do_print=True):
             obj_tars[obj_id] += count
             scene_tars[scene_id] += count
 
+    return tars, obj_tars, scene_tars
+
+
+def calc_scores(scene_ids, obj_ids, matches, n_top, do_print=True):
+
+    # Count the number of targets
+    tars, obj_tars, scene_tars = count_targets(scene_ids, obj_ids, matches,
+                                               n_top)
+
     # Count the number of true positives
     tps = 0 # Total number of true positives
     obj_tps = {i: 0 for i in obj_ids} # True positives per object
@@ -145,7 +265,7 @@ def calc_scores(scene_ids, obj_ids, matches, n_top, do_print=True):
         'scene_recalls': scene_recalls,
         'mean_scene_recall': mean_scene_recall,
         'gt_count': len(matches),
-        'targets_count': tars,
+        'targets_count': int(tars),
         'tp_count': tps,
     }
 
@@ -172,6 +292,268 @@ def calc_scores(scene_ids, obj_ids, matches, n_top, do_print=True):
     return scores
 
 
+def calc_detections(gts, errs, matches, scene_id, error_threshs):
+    """
+    Classifies the estimated poses in the considered images as detections:
+    true positives (matched to a valid GT pose), ignored (not matched, but
+    with error below the threshold w.r.t. a GT pose which is not valid, e.g.
+    because of low visibility) and false positives (the rest).
+
+    :param gts: GT poses of the scene (as passed to match_poses).
+    :param errs: Errors of the pose estimates in the columnar format.
+    :param matches: Matches of the scene (as returned by match_poses).
+    :param scene_id: Scene ID.
+    :param error_threshs: Dictionary with a threshold of correctness for each
+    object ID.
+    :return: Dictionary with arrays 'scene_id', 'obj_id', 'score', 'tp' and
+    'ignored' describing the detections.
+    """
+    est_im_ids = np.asarray(errs['im_id'], np.int64)
+    est_mask = np.isin(est_im_ids, np.array(list(gts.keys()), np.int64))
+    n_ests = len(est_im_ids)
+
+    # True positives
+    tp = np.zeros(n_ests, np.bool_)
+    if n_ests:
+        est_inds = {key: i for i, key in enumerate(zip(
+            est_im_ids.tolist(), np.asarray(errs['obj_id']).tolist(),
+            np.asarray(errs['est_id']).tolist()))}
+        for m in matches:
+            if m['est_id'] != -1 and m['valid']:
+                tp[est_inds[(m['im_id'], m['obj_id'], m['est_id'])]] = True
+
+    # Detections of GT poses which are not valid are ignored
+    ignored = np.zeros(n_ests, np.bool_)
+    if n_ests and len(matches):
+        errors, _ = calc_error_matrix(gts, errs)
+        gt_valid_mask = np.array([m['valid'] for m in matches], np.bool_)
+        threshs = get_est_values(errs, error_threshs)
+        pairs_ignored = ~gt_valid_mask[errors.col] &\
+                        (errors.data < threshs[errors.row])
+        ignored[errors.row[pairs_ignored]] = True
+        ignored &= ~tp
+
+    return {
+        'scene_id': scene_id * np.ones(est_mask.sum(), np.int64),
+        'obj_id': np.asarray(errs['obj_id'], np.int64)[est_mask],
+        'score': np.asarray(errs['score'], np.float64)[est_mask],
+        'tp': tp[est_mask],
+        'ignored': ignored[est_mask]
+    }
+
+
+def calc_detection_scores(scene_ids, obj_ids, dets, matches, n_top,
+                          do_print=True):
+    """
+    Calculates Average Precision (AP) of the 6D detection task, i.e. the area
+    under the precision/recall curve of the detections (see calc_detections)
+    sorted by decreasing score.
+
+    :param dets: Detections (concatenated results of calc_detections).
+    :param matches: Matches (the number of targets is given by the valid GT
+    poses as in calc_scores).
+    :return: Dictionary with the scores.
+    """
+    obj_ids = list(obj_ids)
+    scene_ids = list(scene_ids)
+    tars, obj_tars, scene_tars = count_targets(scene_ids, obj_ids, matches,
+                                               n_top)
+
+    # The ignored detections are removed
+    keep = ~dets['ignored']
+    scores = dets['score'][keep]
+    tps = dets['tp'][keep]
+    obj_map = {obj_id: i for i, obj_id in enumerate(obj_ids)}
+    scene_map = {scene_id: i for i, scene_id in enumerate(scene_ids)}
+    obj_inds = np.array([obj_map.get(i, len(obj_ids))
+                         for i in dets['obj_id'][keep].tolist()], np.int64)
+    scene_inds = np.array([scene_map.get(i, len(scene_ids))
+                           for i in dets['scene_id'][keep].tolist()], np.int64)
+
+    # Detections of other than the considered objects (in the last group) are
+    # counted only in the total AP
+    total_pr = score.pr_curves(scores, tps, tars)
+    obj_pr = score.pr_curves(scores, tps,
+                             [obj_tars[i] for i in obj_ids] + [0],
+                             obj_inds, len(obj_ids) + 1)
+    scene_pr = score.pr_curves(scores, tps,
+                               [scene_tars[i] for i in scene_ids] + [0],
+                               scene_inds, len(scene_ids) + 1)
+
+    obj_aps = {obj_id: float(obj_pr['ap'][i])
+               for i, obj_id in enumerate(obj_ids)}
+    scene_aps = {scene_id: float(scene_pr['ap'][i])
+                 for i, scene_id in enumerate(scene_ids)}
+    scores = {
+        'total_ap': float(total_pr['ap'][0]),
+        'obj_aps': obj_aps,
+        'mean_obj_ap': float(np.mean(list(obj_aps.values()))),
+        'scene_aps': scene_aps,
+        'mean_scene_ap': float(np.mean(list(scene_aps.values()))),
+        'det_count': int(len(scores)),
+        'ignored_count': int(dets['ignored'].sum()),
+        'targets_count': int(tars),
+        'tp_count': int(tps.sum())
+    }
+
+    if do_print:
+        obj_aps_str = ', '.join(
+            ['{}: {:.3f}'.format(i, s) for i, s in scores['obj_aps'].items()])
+        scene_aps_str = ', '.join(
+            ['{}: {:.3f}'.format(i, s) for i, s in scores['scene_aps'].items()])
+
+        print('')
+        print('Detection count:    {:d}'.format(scores['det_count']))
+        print('Ignored count:      {:d}'.format(scores['ignored_count']))
+        print('Target count:       {:d}'.format(scores['targets_count']))
+        print('TP count:           {:d}'.format(scores['tp_count']))
+        print('Total AP:           {:.4f}'.format(scores['total_ap']))
+        print('Mean object AP:     {:.4f}'.format(scores['mean_obj_ap']))
+        print('Mean scene AP:      {:.4f}'.format(scores['mean_scene_ap']))
+        print('Object APs:\n{}'.format(obj_aps_str))
+        print('Scene APs:\n{}'.format(scene_aps_str))
+        print('')
+
+    return scores
+
+
+def calc_auc(threshs, recalls):
+    """
+    :param threshs: Thresholds of correctness (t-vector).
+    :param recalls: ...xt ndarray with recall rates at the thresholds.
+    :return: Area under the recall curve(s) normalized by the range of the
+    thresholds (i.e. mean recall; the recall itself for a single threshold).
+    """
+    order = np.argsort(threshs)
+    threshs = np.asarray(threshs, np.float64)[order]
+    recalls = np.asarray(recalls, np.float64)[..., order]
+    if len(threshs) == 1 or threshs[-1] == threshs[0]:
+        return recalls.mean(axis=-1)
+    areas = 0.5 * (recalls[..., 1:] + recalls[..., :-1]) * np.diff(threshs)
+    return areas.sum(axis=-1) / (threshs[-1] - threshs[0])
+
+
+def calc_sweep_scores(scene_ids, obj_ids, sweep, n_top, error_threshs,
+                      visib_gt_mins, do_print=True):
+    """
+    Calculates recall curves (recall vs. threshold of correctness) for each
+    minimum visible fraction of valid GT poses, and their area under curve.
+
+    :param sweep: Matching for all combinations of the thresholds and the
+    minimum visible fractions (see sweep_scene and concat_arrays).
+    :return: Dictionary with the scores. The recall curves are given by lists
+    indexed by [visib_id][thresh_id], AUCs by lists indexed by [visib_id].
+    """
+    obj_ids = list(obj_ids)
+    scene_ids = list(scene_ids)
+    obj_map = {obj_id: i for i, obj_id in enumerate(obj_ids)}
+    scene_map = {scene_id: i for i, scene_id in enumerate(scene_ids)}
+    gt_obj_inds = np.array([obj_map[i] for i in sweep['obj_id'].tolist()],
+                           np.int64)
+    gt_scene_inds = np.array([scene_map[i] for i in sweep['scene_id'].tolist()],
+                             np.int64)
+    n_visibs = len(visib_gt_mins)
+    n_threshs = len(error_threshs)
+
+    # Mask of valid GT poses for each minimum visible fraction (vxm)
+    valid = sweep['visib_fract'][np.newaxis, :] >=\
+            np.asarray(visib_gt_mins, np.float64)[:, np.newaxis]
+
+    # Count the number of targets (see calc_scores) - the instances are grouped
+    # by object, scene and image
+    if len(gt_obj_inds):
+        _, inst_groups = np.unique(np.stack(
+            [gt_obj_inds, gt_scene_inds, sweep['im_id']], axis=1),
+            axis=0, return_inverse=True)
+        inst_groups = inst_groups.ravel()
+    else:
+        inst_groups = np.zeros(0, np.int64)
+    n_groups = inst_groups.max() + 1 if len(inst_groups) else 0
+    group_obj_inds = np.zeros(n_groups, np.int64)
+    group_obj_inds[inst_groups] = gt_obj_inds
+    group_scene_inds = np.zeros(n_groups, np.int64)
+    group_scene_inds[inst_groups] = gt_scene_inds
+
+    obj_tars = np.zeros((n_visibs, len(obj_ids)))
+    scene_tars = np.zeros((n_visibs, len(scene_ids)))
+    for v in range(n_visibs):
+        counts = np.bincount(inst_groups, weights=valid[v], minlength=n_groups)
+        if n_top > 0:
+            counts = np.minimum(n_top, counts)
+        obj_tars[v] = np.bincount(group_obj_inds, weights=counts,
+                                  minlength=len(obj_ids))
+        scene_tars[v] = np.bincount(group_scene_inds, weights=counts,
+                                    minlength=len(scene_ids))
+    tars = obj_tars.sum(axis=1)
+
+    # Count the number of true positives (vxtxm -> vxt, vxtxobjects, ...)
+    tps_mask = (sweep['matched'] & valid[:, np.newaxis, :]).astype(np.float64)
+    tps = tps_mask.sum(axis=2)
+    obj_tps = np.dot(tps_mask, np.eye(len(obj_ids))[gt_obj_inds])
+    scene_tps = np.dot(tps_mask, np.eye(len(scene_ids))[gt_scene_inds])
+
+    # Recall rates (0 if there are no targets, as in calc_recall)
+    def recall(tp_counts, target_counts):
+        return tp_counts / np.maximum(target_counts, 1) *\
+               (target_counts > 0)
+
+    total_recalls = recall(tps, tars[:, np.newaxis])
+    obj_recalls = recall(obj_tps, obj_tars[:, np.newaxis, :])
+    scene_recalls = recall(scene_tps, scene_tars[:, np.newaxis, :])
+    mean_obj_recalls = obj_recalls.mean(axis=2)
+    mean_scene_recalls = scene_recalls.mean(axis=2)
+
+    scores = {
+        'error_threshs': [float(t) for t in error_threshs],
+        'visib_gt_mins': [float(v) for v in visib_gt_mins],
+        'total_recall': total_recalls.tolist(),
+        'total_recall_auc': calc_auc(error_threshs, total_recalls).tolist(),
+        'mean_obj_recall': mean_obj_recalls.tolist(),
+        'mean_obj_recall_auc':
+            calc_auc(error_threshs, mean_obj_recalls).tolist(),
+        'mean_scene_recall': mean_scene_recalls.tolist(),
+        'mean_scene_recall_auc':
+            calc_auc(error_threshs, mean_scene_recalls).tolist(),
+        'obj_recalls': {obj_id: obj_recalls[:, :, i].tolist()
+                        for i, obj_id in enumerate(obj_ids)},
+        'obj_recall_aucs': {
+            obj_id: calc_auc(error_threshs, obj_recalls[:, :, i]).tolist()
+            for i, obj_id in enumerate(obj_ids)},
+        'scene_recalls': {scene_id: scene_recalls[:, :, i].tolist()
+                          for i, scene_id in enumerate(scene_ids)},
+        'scene_recall_aucs': {
+            scene_id: calc_auc(error_threshs, scene_recalls[:, :, i]).tolist()
+            for i, scene_id in enumerate(scene_ids)},
+        'gt_count': int(len(gt_obj_inds)),
+        'targets_count': [int(t) for t in tars],
+        'tp_count': tps.astype(np.int64).tolist()
+    }
+
+    if do_print:
+        print('')
+        print('Thresholds: {}'.format(', '.join(
+            ['{:.3f}'.format(t) for t in scores['error_threshs']])))
+        for v, visib_gt_min in enumerate(scores['visib_gt_mins']):
+            obj_aucs_str = ', '.join(
+                ['{}: {:.3f}'.format(i, s[v])
+                 for i, s in scores['obj_recall_aucs'].items()])
+            print('')
+            print('Min. visible fraction: {}'.format(visib_gt_min))
+            print('Target count:              {:d}'.format(
+                scores['targets_count'][v]))
+            print('Total recall:              {}'.format(', '.join(
+                ['{:.3f}'.format(r) for r in scores['total_recall'][v]])))
+            print('Total recall AUC:          {:.4f}'.format(
+                scores['total_recall_auc'][v]))
+            print('Mean object recall AUC:    {:.4f}'.format(
+                scores['mean_obj_recall_auc'][v]))
+            print('Mean scene recall AUC:     {:.4f}'.format(
+                scores['mean_scene_recall_auc'][v]))
+            print('Object recall AUCs:\n{}'.format(obj_aucs_str))
+        print('')
+
+    return scores
+
 def main():
     # Paths to pose errors (calculated using eval_calc_errors.py)
     #---------------------------------------------------------------------------
@@ -187,13 +569,20 @@ def main():
 
     # Other paths
     #---------------------------------------------------------------------------
-    # Mask of path to the input file with calculated errors
-    errors_mpath = pjoin('{error_path}', 'errors_{scene_id:02d}.yml')
+    # Mask of path to the input file with calculated errors (the columnar binary
+    # format is used if available, YAML otherwise)
+    errors_mpath = pjoin('{error_path}', 'errors_{scene_id:02d}.{errors_format}')
 
     # Mask of path to the output file with established matches and calculated scores
     matches_mpath = pjoin('{error_path}', 'matches_{eval_sign}.yml')
     scores_mpath = pjoin('{error_path}', 'scores_{eval_sign}.yml')
 
+    # Mask of path to the output file with recall curves (threshold sweep)
+    scores_sweep_mpath = pjoin('{error_path}', 'scores_sweep_{eval_sign}.yml')
+
+    # Mask of path to the output file with scores of the 6D detection task
+    scores_det_mpath = pjoin('{error_path}', 'scores_det_{eval_sign}.yml')
+
     # Parameters
     #---------------------------------------------------------------------------
     use_image_subset = True  # Whether to use the specified subset of images
@@ -215,6 +604,26 @@ def main():
         'adi': 0.1
     }
 
+    # Threshold sweep - recall curves are calculated for all combinations of
+    # the thresholds of correctness and the minimum visible fractions of valid
+    # GT poses (in one pass over the errors)
+    do_sweep = False
+    error_thresh_sweep = {
+        'vsd': np.linspace(0.05, 0.5, 10),
+        'cou': np.linspace(0.05, 0.5, 10),
+        'te': np.linspace(0.5, 5.0, 10), # [cm]
+        're': np.linspace(0.5, 5.0, 10) # [deg]
+    }
+    error_thresh_fact_sweep = { # Factors of the object diameter
+        'add': np.linspace(0.05, 0.5, 10),
+        'adi': np.linspace(0.05, 0.5, 10)
+    }
+    visib_gt_min_sweep = [0.0, 0.1, 0.3, 0.5]
+
+    # Whether to evaluate also the 6D detection task (Average Precision of the
+    # estimated poses ranked by their confidence score)
+    do_detection = False
+
     # Evaluation
     #---------------------------------------------------------------------------
     for error_path in error_paths:
@@ -263,13 +672,29 @@ def main():
             for obj_id in obj_ids:
                 error_threshs[obj_id] = error_thresh[error_type]
 
+        # Thresholds of the sweep (relative to the object diameter for ADD and
+        # ADI - the errors are divided by the diameter)
+        if do_sweep:
+            error_scales = {}
+            if error_type in ['add', 'adi']:
+                error_threshs_sweep = error_thresh_fact_sweep[error_type]
+                for obj_id in obj_ids:
+                    error_scales[obj_id] = models_info[obj_id]['diameter']
+            else:
+                error_threshs_sweep = error_thresh_sweep[error_type]
+                for obj_id in obj_ids:
+                    error_scales[obj_id] = 1.0
+
         # Go through the test scenes and match estimated poses to GT poses
         #-----------------------------------------------------------------------
         matches = []  # Stores info about the matching estimate for each GT
+        sweeps = [] # Matching for all thresholds (if do_sweep)
+        dets = [] # Detections (if do_detection)
         for scene_id in scene_ids:
 
             # Load GT poses
-            gts = inout.load_gt(dp['scene_gt_mpath'].format(scene_id))
+            gts = inout.load_gt(dp['scene_gt_mpath'].format(scene_id),
+                                use_index=True)
 
             # Load statistics (e.g. visibility fraction) of the GT poses
             gt_stats_path = dp['scene_gt_stats_mpath'].format(scene_id,
@@ -284,13 +709,31 @@ def main():
 
             # Load pre-calculated errors of the pose estimates
             scene_errs_path = errors_mpath.format(
-                error_path=error_path, scene_id=scene_id)
+                error_path=error_path, scene_id=scene_id, errors_format='bin')
+            if not os.path.isfile(scene_errs_path):
+                scene_errs_path = errors_mpath.format(
+                    error_path=error_path, scene_id=scene_id,
+                    errors_format='yml')
 
             if os.path.isfile(scene_errs_path):
-                errs = inout.load_errors(scene_errs_path)
+                if scene_errs_path.endswith('.bin'):
+                    errs = inout.load_errors_bin(scene_errs_path)
+                else:
+                    errs = inout.errors_to_arrays(
+                        inout.load_errors(scene_errs_path))
+
+                scene_matches = match_poses(gts, gt_stats, errs, scene_id,
+                                            visib_gt_min, error_threshs, n_top)
+                matches += scene_matches
+
+                if do_detection:
+                    dets.append(calc_detections(gts, errs, scene_matches,
+                                                scene_id, error_threshs))
 
-                matches += match_poses(gts, gt_stats, errs, scene_id,
-                                       visib_gt_min, error_threshs, n_top)
+                if do_sweep:
+                    sweeps.append(sweep_scene(
+                        gts, gt_stats, errs, scene_id, error_scales,
+                        error_threshs_sweep, visib_gt_min_sweep, n_top))
 
             elif require_all_errors:
                 raise IOError(
@@ -319,6 +762,28 @@ def main():
                 error_path=error_path, eval_sign=eval_sign_lm)
             inout.save_yaml(matches_path, matches_lm)
 
+            # 6D detection
+            if do_detection:
+                det = concat_arrays(dets)
+                det_lm = concat_arrays(dets, det['scene_id'] == det['obj_id'])
+                scores_det_lm = calc_detection_scores(
+                    scene_ids, obj_ids, det_lm, matches_lm, n_top)
+                scores_det_path = scores_det_mpath.format(
+                    error_path=error_path, eval_sign=eval_sign_lm)
+                inout.save_yaml(scores_det_path, scores_det_lm)
+
+            # Recall curves
+            if do_sweep:
+                sweep = concat_arrays(sweeps)
+                sweep_lm = concat_arrays(
+                    sweeps, sweep['scene_id'] == sweep['obj_id'])
+                scores_sweep_lm = calc_sweep_scores(
+                    scene_ids, obj_ids, sweep_lm, n_top, error_threshs_sweep,
+                    visib_gt_min_sweep)
+                scores_sweep_path = scores_sweep_mpath.format(
+                    error_path=error_path, eval_sign='linemod')
+                inout.save_yaml(scores_sweep_path, scores_sweep_lm)
+
             print('-- Occlusion dataset')
             eval_sign_occ = 'occlusion_' + eval_sign
             matches_occ = [m for m in matches if m['scene_id'] == 2]
@@ -335,6 +800,26 @@ def main():
             matches_path = matches_mpath.format(
                 error_path=error_path, eval_sign=eval_sign_occ)
             inout.save_yaml(matches_path, matches_occ)
+
+            # 6D detection
+            if do_detection:
+                det_occ = concat_arrays(dets, (det['scene_id'] == 2) &
+                                        np.isin(det['obj_id'], obj_ids_occ))
+                scores_det_occ = calc_detection_scores(
+                    scene_ids_occ, obj_ids_occ, det_occ, matches_occ, n_top)
+                scores_det_path = scores_det_mpath.format(
+                    error_path=error_path, eval_sign=eval_sign_occ)
+                inout.save_yaml(scores_det_path, scores_det_occ)
+
+            # Recall curves
+            if do_sweep:
+                sweep_occ = concat_arrays(sweeps, sweep['scene_id'] == 2)
+                scores_sweep_occ = calc_sweep_scores(
+                    scene_ids_occ, obj_ids_occ, sweep_occ, n_top,
+                    error_threshs_sweep, visib_gt_min_sweep)
+                scores_sweep_path = scores_sweep_mpath.format(
+                    error_path=error_path, eval_sign='occlusion')
+                inout.save_yaml(scores_sweep_path, scores_sweep_occ)
         else:
             scores = calc_scores(scene_ids, obj_ids, matches, n_top)
 
@@ -348,6 +833,23 @@ def main():
                 error_path=error_path, eval_sign=eval_sign)
             inout.save_yaml(matches_path, matches)
 
+            # 6D detection
+            if do_detection:
+                scores_det = calc_detection_scores(
+                    scene_ids, obj_ids, concat_arrays(dets), matches, n_top)
+                scores_det_path = scores_det_mpath.format(
+                    error_path=error_path, eval_sign=eval_sign)
+                inout.save_yaml(scores_det_path, scores_det)
+
+            # Recall curves
+            if do_sweep:
+                scores_sweep = calc_sweep_scores(
+                    scene_ids, obj_ids, concat_arrays(sweeps), n_top,
+                    error_threshs_sweep, visib_gt_min_sweep)
+                scores_sweep_path = scores_sweep_mpath.format(
+                    error_path=error_path, eval_sign='all')
+                inout.save_yaml(scores_sweep_path, scores_sweep)
+
     print('Done.')
 
 
@@ -2,16 +2,35 @@
 # Center for Machine Perception, Czech Technical University in Prague
 
 # Renders RGB-D images of an object model.
+#
+# The images are produced by a pipeline: a pool of render worker processes
+# (each with its own renderer, i.e. its own OpenGL context) renders chunks of
+# views, and a pool of writer threads encodes and saves the images. The
+# rendered views are passed to the writers through a bounded queue, so the
+# memory usage is bounded even if the writers are slower than the renderers.
+# Views whose images already exist are not rendered again, i.e. an interrupted
+# rendering can be resumed by running the script again.
 
 import os
 import sys
 import math
+import time
+import itertools
+import threading
+import collections
+import multiprocessing
+import multiprocessing.util
 import numpy as np
 import cv2
 # import scipy.misc
 
+try:
+    import queue
+except ImportError: # Python 2
+    import Queue as queue
+
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from pysixd import view_sampler, inout, misc, renderer
+from pysixd import view_sampler, inout, misc, renderer, model_store
 
 from params.dataset_params import get_dataset_params
 
@@ -100,6 +119,20 @@ shading = 'phong' # 'flat', 'phong'
 # down-sampled to the required resolution.
 ssaa_fact = 4
 
+# Number of render worker processes (each has its own OpenGL context; 1 = the
+# views are rendered in the main process)
+n_render_workers = 2
+
+# Number of threads encoding and saving the rendered images
+n_writer_threads = 4
+
+# Maximum number of rendered views waiting to be saved
+write_queue_size = 64
+
+# Number of views rendered by a worker in one task (the views of each object
+# are split into chunks of this size)
+views_per_task = 50
+
 # Output path masks
 out_rgb_mpath = '../output/render/{:02d}/rgb/{:04d}.png'
 out_depth_mpath = '../output/render/{:02d}/depth/{:04d}.png'
@@ -107,21 +140,54 @@ out_obj_info_path = '../output/render/{:02d}/info.yml'
 out_obj_gt_path = '../output/render/{:02d}/gt.yml'
 out_views_vis_mpath = '../output/render/views_radius={}.ply'
 
-# Prepare output folder
-# misc.ensure_dir(os.path.dirname(out_obj_info_path))
-
 # Image size and K for SSAA
 im_size_rgb = [int(round(x * float(ssaa_fact))) for x in par['cam']['im_size']]
-K_rgb = par['cam']['K'] * ssaa_fact
-
-for obj_id in obj_ids:
-    # Prepare folders
-    misc.ensure_dir(os.path.dirname(out_rgb_mpath.format(obj_id, 0)))
-    misc.ensure_dir(os.path.dirname(out_depth_mpath.format(obj_id, 0)))
+K_rgb = par['cam']['K'].copy()
+K_rgb[:2, :] *= ssaa_fact # K[2, 2] stays 1 (used by the software renderer)
+
+# State of the current (render worker) process
+_worker = {}
+
+def init_worker():
+    """
+    Creates a renderer (the OpenGL context is created in the worker process).
+    """
+    # The renderer keeps the OpenGL context, the compiled programs and the
+    # uploaded model alive across the rendered views
+    _worker['ren'] = renderer.Renderer(
+        par['cam']['im_size'], clip_near, clip_far,
+        ambient_weight=ambient_weight, shading=shading)
+    _worker['obj_id'] = None
+
+    # In a pool worker, the renderer is closed when the worker exits (after
+    # pool.close() and pool.join() in the main process)
+    if multiprocessing.current_process().name != 'MainProcess':
+        multiprocessing.util.Finalize(None, close_worker, exitpriority=10)
+
+def close_worker():
+    """
+    Releases the model and the OpenGL context of the worker.
+    """
+    if _worker.get('ren') is not None:
+        _worker['ren'].close()
+    _worker.clear()
+
+def load_object(obj_id):
+    """
+    Adds a model to the renderer of the worker (the previously rendered model
+    is removed).
+
+    :param obj_id: Object ID.
+    """
+    if _worker['obj_id'] == obj_id:
+        return
+    ren = _worker['ren']
+    if _worker['obj_id'] is not None:
+        ren.remove_object(_worker['obj_id'])
 
     # Load model
     model_path = par['model_mpath'].format(obj_id)
-    model = inout.load_ply(model_path)
+    model = model_store.load_model(model_path)
 
     # Load model texture
     if par['model_texture_mpath']:
@@ -130,65 +196,233 @@ for obj_id in obj_ids:
     else:
         model_texture = None
 
-    obj_info = {}
-    obj_gt = {}
-    im_id = 0
+    ren.add_object(obj_id, model, texture=model_texture)
+    _worker['obj_id'] = obj_id
+
+def is_rendered(obj_id, im_id):
+    """
+    :return: Whether both images of the view were already saved.
+    """
+    return os.path.isfile(out_rgb_mpath.format(obj_id, im_id)) and\
+           os.path.isfile(out_depth_mpath.format(obj_id, im_id))
+
+def render_views(task):
+    """
+    Renders RGB-D images of an object model from a chunk of views.
+
+    :param task: Tuple (obj_id, views), where views is a list of
+    (im_id, R, t).
+    :return: Tuple (obj_id, rendered, n_rendered), where rendered is a list of
+    (im_id, rgb, depth, obj_bb) and n_rendered is the number of rendered
+    views. rgb and depth are None for views which were already rendered (their
+    2D bounding box is calculated from the saved depth image).
+    """
+    obj_id, views = task
+    ren = _worker['ren']
+
+    rendered = []
+    n_rendered = 0
+    for im_id, R, t in views:
+        if is_rendered(obj_id, im_id):
+            rgb = None
+            depth_saved = inout.load_depth(
+                out_depth_mpath.format(obj_id, im_id), dtype=np.uint16)
+            ys, xs = np.nonzero(depth_saved > 0)
+
+        else:
+            load_object(obj_id)
+
+            if ssaa_fact == 1:
+                # Both images can be rendered in a single call
+                rgb, depth = ren.render(obj_id, par['cam']['K'], R, t,
+                                        mode='rgb+depth')
+            else:
+                # Render depth image
+                depth = ren.render(obj_id, par['cam']['K'], R, t, mode='depth')
+
+                # Render RGB image
+                rgb = ren.render(obj_id, K_rgb, R, t, mode='rgb',
+                                 im_size=im_size_rgb)
+
+                # The OpenCV function was used for rendering of the training
+                # images provided for the SIXD Challenge 2017.
+                rgb = cv2.resize(rgb, par['cam']['im_size'],
+                                 interpolation=cv2.INTER_AREA)
+                #rgb = scipy.misc.imresize(rgb, par['cam']['im_size'][::-1], 'bicubic')
+
+            # Convert depth so it is in the same units as the real test images
+            depth /= par['cam']['depth_scale']
+
+            ys, xs = np.nonzero(depth > 0)
+            n_rendered += 1
+
+        # Get 2D bounding box of the object model at the ground truth pose
+        obj_bb = misc.calc_2d_bbox(xs, ys, par['cam']['im_size'])
+
+        rendered.append((im_id, rgb, None if rgb is None else depth, obj_bb))
+
+    return obj_id, rendered, n_rendered
+
+def save_atomic(save_func, path, im):
+    """
+    Saves an image into a temporary file which is then renamed, i.e. the image
+    exists only if it was completely saved.
+    """
+    tmp_path = '{}.tmp{}'.format(*os.path.splitext(path))
+    save_func(tmp_path, im)
+    os.rename(tmp_path, path)
+
+def write_views(write_queue, write_errors):
+    """
+    Saves the rendered images taken from the queue (until None is taken).
+
+    :param write_queue: Queue with (obj_id, im_id, rgb, depth).
+    :param write_errors: List to which the raised exceptions are appended (the
+    queue is consumed even after an error, so the renderers are not blocked).
+    """
+    while True:
+        item = write_queue.get()
+        try:
+            if item is None:
+                break
+            obj_id, im_id, rgb, depth = item
+            save_atomic(inout.save_depth, out_depth_mpath.format(obj_id, im_id),
+                        depth)
+            save_atomic(inout.save_im, out_rgb_mpath.format(obj_id, im_id), rgb)
+        except Exception as e:
+            write_errors.append(e)
+        finally:
+            write_queue.task_done()
+
+if __name__ == '__main__':
+    t_start = time.time()
+
+    # Sample views (the same for all objects)
+    misc.ensure_dir(os.path.dirname(out_views_vis_mpath))
+    views_radii = []
     for radius in radii:
-        # Sample views
         views, views_level = view_sampler.sample_views(min_n_views, radius,
                                                        azimuth_range, elev_range)
         print('Sampled views: ' + str(len(views)))
         view_sampler.save_vis(out_views_vis_mpath.format(str(radius)),
                               views, views_level)
+        views_radii.append((views, views_level))
 
-        # Render the object model from all the views
-        for view_id, view in enumerate(views):
-            if view_id % 10 == 0:
-                print('obj,radius,view: ' + str(obj_id) +
-                      ',' + str(radius) + ',' + str(view_id))
-
-            # Render depth image
-            depth = renderer.render(model, par['cam']['im_size'], par['cam']['K'],
-                                    view['R'], view['t'],
-                                    clip_near, clip_far, mode='depth')
-
-            # Convert depth so it is in the same units as the real test images
-            depth /= par['cam']['depth_scale']
-
-            # Render RGB image
-            rgb = renderer.render(model, im_size_rgb, K_rgb, view['R'], view['t'],
-                                  clip_near, clip_far, texture=model_texture,
-                                  ambient_weight=ambient_weight, shading=shading,
-                                  mode='rgb')
-
-            # The OpenCV function was used for rendering of the training images
-            # provided for the SIXD Challenge 2017.
-            rgb = cv2.resize(rgb, par['cam']['im_size'], interpolation=cv2.INTER_AREA)
-            #rgb = scipy.misc.imresize(rgb, par['cam']['im_size'][::-1], 'bicubic')
-
-            # Save the rendered images
-            inout.save_im(out_rgb_mpath.format(obj_id, im_id), rgb)
-            inout.save_depth(out_depth_mpath.format(obj_id, im_id), depth)
+    # Split the views of each object into chunks (rendered as separate tasks)
+    tasks = []
+    obj_n_tasks = {}
+    obj_info = {}
+    obj_gt = {}
+    n_views_todo = 0
+    for obj_id in obj_ids:
+        # Prepare folders
+        misc.ensure_dir(os.path.dirname(out_rgb_mpath.format(obj_id, 0)))
+        misc.ensure_dir(os.path.dirname(out_depth_mpath.format(obj_id, 0)))
+
+        obj_info[obj_id] = {}
+        obj_gt[obj_id] = {}
+        obj_views = []
+        im_id = 0
+        for views, views_level in views_radii:
+            for view_id, view in enumerate(views):
+                obj_views.append((im_id, view['R'], view['t']))
+
+                obj_info[obj_id][im_id] = {
+                    'cam_K': par['cam']['K'].flatten().tolist(),
+                    'view_level': int(views_level[view_id]),
+                    #'sphere_radius': float(radius)
+                }
+
+                obj_gt[obj_id][im_id] = [{
+                    'cam_R_m2c': view['R'].flatten().tolist(),
+                    'cam_t_m2c': view['t'].flatten().tolist(),
+                    'obj_bb': None, # Filled when rendered
+                    'obj_id': int(obj_id)
+                }]
+
+                if not is_rendered(obj_id, im_id):
+                    n_views_todo += 1
+                im_id += 1
+
+        obj_tasks = [(obj_id, obj_views[i:(i + views_per_task)])
+                     for i in range(0, len(obj_views), views_per_task)]
+        obj_n_tasks[obj_id] = len(obj_tasks)
+        tasks += obj_tasks
+
+    print('Views to render: {} (already rendered: {})'.format(
+        n_views_todo, sum(len(v) for _, v in tasks) - n_views_todo))
+
+    # Writer threads
+    write_queue = queue.Queue(maxsize=write_queue_size)
+    write_errors = []
+    writers = []
+    for _ in range(n_writer_threads):
+        writer = threading.Thread(target=write_views,
+                                  args=(write_queue, write_errors))
+        writer.daemon = True
+        writer.start()
+        writers.append(writer)
+
+    # Render workers. At most 2 tasks per worker are submitted in advance (new
+    # tasks are submitted only when the rendered views are passed to the
+    # writers, i.e. the rendering waits if the write queue is full).
+    if n_render_workers > 1:
+        pool = multiprocessing.Pool(n_render_workers, initializer=init_worker)
+        def get_results():
+            pending = collections.deque()
+            tasks_iter = iter(tasks)
+            for task in itertools.islice(tasks_iter, 2 * n_render_workers):
+                pending.append(pool.apply_async(render_views, (task,)))
+            while pending:
+                result = pending.popleft().get()
+                for task in itertools.islice(tasks_iter, 1):
+                    pending.append(pool.apply_async(render_views, (task,)))
+                yield result
+        results = get_results()
+    else:
+        pool = None
+        init_worker()
+        results = (render_views(task) for task in tasks)
+
+    n_rendered = 0
+    obj_n_done = collections.defaultdict(lambda: 0)
+    t_render_start = time.time()
+    for obj_id, rendered, n_rendered_task in results:
+        if write_errors:
+            raise write_errors[0]
+
+        for im_id, rgb, depth, obj_bb in rendered:
+            obj_gt[obj_id][im_id][0]['obj_bb'] = [int(x) for x in obj_bb]
+            if rgb is not None:
+                write_queue.put((obj_id, im_id, rgb, depth))
+
+        n_rendered += n_rendered_task
+        obj_n_done[obj_id] += 1
+        elapsed = time.time() - t_render_start
+        print('obj: {}, task: {}/{}, rendered views: {}/{}, {:.1f} views/s'.format(
+            obj_id, obj_n_done[obj_id], obj_n_tasks[obj_id], n_rendered,
+            n_views_todo, n_rendered / max(elapsed, 1e-6)))
+
+        # Save metadata (when all views of the object are rendered)
+        if obj_n_done[obj_id] == obj_n_tasks[obj_id]:
+            inout.save_yaml(out_obj_info_path.format(obj_id), obj_info[obj_id])
+            inout.save_yaml(out_obj_gt_path.format(obj_id), obj_gt[obj_id])
+
+    # Wait for the writers
+    for _ in writers:
+        write_queue.put(None)
+    for writer in writers:
+        writer.join()
+    if write_errors:
+        raise write_errors[0]
+
+    if pool is not None:
+        pool.close()
+        pool.join()
+    else:
+        close_worker()
 
-            # Get 2D bounding box of the object model at the ground truth pose
-            ys, xs = np.nonzero(depth > 0)
-            obj_bb = misc.calc_2d_bbox(xs, ys, par['cam']['im_size'])
-
-            obj_info[im_id] = {
-                'cam_K': par['cam']['K'].flatten().tolist(),
-                'view_level': int(views_level[view_id]),
-                #'sphere_radius': float(radius)
-            }
-
-            obj_gt[im_id] = [{
-                'cam_R_m2c': view['R'].flatten().tolist(),
-                'cam_t_m2c': view['t'].flatten().tolist(),
-                'obj_bb': [int(x) for x in obj_bb],
-                'obj_id': int(obj_id)
-            }]
-
-            im_id += 1
-
-    # Save metadata
-    inout.save_yaml(out_obj_info_path.format(obj_id), obj_info)
-    inout.save_yaml(out_obj_gt_path.format(obj_id), obj_gt)
+    elapsed = time.time() - t_render_start
+    print('Rendered views: {}, time: {:.1f}s, {:.1f} views/s'.format(
+        n_rendered, elapsed, n_rendered / max(elapsed, 1e-6)))
+    print('Done ({:.1f}s).'.format(time.time() - t_start))
@@ -10,7 +10,7 @@ import matplotlib.pyplot as plt
 import cv2
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from pysixd import inout, misc, renderer
+from pysixd import inout, misc, renderer, im_cache
 from params.dataset_params import get_dataset_params
 
 # dataset = 'hinterstoisser'
@@ -55,12 +55,19 @@ vis_depth_mpath = '../output/vis_gt_poses_{}/{:02d}/{:04d}_depth_diff.jpg'
 # Whether to consider only the specified subset of images
 use_image_subset = True
 
+# Whether to read the depth images through the cache of decoded images (built
+# from the visualized images; useful only if they are visualized repeatedly)
+use_im_cache = False
+
 # Subset of images to be considered
 if use_image_subset:
     im_ids_sets = inout.load_yaml(dp['test_set_fpath'])
 else:
     im_ids_sets = None
 
+# The images are saved in the background
+im_writer = inout.AsyncImageWriter()
+
 scene_ids_curr = range(1, dp['scene_count'] + 1)
 if scene_ids:
     scene_ids_curr = set(scene_ids_curr).intersection(scene_ids)
@@ -86,15 +93,26 @@ for scene_id in scene_ids_curr:
     if im_ids:
         im_ids_curr = set(im_ids_curr).intersection(im_ids)
 
+    # Cache of the decoded depth images
+    depth_im_cache = None
+    if use_im_cache:
+        depth_im_cache = im_cache.load_scene_cache(
+            dp['scene_im_cache_mpath'].format(scene_id, 'depth'),
+            dp['test_depth_mpath'], scene_id, im_ids_curr)
+
     # Visualize GT poses in the selected images
     for im_id in im_ids_curr:
         print('scene: {}, im: {}'.format(scene_id, im_id))
 
         # Load the images
         rgb = inout.load_im(dp['test_rgb_mpath'].format(scene_id, im_id))
-        depth = inout.load_depth(dp['test_depth_mpath'].format(scene_id, im_id))
-        depth = depth.astype(np.float32) # [mm]
-        depth *= dp['cam']['depth_scale'] # to [mm]
+        if depth_im_cache is not None:
+            depth = depth_im_cache.get_depth(
+                im_id, dp['cam']['depth_scale']) # [mm]
+        else:
+            depth = inout.load_depth(
+                dp['test_depth_mpath'].format(scene_id, im_id),
+                depth_scale=dp['cam']['depth_scale']) # [mm]
 
         # Render the objects at the ground truth poses
         im_size = (depth.shape[1], depth.shape[0])
@@ -168,8 +186,8 @@ for scene_id in scene_ids_curr:
                          0.5 * ren_rgb + \
                          1.0 * ren_rgb_info
             vis_im_rgb[vis_im_rgb > 255] = 255
-            inout.save_im(vis_rgb_mpath.format(dataset, scene_id, im_id),
-                          vis_im_rgb.astype(np.uint8))
+            im_writer.save_im(vis_rgb_mpath.format(dataset, scene_id, im_id),
+                              vis_im_rgb.astype(np.uint8))
 
         # Save image of depth differences
         if vis_depth:
@@ -187,3 +205,5 @@ for scene_id in scene_ids_curr:
             plt.savefig(vis_depth_mpath.format(dataset, scene_id, im_id), pad=0,
                         bbox_inches='tight')
             plt.close()
+
+im_writer.close()
@@ -6,13 +6,13 @@
 import os
 from os.path import join as pjoin
 import sys
-import glob
 import numpy as np
 import matplotlib.pyplot as plt
 import cv2
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from pysixd import inout, misc, renderer
+from pysixd import inout, misc, renderer, model_store, result_stream,\
+    im_cache
 from params.dataset_params import get_dataset_params
 
 #-------------------------------------------------------------------------------
@@ -54,10 +54,17 @@ vis_orig_color = False
 # Object colors (used if vis_orig_colors == False)
 colors = inout.load_yaml('../data/colors.yml')
 
+# Whether to read the depth images through the cache of decoded images (built
+# from the visualized images; useful only if they are visualized repeatedly)
+use_im_cache = False
+
 assert(vis_rgb or vis_depth)
 
 # Visualization
 #-------------------------------------------------------------------------------
+# The images are saved in the background
+im_writer = inout.AsyncImageWriter()
+
 for result_path in result_paths:
     print('Processing: ' + result_path)
 
@@ -83,35 +90,44 @@ for result_path in result_paths:
     print('Loading object models...')
     models = {}
     for obj_id in range(1, dp['obj_count'] + 1):
-        models[obj_id] = inout.load_ply(dp['model_mpath'].format(obj_id))
-
-    # Directories with results for individual scenes
-    scene_dirs = sorted([d for d in glob.glob(os.path.join(result_path, '*'))
-                         if os.path.isdir(d)])
-
-    for scene_dir in scene_dirs:
-        scene_id = int(os.path.basename(scene_dir))
+        models[obj_id] = model_store.load_model(
+            dp['model_mpath'].format(obj_id))
+
+    # Results grouped by images (the results and depth images of the next
+    # images are loaded in the background, the depth images are read from the
+    # cache if it is used)
+    res_units = result_stream.list_results(result_path)
+    depth_mpath = None
+    if vis_depth and not use_im_cache:
+        depth_mpath = dp['test_depth_mpath']
+    ims = result_stream.iter_results(res_units, depth_mpath,
+                                     dp['cam']['depth_scale'])
+
+    scene_id_prev = None
+    res_id = 0
+    for scene_id, im_id, im_res, depth in ims:
 
         # Load info and GT poses for the current scene
-        scene_info = inout.load_info(dp['scene_info_mpath'].format(scene_id))
-        scene_gt = inout.load_gt(dp['scene_gt_mpath'].format(scene_id))
-
-        res_paths = sorted(
-            glob.glob(os.path.join(scene_dir, '*.yml')) +
-            glob.glob(os.path.join(scene_dir, '*.yaml'))
-        )
-        im_id = -1
-        depth_im = None
-        for res_id, res_path in enumerate(res_paths):
-
-            # Parse image ID and object ID from the file name
-            filename = os.path.basename(res_path).split('.')[0]
-            im_id_prev = im_id
-            im_id, obj_id = map(int, filename.split('_'))
-
+        if scene_id != scene_id_prev:
+            scene_info = inout.load_info(
+                dp['scene_info_mpath'].format(scene_id))
+            scene_gt = inout.load_gt(dp['scene_gt_mpath'].format(scene_id))
+            if vis_depth and use_im_cache:
+                depth_im_cache = im_cache.load_scene_cache(
+                    dp['scene_im_cache_mpath'].format(scene_id, 'depth'),
+                    dp['test_depth_mpath'], scene_id,
+                    [u[1] for u in res_units if u[0] == scene_id])
+            scene_id_prev = scene_id
+
+        if vis_depth and use_im_cache:
+            depth = depth_im_cache.get_depth(
+                im_id, dp['cam']['depth_scale']) # [mm]
+
+        for obj_id, ests in im_res:
             if res_id % 10 == 0:
                 print('Processing: {}, {}, {}, {}, {}, {}'.format(
                     method, dataset, test_type, scene_id, im_id, obj_id))
+            res_id += 1
 
             # Colors
             if vis_orig_color:
@@ -130,9 +146,6 @@ for result_path in result_paths:
                 im_size = (rgb.shape[1], rgb.shape[0])
 
             if vis_depth:
-                depth_path = dp['test_depth_mpath'].format(scene_id, im_id)
-                depth = inout.load_depth(depth_path)
-                depth *= dp['cam']['depth_scale'] # to [mm]
                 if im_size:
                     assert(im_size == (depth.shape[1], depth.shape[0]))
                 else:
@@ -144,10 +157,6 @@ for result_path in result_paths:
             # Load camera matrix
             K = scene_info[im_id]['cam_K']
 
-            # Load pose estimates
-            res = inout.load_results_sixd17(res_path)
-            ests = res['ests']
-
             # Sort the estimates by score (in descending order)
             ests_sorted = sorted(enumerate(ests), key=lambda x: x[1]['score'],
                                  reverse=True)
@@ -227,7 +236,7 @@ for result_path in result_paths:
                     result_path=result_path, result_name=result_name,
                     scene_id=scene_id, im_id=im_id, obj_id=obj_id)
                 misc.ensure_dir(os.path.dirname(vis_rgb_path))
-                inout.save_im(vis_rgb_path, vis_im_rgb.astype(np.uint8))
+                im_writer.save_im(vis_rgb_path, vis_im_rgb.astype(np.uint8))
 
             # Save image of depth differences
             if vis_depth:
@@ -251,4 +260,6 @@ for result_path in result_paths:
                 plt.close()
 
     print('')
+
+im_writer.close()
 print('Done.')